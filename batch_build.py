@@ -0,0 +1,158 @@
+# !/usr/bin/env python
+#  encoding: utf-8
+
+"""
+Batch build of the MorphoLex database for several versions of the ELP (dated
+snapshots, segmentation variants) listed in a JSON manifest:
+
+    [
+        {"input": "input/ELP-2016-12-10.csv", "output": "output/2016-12-10",
+         "fix_segmentation": true},
+        {"input": "input/ELP-2016-12-18.csv", "output": "output/2016-12-18"}
+    ]
+
+Relative paths are relative to the manifest. Each entry is built into its own
+output directory: its PRS files, morpho_vars.json and run_report.json. Entries
+with "fix_segmentation" first go through both phases of fix_segmentation.py,
+and the fixed file (FIXED_FILENAME, with segm_to_fix.txt) is what gets built.
+
+The lexicons are processed concurrently by a pool of worker processes, which
+are given the linguistic data (roots, non-roots, prefixes and allomorphs) once,
+when the pool starts. Builds are incremental (see incremental_build.py): an
+entry whose output directory holds the state of a previous run is updated from
+it, and the other entries are updated from the state of the first of them,
+which is built first, since versions of the ELP share most of their rows.
+
+Usage:
+
+    python batch_build.py manifest.json --workers 4
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'utilities'))
+import fix_segmentation
+from incremental_build import STATE_FILENAME, run_incremental_build
+from instrumentation import RunReport
+
+FIXED_FILENAME = 'fixed_segmentations.csv'
+DIFF_FILENAME = 'segm_to_fix.txt'
+REPORT_FILENAME = 'run_report.json'
+
+# Linguistic data shared by the tasks of a worker process, set by init_worker
+_shared = {}
+
+
+def build_task(job, base_dir):
+    """
+    Builds the PRS files of a manifest entry, updating the state saved in
+    base_dir if the output directory has none. Returns the number of morphemes.
+    """
+    report = RunReport('build_morpholex_db')
+    with report.stage('incremental_build') as stage:
+        morpho_vars = run_incremental_build(get_build_input(job), job['output'], base_dir)
+        stage.counters['base_dir'] = base_dir
+    report.counters['morphemes'] = len(morpho_vars)
+    report.save(os.path.join(job['output'], REPORT_FILENAME))
+    with open(os.path.join(job['output'], 'morpho_vars.json'), 'w') as f:
+        json.dump(morpho_vars, f)
+    return len(morpho_vars)
+
+
+def fix_task(job):
+    """
+    Runs fix_segmentation.py on the input of a manifest entry. Returns the
+    number of rows.
+    """
+    os.makedirs(job['output'], exist_ok=True)
+    report = RunReport('fix_segmentation')
+    n_rows = fix_segmentation.fix_elp_file(job['input'], get_build_input(job),
+                                           os.path.join(job['output'], DIFF_FILENAME),
+                                           *_shared['linguistic_data'], report)
+    report.save(os.path.join(job['output'], 'fix_segmentation_report.json'))
+    return n_rows
+
+
+def get_build_input(job):
+    """
+    Returns the path of the file built for a manifest entry.
+    """
+    if job.get('fix_segmentation'):
+        return os.path.join(job['output'], FIXED_FILENAME)
+    return job['input']
+
+
+def init_worker(linguistic_data):
+    _shared['linguistic_data'] = linguistic_data
+
+
+def read_manifest(filepath):
+    """
+    Returns the entries of the manifest at filepath, with absolute paths.
+    """
+    with open(filepath) as f:
+        jobs = json.load(f)
+    manifest_dir = os.path.dirname(os.path.abspath(filepath))
+    for job in jobs:
+        job['input'] = os.path.join(manifest_dir, job['input'])
+        job['output'] = os.path.join(manifest_dir, job['output'])
+    outputs = [job['output'] for job in jobs]
+    if len(set(outputs)) != len(outputs):
+        raise ValueError('Each entry of the manifest needs its own output directory')
+    return jobs
+
+
+def run_batch(jobs, workers, linguistic_data=None):
+    """
+    Fixes and builds the manifest entries jobs with a pool of workers
+    processes. linguistic_data is returned by
+    fix_segmentation.load_linguistic_data, and is only needed if some entries
+    have "fix_segmentation". Returns a list of dicts, one per entry, with the
+    number of fixed rows (if any) and of morphemes.
+    """
+    results = [{'input': job['input'], 'output': job['output']} for job in jobs]
+    with multiprocessing.Pool(workers, init_worker, (linguistic_data,)) as pool:
+        to_fix = [i for i, job in enumerate(jobs) if job.get('fix_segmentation')]
+        for i, n_rows in zip(to_fix, pool.map(fix_task, [jobs[i] for i in to_fix])):
+            results[i]['fixed_rows'] = n_rows
+
+        # Entries without a state of their own wait for the first of them
+        pending = {}
+        seed = None
+        for i, job in enumerate(jobs):
+            if os.path.exists(os.path.join(job['output'], STATE_FILENAME)):
+                pending[i] = pool.apply_async(build_task, (job, None))
+            elif seed is None:
+                seed = i
+                pending[i] = pool.apply_async(build_task, (job, None))
+        if seed is not None:
+            pending[seed].wait()
+            for i, job in enumerate(jobs):
+                if i not in pending:
+                    pending[i] = pool.apply_async(build_task, (job, jobs[seed]['output']))
+        for i, result in pending.items():
+            results[i]['morphemes'] = result.get()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Build the MorphoLex database for every lexicon of a manifest.')
+    parser.add_argument('manifest', help='JSON list of {"input", "output", '
+                                         '"fix_segmentation"} entries')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='number of worker processes')
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+
+    jobs = read_manifest(args.manifest)
+    linguistic_data = None
+    if any(job.get('fix_segmentation') for job in jobs):
+        linguistic_data = fix_segmentation.load_linguistic_data()
+    for result in run_batch(jobs, args.workers, linguistic_data):
+        print(result)
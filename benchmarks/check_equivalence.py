@@ -0,0 +1,489 @@
+# !/usr/bin/env python
+# encoding: utf-8
+
+"""
+Checks that faster engines produce exactly the same numbers as the original
+implementation, and measures how much faster they are.
+
+Build engines are compared with a reference engine, by default the original
+build_morpholex_db.py (see golden.py), on their morpho_vars dict and on every
+row of every PRS file they write:
+
+- naive: the original script, which scans the whole database for each
+  morpheme; slow on large lexicons, where --reference current is faster
+- current: the default path of build_morpholex_db.py (preprocess_db,
+  get_hapax_set, compute_morphological_variables and apply_morpho_vars_to_lex_db)
+- numpy: the columnar engine (columnar_db.py)
+- workers: the process-pool engine (parallel_build.py)
+- stream: the two-pass streaming build (--stream)
+- incremental: --incremental, updating the output of a lexicon with one more
+  row (see run_incremental)
+- out_of_core: the on-disk build (out_of_core.py), which has no morpho_vars,
+  so only its PRS files are compared
+
+The SUBTLEX variables of --corpora are checked against sums computed row by
+row: float frequencies are summed exactly (math.fsum), so they don't depend on
+the order of the rows.
+
+The morpheme index (morpheme_index.py) of the reference is checked against its
+morpho_vars, and its command line against morphemes that are not indexed.
+
+fix_segmentation.py, run in a single process and with a process pool, is
+compared with the passes of the original script (see golden.py) on every fixed
+and allomorph-merged segmentation (columns 48 and 49, and so segm_to_fix.txt).
+
+Values are equal if they are written the same way in the output files, so 0 and
+0.0 differ. With --ulps N, two floats that are at most N units in the last place
+apart are also equal. The first differences are reported by morpheme and by
+word, and the script exits with status 1 if there are any.
+
+Usage:
+
+    python benchmarks/check_equivalence.py --synthetic 20000 --engines numpy workers
+    python benchmarks/check_equivalence.py --input /path/to/ELP.csv --reference current
+"""
+
+import argparse
+import csv
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.join(BENCHMARKS_DIR, '..')
+sys.path.insert(0, PROJECT_DIR)
+sys.path.insert(0, os.path.join(PROJECT_DIR, 'utilities'))
+import build_morpholex_db as bmd
+import fix_segmentation
+import golden
+from allomorphs import load_canonical_forms
+from generate_lexicon import make_vocabulary, write_synthetic_elp
+from incremental_build import run_incremental_build
+
+LINGUISTIC_DATA_DIR = os.path.join(PROJECT_DIR, 'linguistic_data')
+BUILD_ENGINES = ('naive', 'current', 'numpy', 'workers', 'stream', 'incremental',
+                 'out_of_core')
+DEFAULT_ENGINES = ('current', 'numpy', 'workers', 'stream', 'incremental', 'out_of_core')
+MORPHO_VARS_KEYS = ('hal_freq', 'family_size', 'length', 'hal_p', 'hal_p*')
+
+
+def values_equal(a, b, ulps=0):
+    """
+    Returns True if a and b are written the same way, or if they are floats at
+    most ulps units in the last place apart.
+    """
+    if str(a) == str(b):
+        return True
+    if ulps:
+        try:
+            a, b = float(a), float(b)
+        except (TypeError, ValueError):
+            return False
+        return abs(a - b) <= ulps * math.ulp(max(abs(a), abs(b)))
+    return False
+
+
+def compare_morpho_vars(ref, new, ulps=0):
+    """
+    Generates a (MORPHEME, DESCRIPTION) pair for each difference between two
+    morpho_vars dicts, morphemes in alphabetical order.
+    """
+    for m in sorted(set(ref) | set(new)):
+        if m not in new:
+            yield m, 'missing'
+            continue
+        if m not in ref:
+            yield m, 'unexpected'
+            continue
+        for key in MORPHO_VARS_KEYS:
+            if not values_equal(ref[m][key], new[m][key], ulps):
+                yield m, '%s: %r != %r' % (key, ref[m][key], new[m][key])
+        ref_family, new_family = ref[m]['family'], new[m]['family']
+        for segm in sorted(set(ref_family) | set(new_family)):
+            if segm not in new_family:
+                yield m, 'family member %s missing' % segm
+            elif segm not in ref_family:
+                yield m, 'unexpected family member %s' % segm
+            elif not values_equal(ref_family[segm], new_family[segm], ulps):
+                yield m, 'family member %s: %r != %r' % (segm, ref_family[segm],
+                                                         new_family[segm])
+
+
+def compare_prs_files(ref_dir, new_dir, ulps=0):
+    """
+    Generates a (WORD, DESCRIPTION) pair for each difference between the PRS
+    files of two output directories, compared row by row. Other files, such as
+    the state of --incremental, are ignored.
+    """
+    ref_files = {f for f in os.listdir(ref_dir) if f.endswith('.csv')}
+    new_files = {f for f in os.listdir(new_dir) if f.endswith('.csv')}
+    for filename in sorted(ref_files | new_files):
+        if filename not in new_files:
+            yield None, '%s missing' % filename
+            continue
+        if filename not in ref_files:
+            yield None, 'unexpected %s' % filename
+            continue
+        with open(os.path.join(ref_dir, filename)) as f:
+            ref_rows = list(csv.reader(f))
+        with open(os.path.join(new_dir, filename)) as f:
+            new_rows = list(csv.reader(f))
+        headers = ref_rows[0]
+        if new_rows[0] != headers:
+            yield None, '%s: different headers' % filename
+        if len(new_rows) != len(ref_rows):
+            yield None, '%s: %d rows != %d rows' % (filename, len(new_rows) - 1,
+                                                    len(ref_rows) - 1)
+        for ref_row, new_row in zip(ref_rows[1:], new_rows[1:]):
+            word = ref_row[bmd.DB_WORD_COL]
+            if len(new_row) != len(ref_row):
+                yield word, '%s: %d columns != %d columns' % (filename, len(new_row),
+                                                              len(ref_row))
+                continue
+            for i, (a, b) in enumerate(zip(ref_row, new_row)):
+                if not values_equal(a, b, ulps):
+                    column = headers[i] if i < len(headers) else 'column %d' % i
+                    yield word, '%s, %s: %s != %s' % (filename, column, a, b)
+
+
+def check_morpheme_index(morpho_vars, filepath):
+    """
+    Saves the morpheme index of morpho_vars to filepath, and generates a
+    (MORPHEME, DESCRIPTION) pair for each entry that differs from morpho_vars,
+    and for each query of the morpheme_index.py command line about a morpheme
+    that is not in the index (including the empty one) that doesn't print null.
+    """
+    from morpheme_index import MorphemeIndex, build_morpheme_index_file
+    build_morpheme_index_file(filepath, morpho_vars)
+    with MorphemeIndex(filepath) as index:
+        for m in sorted(morpho_vars):
+            entry = index.lookup(m)
+            if entry is None:
+                yield m, 'missing'
+                continue
+            for key, ref_key in (('FamSize', 'family_size'), ('Freq_HAL', 'hal_freq'),
+                                 ('P', 'hal_p'), ('P*', 'hal_p*'), ('length', 'length')):
+                if not values_equal(morpho_vars[m][ref_key], entry[key]):
+                    yield m, '%s: %r != %r' % (key, morpho_vars[m][ref_key], entry[key])
+    for query in ('--morpheme', '--family'):
+        for m in ('', '(notamorpheme)'):
+            process = subprocess.run(
+                [sys.executable, os.path.join(PROJECT_DIR, 'morpheme_index.py'), filepath,
+                 query, m], capture_output=True, text=True)
+            if process.returncode != 0 or process.stdout.strip() != 'null':
+                yield m, '%s: %s' % (query, (process.stdout + process.stderr).strip())
+
+
+def check_corpus_frequencies(filepath, corpus='SUBTLEX'):
+    """
+    Computes the variables of the extra corpus with build_morpholex_db.py
+    --corpora, and generates a (MORPHEME, DESCRIPTION) pair for each frequency,
+    P or P* that differs from the one computed row by row: the math.fsum of
+    the frequencies of the rows that contain the morpheme, in row order.
+    """
+    db = bmd.preprocess_db(bmd.read_lexical_db(filepath))
+    hapax_set = bmd.get_hapax_set(db)
+    hapax_ids = {id(row) for row in hapax_set}
+    morpho_vars = bmd.compute_morphological_variables(db, hapax_set, [corpus])
+    col = bmd.CORPUS_FREQ_COLS[corpus]
+    freqs = {m: [] for m in morpho_vars}
+    hapax_freqs = {m: [] for m in morpho_vars}
+    for row in db:
+        for m in bmd.get_contained_morphemes(row[bmd.DB_SEGM_COL]):
+            if m in freqs:
+                freqs[m].append(row[col])
+                if id(row) in hapax_ids:
+                    hapax_freqs[m].append(row[col])
+    for m in sorted(morpho_vars):
+        c_vars = morpho_vars[m]['corpora'][corpus]
+        freq, hapax_freq = math.fsum(freqs[m]), math.fsum(hapax_freqs[m])
+        expected = {'freq': freq,
+                    'p': hapax_freq / freq if hapax_freq else 0,
+                    'p*': hapax_freq / len(hapax_set) if hapax_freq else 0}
+        for key, value in expected.items():
+            if not values_equal(float(value), float(c_vars[key])):
+                yield m, '%s %s: %r != %r' % (corpus, key, value, c_vars[key])
+
+
+def compare_fixed_segmentations(words, ref, new):
+    """
+    Generates a (WORD, DESCRIPTION) pair for each row whose fixed or
+    allomorph-merged segmentation differs between two runs of fix_segmentation.
+    """
+    for i, (word, (ref_new, ref_allo), (new_new, new_allo)) in enumerate(zip(words, ref, new)):
+        if ref_new != new_new:
+            yield word, 'row %d, MorphoLexSegm: %s != %s' % (i, ref_new, new_new)
+        if ref_allo != new_allo:
+            yield word, 'row %d, MorphoLexSegmMerged: %s != %s' % (i, ref_allo, new_allo)
+    if len(new) != len(ref):
+        yield None, '%d rows != %d rows' % (len(new), len(ref))
+
+
+def run_current(filepath, output_dir, workers):
+    db = bmd.preprocess_db(bmd.read_lexical_db(filepath))
+    hapax_set = bmd.get_hapax_set(db)
+    morpho_vars = bmd.compute_morphological_variables(db, hapax_set)
+    new_data_by_prs = bmd.apply_morpho_vars_to_lex_db(db, morpho_vars)
+    bmd.save_prs_data_to_files(((prs, row) for prs, data in new_data_by_prs.items()
+                                for row in data), output_dir)
+    return morpho_vars
+
+
+def run_golden_fix_segmentation(filepath, extra_roots=(), extra_prefixes=()):
+    """
+    Same as run_fix_segmentation, with the passes of the original
+    fix_segmentation.py.
+    """
+    roots, non_roots, prefixes = read_linguistic_data(extra_roots, extra_prefixes)
+    with open(filepath) as f:
+        elp = list(csv.reader(f))[2:]  # skip headers (2 rows)
+    words = [row[fix_segmentation.WORD_COL] for row in elp]
+    new_segms, allo_segms = golden.fix_segmentations(
+        [row[fix_segmentation.SEGM_COL] for row in elp], words, roots, non_roots, prefixes,
+        LINGUISTIC_DATA_DIR)
+    return words, list(zip(new_segms, allo_segms))
+
+
+def run_naive(filepath, output_dir, workers):
+    return golden.build(filepath, output_dir)
+
+
+def run_incremental(filepath, output_dir, workers):
+    """
+    Runs --incremental on a copy of filepath with an extra hapax row, alone in
+    its PRS signature, then on filepath itself: the update removes that row's
+    PRS file while the size of the hapax set changes.
+    """
+    with open(filepath) as f:
+        rows = list(csv.reader(f))
+    extra = list(rows[-1])
+    extra[bmd.DB_ITEMID_COL] = 'incremental-extra'
+    extra[bmd.DB_WORD_COL] = 'incrementalextra'
+    extra[bmd.DB_HAL_FREQ_COL] = '0'
+    extra[bmd.DB_SBTL_FREQ_COL] = '0'
+    extra[bmd.DB_SEGM_COL] = '<a<<b<<c<<d<<e<<f<<g<(incrementalextra)'
+    previous_filepath = os.path.join(os.path.dirname(output_dir), 'incremental_previous.csv')
+    with open(previous_filepath, 'w', newline='') as f:
+        csv.writer(f).writerows(rows + [extra])
+    run_incremental_build(previous_filepath, output_dir)
+    return run_incremental_build(filepath, output_dir)
+
+
+def run_numpy(filepath, output_dir, workers):
+    from columnar_db import (apply_morpho_vars_to_columns, load_columns,
+                             compute_morphological_variables_columnar)
+    columns = load_columns(bmd.stream_lexical_db(filepath))
+    morpho_vars = compute_morphological_variables_columnar(columns)
+    new_data_by_prs = apply_morpho_vars_to_columns(columns, morpho_vars)
+    bmd.save_prs_data_to_files(((prs, row) for prs, data in new_data_by_prs.items()
+                                for row in data), output_dir)
+    return morpho_vars
+
+
+def run_workers(filepath, output_dir, workers):
+    from parallel_build import (apply_morpho_vars_to_lex_db_parallel,
+                                compute_morphological_variables_parallel)
+    db = bmd.preprocess_db(bmd.read_lexical_db(filepath))
+    hapax_set = bmd.get_hapax_set(db)
+    morpho_vars = compute_morphological_variables_parallel(db, hapax_set, workers)
+    new_data_by_prs = apply_morpho_vars_to_lex_db_parallel(db, morpho_vars, workers)
+    bmd.save_prs_data_to_files(((prs, row) for prs, data in new_data_by_prs.items()
+                                for row in data), output_dir)
+    return morpho_vars
+
+
+def run_stream(filepath, output_dir, workers):
+    segm_freqs, segm_hapax_freqs, n_hapax = bmd.aggregate_segmentations(
+        bmd.stream_lexical_db(filepath))
+    index = bmd.index_segmentations(segm_freqs, segm_hapax_freqs)
+    morpho_vars = bmd.get_morpho_vars_from_index(index, n_hapax)
+    bmd.save_prs_data_to_files(bmd.iter_morpho_vars_rows(bmd.stream_lexical_db(filepath),
+                                                         morpho_vars), output_dir)
+    return morpho_vars
+
+
+def run_out_of_core(filepath, output_dir, workers):
+    from out_of_core import build_out_of_core
+    build_out_of_core(filepath, output_dir)
+    return None
+
+
+def run_fix_segmentation(filepath, workers, extra_roots=(), extra_prefixes=()):
+    """
+    Runs both phases of fix_segmentation.py on filepath with the roots and
+    prefixes of linguistic_data (and the given extra ones), and returns the
+    words and the list of (FIXED_SEGM, ALLOMORPH_MERGED_SEGM) of the rows.
+    """
+    free_roots, _ = fix_segmentation.find_roots(filepath)
+    roots, non_roots, prefixes = read_linguistic_data(extra_roots, extra_prefixes)
+    roots = roots.union(free_roots) - non_roots
+    canonical_forms = load_canonical_forms(LINGUISTIC_DATA_DIR)
+
+    words = []
+    fixed = []
+    with open(filepath) as f:
+        reader = csv.reader(f)
+        next(reader)  # skip headers (2 rows)
+        next(reader)
+        chunks = fix_segmentation.iter_chunks(reader, fix_segmentation.CHUNK_SIZE)
+        for chunk, (new_segms, allo_segms) in fix_segmentation.map_fix_chunk(
+                chunks, workers, (roots, prefixes, canonical_forms)):
+            words.extend(row[fix_segmentation.WORD_COL] for row in chunk)
+            fixed.extend(zip(new_segms, allo_segms))
+    return words, fixed
+
+
+def read_linguistic_data(extra_roots=(), extra_prefixes=()):
+    """
+    Returns the roots, non-roots and prefixes sets of linguistic_data, with the
+    given extra roots and prefixes.
+    """
+    roots = read_lines(os.path.join(LINGUISTIC_DATA_DIR, 'roots.txt'))
+    roots.update(extra_roots)
+    non_roots = read_lines(os.path.join(LINGUISTIC_DATA_DIR, 'non_roots.txt'))
+    prefixes = read_lines(os.path.join(LINGUISTIC_DATA_DIR, 'prefixes.txt'))
+    prefixes.update(extra_prefixes)
+    return roots, non_roots, prefixes
+
+
+def read_lines(filepath):
+    """
+    Returns the set of lines of filepath, or an empty set if it doesn't exist.
+    """
+    if not os.path.exists(filepath):
+        return set()
+    with open(filepath) as f:
+        return set(f.read().split('\n'))
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def report_differences(label, differences, max_differences):
+    """
+    Prints the first max_differences differences, and returns their total
+    number.
+    """
+    n = 0
+    for key, description in differences:
+        if n < max_differences:
+            print('    %s%s' % ('' if key is None else '%s: ' % key, description))
+        n += 1
+    if n > max_differences:
+        print('    ... and %d more' % (n - max_differences))
+    print('  %s: %s' % (label, 'identical' if n == 0 else '%d differences' % n))
+    return n
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compare engines with the original implementation.')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--input', default=None,
+                        help='ELP CSV file (default: DB_PATH of build_morpholex_db.py)')
+    source.add_argument('--synthetic', type=int, default=None, metavar='ROWS',
+                        help='generate a synthetic lexicon of this many rows instead '
+                             '(see generate_lexicon.py)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of --synthetic')
+    parser.add_argument('--engines', nargs='*', choices=BUILD_ENGINES,
+                        default=list(DEFAULT_ENGINES), help='build engines to check')
+    parser.add_argument('--reference', choices=BUILD_ENGINES, default='naive',
+                        help='build engine the others are compared with (default: naive, '
+                             'the original script)')
+    parser.add_argument('--no-fix', action='store_true',
+                        help="don't check fix_segmentation.py")
+    parser.add_argument('--workers', type=int, default=max(2, os.cpu_count() or 1),
+                        help='number of processes of the parallel engines')
+    parser.add_argument('--ulps', type=int, default=0,
+                        help='tolerated distance between floats, in units in the '
+                             'last place (default: exact)')
+    parser.add_argument('--max-differences', type=int, default=10,
+                        help='number of differences printed per comparison')
+    parser.add_argument('--json', default=None, help='save the results to this file')
+    args = parser.parse_args()
+
+    report = {'python': platform.python_version(), 'workers': args.workers,
+              'ulps': args.ulps, 'reference': args.reference, 'build': [], 'fix_segmentation': None}
+    n_differences = 0
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        extra_roots, extra_prefixes = (), ()
+        if args.synthetic is not None:
+            filepath = os.path.join(tmp_dir, 'lexicon.csv')
+            write_synthetic_elp(filepath, args.synthetic, seed=args.seed)
+            vocabulary = make_vocabulary(100, 5000, 200, args.seed)
+            extra_roots, extra_prefixes = vocabulary['roots'], vocabulary['prefixes']
+        else:
+            filepath = args.input or bmd.DB_PATH
+        report['input'] = filepath if args.synthetic is None else 'synthetic:%d:%d' % (
+            args.synthetic, args.seed)
+
+        ref_dir = os.path.join(tmp_dir, 'reference')
+        ref_vars, ref_seconds = timed(globals()['run_' + args.reference], filepath, ref_dir,
+                                      args.workers)
+        print('%s (reference): %.3f s' % (args.reference, ref_seconds))
+        for engine in args.engines:
+            if engine == args.reference:
+                continue
+            output_dir = os.path.join(tmp_dir, engine)
+            morpho_vars, seconds = timed(globals()['run_' + engine], filepath, output_dir,
+                                         args.workers)
+            print('%s: %.3f s (speedup %.2fx)' % (engine, seconds, ref_seconds / seconds))
+            result = {'engine': engine, 'seconds': seconds,
+                      'speedup': ref_seconds / seconds}
+            # out_of_core has no morpho_vars: only its PRS files are compared
+            if morpho_vars is not None and ref_vars is not None:
+                result['morpho_vars_differences'] = report_differences(
+                    'morpho_vars', compare_morpho_vars(ref_vars, morpho_vars, args.ulps),
+                    args.max_differences)
+            result['row_differences'] = report_differences(
+                'PRS files', compare_prs_files(ref_dir, output_dir, args.ulps),
+                args.max_differences)
+            n_differences += (result.get('morpho_vars_differences', 0)
+                              + result['row_differences'])
+            report['build'].append(result)
+        report['reference_seconds'] = ref_seconds
+
+        print('--corpora SUBTLEX, compared row by row')
+        report['corpus_differences'] = report_differences(
+            'SUBTLEX variables', check_corpus_frequencies(filepath), args.max_differences)
+        n_differences += report['corpus_differences']
+
+        if ref_vars is not None:
+            print('morpheme index of %s' % args.reference)
+            report['morpheme_index_differences'] = report_differences(
+                'entries',
+                check_morpheme_index(ref_vars, os.path.join(tmp_dir, 'morphemes.index')),
+                args.max_differences)
+            n_differences += report['morpheme_index_differences']
+
+        if not args.no_fix:
+            (words, ref_fixed), ref_seconds = timed(run_golden_fix_segmentation, filepath,
+                                                    extra_roots, extra_prefixes)
+            print('fix_segmentation, original (reference): %.3f s' % ref_seconds)
+            report['fix_segmentation'] = {'reference_seconds': ref_seconds, 'runs': []}
+            for workers in sorted({1, args.workers}):
+                (_, fixed), seconds = timed(run_fix_segmentation, filepath, workers,
+                                            extra_roots, extra_prefixes)
+                print('fix_segmentation, %d process(es): %.3f s (speedup %.2fx)' % (
+                    workers, seconds, ref_seconds / seconds))
+                differences = report_differences(
+                    'segmentations', compare_fixed_segmentations(words, ref_fixed, fixed),
+                    args.max_differences)
+                n_differences += differences
+                report['fix_segmentation']['runs'].append({'workers': workers,
+                                                           'seconds': seconds,
+                                                           'speedup': ref_seconds / seconds,
+                                                           'differences': differences})
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    sys.exit(1 if n_differences else 0)
@@ -0,0 +1,198 @@
+# !/usr/bin/env python
+# encoding: utf-8
+
+"""
+Writes synthetic lexicons in the format of the ELP CSV file, to benchmark the
+pipeline at sizes the real database doesn't reach.
+
+The file has the two header rows of the ELP file, and the columns read by the
+pipeline at the same positions: ItemID, word and POS (0-2), HAL frequency (25),
+SUBTLEX frequency (27), the raw segmentations read by fix_segmentation.py
+(46-47) and the MorphoLex segmentations (48-49). Other columns are filler.
+
+Morphemes are pseudo-words built from random syllables. Each word draws its
+prefixes, roots and suffixes from the vocabulary with Zipfian probabilities,
+and HAL frequencies follow Zipf's law over the rows of the lexicon, so that
+family sizes and hapax sets have realistic shapes.
+
+Usage:
+
+    python benchmarks/generate_lexicon.py 100000 lexicon.csv --roots 20000
+"""
+
+import argparse
+import csv
+import itertools
+import random
+
+N_COLUMNS = 50
+ITEMID_COL = 0
+WORD_COL = 1
+POS_COL = 2
+HAL_FREQ_COL = 25
+SBTL_FREQ_COL = 27
+RAW_SEGM_COLS = (46, 47)
+SEGM_COLS = (48, 49)
+
+ZIPF_EXPONENT = 1.0
+MAX_HAL_FREQ = 10000000
+# SUBTLEX frequencies are per million words, HAL frequencies are raw counts
+SBTL_PER_HAL = 0.01
+NULL_SBTL_RATE = 0.1
+NULL_SEGM_RATE = 0.05
+INFLECTED_RATE = 0.2
+# Rounds of the Feistel network that permutes the frequency ranks
+PERMUTATION_ROUNDS = 4
+
+POS_TAGS = ('NN', 'VB', 'JJ', 'RB', 'NN|VB', 'JJ|NN')
+INFLECTIONS = ('s', 'ed', 'ing')
+CONSONANTS = 'bcdfghjklmnprstvwz'
+VOWELS = 'aeiouy'
+# Number of morphemes of each role in a word, and their relative weights
+N_PREFIXES = ((0, 6), (1, 3), (2, 1))
+N_ROOTS = ((1, 8), (2, 2))
+N_SUFFIXES = ((0, 3), (1, 4), (2, 2), (3, 1))
+
+
+def make_vocabulary(n_prefixes, n_roots, n_suffixes, seed=0):
+    """
+    Returns a dict {ROLE: [MORPH, ...]} for the 'prefixes', 'roots' and
+    'suffixes' roles, with distinct pseudo-words in each role. The vocabulary
+    only depends on its arguments.
+    """
+    rand = random.Random(seed)
+    seen = set()
+
+    def make_morphs(n, min_syllables, max_syllables):
+        morphs = []
+        while len(morphs) < n:
+            m = ''.join(rand.choice(CONSONANTS) + rand.choice(VOWELS)
+                        for _ in range(rand.randint(min_syllables, max_syllables)))
+            if m not in seen:
+                seen.add(m)
+                morphs.append(m)
+        return morphs
+
+    # Inflections must not be mistaken for derivational suffixes
+    seen.update(INFLECTIONS)
+    return {'prefixes': make_morphs(n_prefixes, 1, 2),
+            'roots': make_morphs(n_roots, 2, 4),
+            'suffixes': make_morphs(n_suffixes, 1, 2)}
+
+
+def write_synthetic_elp(filepath, n_rows, n_prefixes=100, n_roots=5000, n_suffixes=200,
+                        seed=0):
+    """
+    Writes a synthetic lexicon of n_rows rows to filepath. Rows are generated
+    one at a time, so memory use doesn't depend on n_rows.
+    """
+    rand = random.Random(seed)
+    vocabulary = make_vocabulary(n_prefixes, n_roots, n_suffixes, seed)
+    cum_weights = {role: _zipf_cum_weights(len(morphs))
+                   for role, morphs in vocabulary.items()}
+
+    def draw(role, counts):
+        n = rand.choices([c for c, _ in counts], [w for _, w in counts])[0]
+        return rand.choices(vocabulary[role], cum_weights=cum_weights[role], k=n)
+
+    # Frequency rank of each row
+    get_rank = _make_rank_permutation(rand, n_rows)
+
+    with open(filepath, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Column%d' % i for i in range(N_COLUMNS)])
+        writer.writerow(['-'] * N_COLUMNS)
+        for i in range(n_rows):
+            rank = get_rank(i)
+            prefixes = draw('prefixes', N_PREFIXES)
+            roots = draw('roots', N_ROOTS)
+            suffixes = draw('suffixes', N_SUFFIXES)
+            inflection = rand.choice(INFLECTIONS) if rand.random() < INFLECTED_RATE else None
+
+            hal_freq = int(MAX_HAL_FREQ * rank ** -ZIPF_EXPONENT)
+            if rand.random() < NULL_SBTL_RATE:
+                sbtl_freq = 'NULL'
+            else:
+                sbtl_freq = '%.2f' % (hal_freq * SBTL_PER_HAL * rand.lognormvariate(0, 1))
+
+            row = ['0'] * N_COLUMNS
+            row[ITEMID_COL] = str(i + 1)
+            row[WORD_COL] = ''.join(prefixes + roots + suffixes) + (inflection or '')
+            row[POS_COL] = rand.choice(POS_TAGS)
+            row[HAL_FREQ_COL] = str(hal_freq)
+            row[SBTL_FREQ_COL] = sbtl_freq
+            raw_segm = _make_raw_segmentation(rand, prefixes, roots, suffixes, inflection)
+            for col in RAW_SEGM_COLS:
+                row[col] = raw_segm
+            segm = (''.join('<%s<' % p for p in prefixes)
+                    + ''.join('(%s)' % r for r in roots)
+                    + ''.join('>%s>' % s for s in suffixes))
+            for col in SEGM_COLS:
+                row[col] = 'NULL' if rand.random() < NULL_SEGM_RATE else segm
+            writer.writerow(row)
+
+
+def _make_raw_segmentation(rand, prefixes, roots, suffixes, inflection):
+    """
+    Returns an under-annotated segmentation, in one of the styles of the
+    MorphSp column of the ELP.
+    """
+    suffixes = suffixes + [inflection] if inflection else suffixes
+    k = rand.random()
+    if k < 0.3:
+        # Annotated affixes, unmarked roots: <re<{act}>ion>
+        return (''.join('<%s<' % p for p in prefixes)
+                + ''.join('{%s}' % r for r in roots)
+                + ''.join('>%s>' % s for s in suffixes))
+    elif k < 0.6:
+        # Dashed sequence: {re--act--ion}
+        return '{%s}' % '--'.join(prefixes + roots + suffixes)
+    elif k < 0.8:
+        # Unsegmented
+        return '{%s}' % ''.join(prefixes + roots + suffixes)
+    else:
+        # Unmarked prefixes and roots: {re}{act}>ion>
+        return (''.join('{%s}' % m for m in prefixes + roots)
+                + ''.join('>%s>' % s for s in suffixes))
+
+
+def _make_rank_permutation(rand, n):
+    """
+    Returns a function that maps each row number in range(n) to a distinct
+    frequency rank in range(1, n + 1), without storing the permutation. A
+    Feistel network keyed by rand permutes the numbers below a power of 4 that
+    is at least n, and is applied again to numbers that fall outside range(n)
+    (cycle walking), which stays a permutation of range(n).
+    """
+    half_bits = max(1, ((n - 1).bit_length() + 1) // 2)
+    mask = (1 << half_bits) - 1
+    keys = [rand.getrandbits(32) for _ in range(PERMUTATION_ROUNDS)]
+
+    def get_rank(i):
+        while True:
+            left, right = i >> half_bits, i & mask
+            for key in keys:
+                left, right = right, left ^ ((((right * 0x9E3779B1) ^ key) * 0x85EBCA6B >> 7)
+                                             & mask)
+            i = (left << half_bits) | right
+            if i < n:
+                return i + 1
+
+    return get_rank
+
+
+def _zipf_cum_weights(n):
+    return list(itertools.accumulate(rank ** -ZIPF_EXPONENT for rank in range(1, n + 1)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic ELP-format lexicon.')
+    parser.add_argument('rows', type=int, help='number of rows')
+    parser.add_argument('output', help='path of the CSV file to write')
+    parser.add_argument('--prefixes', type=int, default=100, help='number of prefixes')
+    parser.add_argument('--roots', type=int, default=5000, help='number of roots')
+    parser.add_argument('--suffixes', type=int, default=200, help='number of suffixes')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    write_synthetic_elp(args.output, args.rows, args.prefixes, args.roots, args.suffixes,
+                        args.seed)
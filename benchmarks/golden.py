@@ -0,0 +1,306 @@
+# !/usr/bin/env python
+# encoding: utf-8
+
+"""
+The original, pass-by-pass implementations of build_morpholex_db.py and
+fix_segmentation.py, kept as the golden reference of check_equivalence.py.
+
+Every optimized engine must reproduce their output exactly, so this code must
+not be optimized or refactored: it is the definition of the expected output.
+Only the configuration (columns, hapax thresholds) is shared with the
+pipeline. The build scans the whole database for each morpheme, so it is slow
+on large lexicons.
+"""
+
+import csv
+import json
+import os
+import re
+
+from build_morpholex_db import (DB_HAL_FREQ_COL, DB_ITEMID_COL, DB_POS_COL,
+                                DB_SBTL_FREQ_COL, DB_SEGM_COL, DB_WORD_COL,
+                                HAPAX_HAL_FREQ_THRESHOLD, HAPAX_SBTL_FREQ_THRESHOLD)
+
+
+############################
+### build_morpholex_db.py ###
+############################
+
+def apply_morpho_vars_to_lex_db(db, morpho_vars):
+    res = {}
+    for row in db:
+        segm = row[DB_SEGM_COL]
+        if segm == "NULL":
+            continue
+        prs = get_PRS_signature(row[DB_SEGM_COL])
+        if prs not in res.keys():
+            res[prs] = []
+        morphemes = get_morphemes(segm)
+        n_morphemes = len(morphemes)
+        prs_string = ','.join([str(x) for x in prs])
+        temp = [row[DB_ITEMID_COL], row[DB_WORD_COL], row[DB_POS_COL],
+                n_morphemes, prs_string, segm]
+        # Any morpheme would do, we use the first.
+        freq = morpho_vars[morphemes[0]]['family'][segm] if morphemes else None
+        for m in morphemes:
+            ffr = get_family_frequency_rank(freq, morpho_vars[m]['family'])
+            pfmf = get_percentage_family_more_frequent(freq, morpho_vars[m]['family'])
+            m_vars = [ffr,
+                      pfmf,
+                      morpho_vars[m]['family_size'],
+                      morpho_vars[m]['hal_freq'],
+                      morpho_vars[m]['hal_p'],
+                      morpho_vars[m]['hal_p*'],
+                      morpho_vars[m]['length']]
+            temp.extend(m_vars)
+        res[prs].append(temp)
+
+    return res
+
+
+def build(db_path, output_dir):
+    """
+    Writes the PRS files of the database at db_path to output_dir, like the
+    original script, and returns the morpho_vars dict.
+    """
+    with open(db_path) as database:
+        db = [x for x in list(csv.reader(database))[2:] if x]  # skip headers (2 rows)
+    db = preprocess_db(db)
+    hapax_set = get_hapax_set(db)
+    morpho_vars = compute_morphological_variables(db, hapax_set)
+    new_data_by_prs = apply_morpho_vars_to_lex_db(db, morpho_vars)
+
+    os.makedirs(output_dir, exist_ok=True)
+    headers = ['ELP_ItemID', 'Word', 'POS', 'Nmorph', 'PRS_signature',
+               'MorphoLexSegm']
+    for prs, data in new_data_by_prs.items():
+        prs_str = re.sub(r'[,()]', '', str(prs))
+        savepath = os.path.join(output_dir, '%s.csv' % prs_str)
+        with open(savepath, 'w') as f:
+            csvwriter = csv.writer(f)
+            csvwriter.writerow(headers + generate_headers(prs))
+            csvwriter.writerows(data)
+    return morpho_vars
+
+
+def compute_morphological_variables(db, hapax_set):
+    morpho_vars = {}
+    counted = set()
+
+    for i, row in enumerate(db):
+        segm = row[DB_SEGM_COL]
+        morphemes = get_morphemes(segm)
+        for m in [x for x in morphemes if x not in counted]:
+            counted.add(m)
+            freq = total_morpheme_freq(m, db)
+            family = get_family(m, db)
+            morpho_vars[m] = {'hal_freq': freq}
+            morpho_vars[m]['family'] = family
+            morpho_vars[m]['family_size'] = len(family)
+            morpho_vars[m]['length'] = len(m) - 2  # -2 because every morpheme is surrounded by brackets
+
+            hapax_freq = total_morpheme_freq(m, hapax_set)
+            if hapax_freq == 0:
+                morpho_vars[m]['hal_p'] = 0
+                morpho_vars[m]['hal_p*'] = 0
+            else:
+                morpho_vars[m]['hal_p'] = hapax_freq / freq
+                morpho_vars[m]['hal_p*'] = hapax_freq / len(hapax_set)
+
+    return morpho_vars
+
+
+def generate_headers(prs):
+    p, r, s = int(prs[0]), int(prs[1]), int(prs[2])
+    headers = []
+    for i in range(1, p+1):
+        headers.extend(['PREF%d_FFR' % i, 'PREF%d_PFMF' % i,
+                        'PREF%d_FamSize' % i, 'PREF%d_Freq_HAL' % i,
+                        'PREF%d_P' % i, 'PREF%d_P*' % i, 'PREF%d_length' % i
+                        ])
+    for i in range(1, r+1):
+        headers.extend(['ROOT%d_FFR' % i, 'ROOT%d_PFMF' % i,
+                        'ROOT%d_FamSize' % i, 'ROOT%d_Freq_HAL' % i,
+                        'ROOT%d_P' % i, 'ROOT%d_P*' % i, 'ROOT%d_length' % i
+                        ])
+    for i in range(1, s+1):
+        headers.extend(['SUFF%d_FFR' % i, 'SUFF%d_PFMF' % i,
+                        'SUFF%d_FamSize' % i, 'SUFF%d_Freq_HAL' % i,
+                        'SUFF%d_P' % i, 'SUFF%d_P*' % i, 'SUFF%d_length' % i
+                        ])
+    return headers
+
+
+def get_family(morpheme, db):
+    family = {}
+    for row in db:
+        segm = row[DB_SEGM_COL]
+        if morpheme in segm:
+            if segm not in family:
+                family[segm] = 0
+            family[segm] += row[DB_HAL_FREQ_COL]
+    return family
+
+
+def get_hapax_set(db):
+    hapax = []
+    for row in db:
+        if row[DB_HAL_FREQ_COL] <= HAPAX_HAL_FREQ_THRESHOLD:
+            hapax.append(row)
+        elif row[DB_SBTL_FREQ_COL] <= HAPAX_SBTL_FREQ_THRESHOLD:
+            hapax.append(row)
+    return hapax
+
+
+def get_morphemes(segm):
+    if segm == 'NULL':
+        raise Exception("NULL segmentation!")
+    return re.findall(r'[<>(][^><)]+?[<>)]', segm)
+
+
+def get_PRS_signature(segm):
+    n_pref = int(segm.count('<') / 2)
+    n_root = segm.count('(')
+    n_suff = int(segm.count('>') / 2)
+    return (n_pref, n_root, n_suff)
+
+
+def get_percentage_family_more_frequent(word_freq, family):
+    if len(family) == 1:
+        return 0
+    fam_more_freq = sum([1 for x in family.values() if x > word_freq])
+    return (fam_more_freq / (len(family)-1)) * 100
+
+
+def get_family_frequency_rank(word_freq, family):
+    return sum([1 for x in family.values() if x > word_freq]) + 1
+
+
+def preprocess_db(db):
+    valid_db_subset = [x for x in db if x[DB_SEGM_COL] != 'NULL']
+    for row in valid_db_subset:
+        if row[DB_SBTL_FREQ_COL] != 'NULL':
+            row[DB_SBTL_FREQ_COL] = float(row[DB_SBTL_FREQ_COL])
+        else:
+            row[DB_SBTL_FREQ_COL] = 0
+        row[DB_HAL_FREQ_COL] = int(row[DB_HAL_FREQ_COL])
+    return valid_db_subset
+
+
+def total_morpheme_freq(morpheme, db):
+    total_freq_hal = 0
+    for row in db:
+        if morpheme in row[DB_SEGM_COL]:
+            total_freq_hal += row[DB_HAL_FREQ_COL]
+    return total_freq_hal
+
+
+###########################
+### fix_segmentation.py ###
+###########################
+
+def fix_segmentations(segms, words, roots, non_roots, prefixes, linguistic_data_dir):
+    """
+    Applies the passes of the original fix_segmentation.py to the list of
+    MorphSp_revised segmentations segms, and returns the list of fixed
+    segmentations and the list of their allomorph-merged versions. roots,
+    non_roots and prefixes are the sets read from linguistic_data, and the
+    allomorphs are read from the allomorphs_*.json files of linguistic_data_dir,
+    the same source as the engine's (see load_reverse_lookup).
+    """
+    new_segm = list(segms)
+
+    # 1. Remove non-derivational suffixes: ed/d, ing, s, and contractions like 'll, 's, etc.
+    new_segm = [re.sub(r">(ed|d|ing|s|\w*'\w*)>$", '', segm) for segm in new_segm]
+
+    ### Build the set of roots ###
+    free_roots = [re.sub(r'[{}]', '', x) for i, x in enumerate(new_segm)
+                  if not re.search(r'([<>-]|\}\{)', x)
+                     and len(x) > 5
+                     and not words[i][0].isupper()]
+    roots = roots.union(set(free_roots)) - set(non_roots)
+
+    ### Correctly annotate roots ###
+    for i, segm in enumerate(new_segm):
+        rts = [x for x in re.findall(r'[<>{}-](.+?)[<>{}-]', segm) if x in roots]
+        for r in rts:
+            new_segm[i] = new_segm[i].replace(r, '('+r+')')
+
+    # Remove affix notation where we changed to root notation
+    new_segm = [re.sub(r'[><](\(\w+?\))[><]', r'\1', x) for x in new_segm]
+
+    ### Correctly annotate prefixes marked as roots ###
+    for i, segm in enumerate(new_segm):
+        pfs = [x for x in re.findall(r'\{(.+?)\}', segm)
+               if x in prefixes and segm.count('{') > 1]
+        for p in pfs:
+            new_segm[i] = new_segm[i].replace('{'+p+'}', '<'+p+'<')
+
+    # Annotate suffixes between curly brackets
+    for i, segm in enumerate(new_segm):
+        suffs_sequence = ''.join([x[0] for x in re.findall(r'\)((--\w+)*--\w+)', segm)])
+        suffs = re.findall(r'--\w+', suffs_sequence)
+        for suff in suffs:
+            new_segm[i] = rreplace(new_segm[i], suff, '>'+suff+'>', 1)
+
+    # Annotate prefixes between curly brackets
+    for i, segm in enumerate(new_segm):
+        prefs = re.findall(r'(\w+--)(?=[^\)\}]*\()', segm)
+        for pref in prefs:
+            new_segm[i] = new_segm[i].replace(pref, '<'+pref+'<', 1)
+
+    # Remove dashes
+    new_segm = [x.replace('-', '') for x in new_segm]
+
+    # Any uninterrupted alphabetic sequence between curly brackets not marked as root
+    # must be marked as root
+    new_segm = [re.sub(r'\{(\w+)\}', r'{(\1)}', x) for x in new_segm]
+
+    # Inflectional affixes identified inside words
+    new_segm = [re.sub(r">(ed|d|ing|s|\w*'\w*)>", '', segm) for segm in new_segm]
+
+    ### Allomorph merging step ###
+    allo_prefs = load_reverse_lookup(os.path.join(linguistic_data_dir, 'allomorphs_prefixes.json'))
+    allo_roots = load_reverse_lookup(os.path.join(linguistic_data_dir, 'allomorphs_roots.json'))
+    allo_suffs = load_reverse_lookup(os.path.join(linguistic_data_dir, 'allomorphs_suffixes.json'))
+
+    allo_segm = new_segm[:]
+    for i, segm in enumerate(new_segm):
+        prefs = re.findall(r'<(\w+)<', segm)
+        rts = re.findall(r'\((\w+)\)', segm)
+        suffs = re.findall(r'>(\w+)>', segm)
+        for p in prefs:
+            if p in allo_prefs:
+                allo_segm[i] = allo_segm[i].replace('<'+p+'<', '<'+allo_prefs[p]+'<')
+        for r in rts:
+            if r in allo_roots:
+                allo_segm[i] = allo_segm[i].replace('('+r+')', '('+allo_roots[r]+')')
+        for s in suffs:
+            if s in allo_suffs:
+                allo_segm[i] = rreplace(allo_segm[i], '>'+s+'>', '>'+allo_suffs[s]+'>', 1)
+
+    return new_segm, allo_segm
+
+
+def load_reverse_lookup(input_fp):
+    """
+    Reads a json file with {"key1":["value1", "value2", ...]} pairs and returns
+    the reverse lookup {"value1":"key", "value2":"key"}, as the original
+    utilities/build_allomorphs_reverse_lookup.py wrote it to the
+    rev_allomorphs_*.json files.
+    """
+    with open(input_fp) as f:
+        allos = json.load(f)
+
+    reverse = {}
+
+    for k, values in allos.items():
+        for v in values:
+            reverse[v] = k
+
+    return reverse
+
+
+def rreplace(s, old, new, count):
+    """ Replaces only the rightmost occurrence of old in string s, count times."""
+    return (s[::-1].replace(old[::-1], new[::-1], count))[::-1]
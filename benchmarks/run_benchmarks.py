@@ -0,0 +1,239 @@
+# !/usr/bin/env python
+# encoding: utf-8
+
+"""
+Times each stage of the pipeline on synthetic lexicons of increasing size (see
+generate_lexicon.py), and reports the wall time and the peak memory allocated
+by each stage.
+
+Stages of build_morpholex_db.py: read_lexical_db, preprocess_db,
+get_hapax_set, compute_morphological_variables, apply_morpho_vars_to_lex_db and
+save_prs_data_to_files. With --workers, compute_morphological_variables_parallel
+(parallel_build.py) is also timed with each number of worker processes, to
+measure how it scales with the number of cores.
+Stages of fix_segmentation.py: reading the CSV file, remove_final_inflection,
+find_free_roots, the annotation passes (compile_annotator) and allomorph
+canonicalization.
+
+Usage:
+
+    python benchmarks/run_benchmarks.py --sizes 1000 10000 100000 --json results.json
+    python benchmarks/run_benchmarks.py --sizes 150000 --workers 1 2 4 8 --no-memory
+
+Peak memory is measured with tracemalloc, which slows Python code down; pass
+--no-memory for more accurate timings. Results saved with --json can be passed
+back as --baseline: every stage that is more than --tolerance slower (or
+allocates that much more memory) than in the baseline is reported, and the
+script exits with status 1.
+
+    python benchmarks/run_benchmarks.py --sizes 10000 100000 --json baseline.json
+    python benchmarks/run_benchmarks.py --sizes 10000 100000 --baseline baseline.json
+"""
+
+import argparse
+import csv
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.join(BENCHMARKS_DIR, '..')
+sys.path.insert(0, PROJECT_DIR)
+sys.path.insert(0, os.path.join(PROJECT_DIR, 'utilities'))
+import build_morpholex_db as bmd
+from allomorphs import canonicalize, load_canonical_forms
+from generate_lexicon import make_vocabulary, write_synthetic_elp
+from parallel_build import compute_morphological_variables_parallel
+from segm_annotation import compile_annotator, find_free_roots, remove_final_inflection
+
+LINGUISTIC_DATA_DIR = os.path.join(PROJECT_DIR, 'linguistic_data')
+DEFAULT_SIZES = (1000, 10000, 100000)
+# Default tolerated slowdown of a stage, as a fraction of its baseline
+REGRESSION_TOLERANCE = 0.5
+# Stages faster than this in the baseline are too noisy to be compared
+MIN_COMPARED_SECONDS = 0.1
+# Column of the segmentation fixed by fix_segmentation.py
+RAW_SEGM_COL = 47
+
+
+def compare_with_baseline(report, baseline, tolerance=REGRESSION_TOLERANCE):
+    """
+    Generates a description of each stage of report that is more than
+    tolerance (a fraction) slower, or that allocates more than tolerance more
+    memory, than in baseline, a report saved by an earlier run. Stages that are
+    not in the baseline, or that took less than MIN_COMPARED_SECONDS in it, are
+    not compared.
+    """
+    baseline_stages = {(run['rows'], stage['stage']): stage
+                       for run in baseline['runs'] for stage in run['stages']}
+    for run in report['runs']:
+        for stage in run['stages']:
+            ref = baseline_stages.get((run['rows'], stage['stage']))
+            if ref is None:
+                continue
+            if (ref['seconds'] >= MIN_COMPARED_SECONDS
+                    and stage['seconds'] > ref['seconds'] * (1 + tolerance)):
+                yield '%d rows, %s: %.3f s instead of %.3f s (+%.0f%%)' % (
+                    run['rows'], stage['stage'], stage['seconds'], ref['seconds'],
+                    (stage['seconds'] / ref['seconds'] - 1) * 100)
+            if (ref['peak_bytes'] and stage['peak_bytes']
+                    and stage['peak_bytes'] > ref['peak_bytes'] * (1 + tolerance)):
+                yield '%d rows, %s: %.1f MB instead of %.1f MB (+%.0f%%)' % (
+                    run['rows'], stage['stage'], stage['peak_bytes'] / 2**20,
+                    ref['peak_bytes'] / 2**20,
+                    (stage['peak_bytes'] / ref['peak_bytes'] - 1) * 100)
+
+
+def measure(func, *args, trace_memory=True):
+    """
+    Calls func(*args) and returns (result, seconds, peak_bytes), where
+    peak_bytes is the peak memory allocated during the call, or None if
+    trace_memory is False.
+    """
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = func(*args)
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    return result, seconds, peak
+
+
+def read_raw_segmentations(filepath):
+    """
+    Returns the words and the raw segmentations read by fix_segmentation.py.
+    """
+    with open(filepath) as f:
+        rows = [x for x in list(csv.reader(f))[2:] if x]  # skip headers (2 rows)
+    return [row[bmd.DB_WORD_COL] for row in rows], [row[RAW_SEGM_COL] for row in rows]
+
+
+def run_benchmark(filepath, vocabulary, output_dir, trace_memory=True, workers=()):
+    """
+    Runs every stage on the lexicon at filepath and returns a list of
+    (STAGE, SECONDS, PEAK_BYTES) tuples, in order. workers is a list of numbers
+    of processes to run compute_morphological_variables_parallel with.
+    """
+    results = []
+
+    def stage(name, func, *args):
+        result, seconds, peak = measure(func, *args, trace_memory=trace_memory)
+        results.append((name, seconds, peak))
+        return result
+
+    # build_morpholex_db.py
+    db = stage('read_csv', bmd.read_lexical_db, filepath)
+    db = stage('preprocess_db', bmd.preprocess_db, db)
+    hapax_set = stage('get_hapax_set', bmd.get_hapax_set, db)
+    morpho_vars = stage('compute_morphological_variables',
+                        bmd.compute_morphological_variables, db, hapax_set)
+    for n in workers:
+        stage('compute_morphological_variables_parallel_%d' % n,
+              compute_morphological_variables_parallel, db, hapax_set, n)
+    new_data_by_prs = stage('apply_morpho_vars_to_lex_db',
+                            bmd.apply_morpho_vars_to_lex_db, db, morpho_vars)
+    prs_rows = ((prs, row) for prs, data in new_data_by_prs.items() for row in data)
+    stage('save_prs_data_to_files', bmd.save_prs_data_to_files, prs_rows, output_dir)
+    del db, hapax_set, morpho_vars, new_data_by_prs
+
+    # fix_segmentation.py
+    words, raw_segms = stage('read_raw_segmentations', read_raw_segmentations, filepath)
+    segms = stage('remove_final_inflection',
+                  lambda: [remove_final_inflection(segm) for segm in raw_segms])
+    free_roots = stage('find_free_roots', find_free_roots, segms, words)
+    with open(os.path.join(LINGUISTIC_DATA_DIR, 'roots.txt')) as f:
+        roots = set(f.read().split('\n'))
+    with open(os.path.join(LINGUISTIC_DATA_DIR, 'non_roots.txt')) as f:
+        non_roots = set(f.read().split('\n'))
+    roots = roots.union(vocabulary['roots'], free_roots) - non_roots
+    annotate = compile_annotator(roots, vocabulary['prefixes'])
+    segms = stage('annotate', lambda: [annotate(segm) for segm in segms])
+    canonical_forms = load_canonical_forms(LINGUISTIC_DATA_DIR)
+    stage('canonicalize', lambda: [canonicalize(segm, canonical_forms) for segm in segms])
+    return results
+
+
+def print_results(n_rows, results):
+    print('%d rows' % n_rows)
+    for name, seconds, peak in results:
+        memory = '' if peak is None else '%10.1f MB' % (peak / 2**20)
+        print('  %-44s %9.3f s%s' % (name, seconds, memory))
+    print('  %-44s %9.3f s' % ('total', sum(seconds for _, seconds, _ in results)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the MorphoLex pipeline.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='numbers of rows of the synthetic lexicons')
+    parser.add_argument('--prefixes', type=int, default=100, help='number of prefixes')
+    parser.add_argument('--roots', type=int, default=5000, help='number of roots')
+    parser.add_argument('--suffixes', type=int, default=200, help='number of suffixes')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default=None,
+                        help='directory where the generated lexicons are kept and '
+                             'reused (default: a temporary directory)')
+    parser.add_argument('--no-memory', action='store_true',
+                        help="don't measure peak memory (faster)")
+    parser.add_argument('--workers', type=int, nargs='*', default=[],
+                        help='numbers of worker processes to time '
+                             'compute_morphological_variables_parallel with')
+    parser.add_argument('--json', default=None, help='save the results to this file')
+    parser.add_argument('--baseline', default=None,
+                        help='results saved with --json to compare with; exit with '
+                             'status 1 if a stage regressed')
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE,
+                        help='tolerated slowdown or memory increase of a stage over '
+                             'the baseline, as a fraction (default: %(default)s)')
+    args = parser.parse_args()
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if (baseline['vocabulary'] != {'prefixes': args.prefixes, 'roots': args.roots,
+                                       'suffixes': args.suffixes}
+                or baseline['seed'] != args.seed):
+            parser.error('the baseline was run with another vocabulary or seed')
+
+    vocabulary = make_vocabulary(args.prefixes, args.roots, args.suffixes, args.seed)
+    report = {'python': platform.python_version(), 'cpus': os.cpu_count(),
+              'vocabulary': {'prefixes': args.prefixes, 'roots': args.roots,
+                             'suffixes': args.suffixes},
+              'seed': args.seed,
+              'runs': []}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = args.data_dir or tmp_dir
+        os.makedirs(data_dir, exist_ok=True)
+        for n_rows in args.sizes:
+            filepath = os.path.join(data_dir, 'lexicon_%d_%d_%d_%d_%d.csv' % (
+                n_rows, args.prefixes, args.roots, args.suffixes, args.seed))
+            if not os.path.exists(filepath):
+                write_synthetic_elp(filepath, n_rows, args.prefixes, args.roots,
+                                    args.suffixes, args.seed)
+            output_dir = os.path.join(tmp_dir, 'output_%d' % n_rows)
+            results = run_benchmark(filepath, vocabulary, output_dir,
+                                    trace_memory=not args.no_memory,
+                                    workers=args.workers)
+            print_results(n_rows, results)
+            report['runs'].append({'rows': n_rows,
+                                   'stages': [{'stage': name, 'seconds': seconds,
+                                               'peak_bytes': peak}
+                                              for name, seconds, peak in results]})
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if baseline is not None:
+        regressions = list(compare_with_baseline(report, baseline, args.tolerance))
+        for description in regressions:
+            print('REGRESSION %s' % description)
+        print('%d regressions over %s' % (len(regressions), args.baseline))
+        sys.exit(1 if regressions else 0)
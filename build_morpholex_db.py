@@ -27,19 +27,29 @@ The output database must contain the following data for each entry:
   * P*
 """
 
+from bisect import bisect_right
 from collections import OrderedDict
 from pprint import pprint
+import argparse
 import copy
 import os
 import re
+import sys
 import csv
 import json
+import math
 import nltk
 
+from segm_parser import parse_segmentation
+
 PROJECT_PATH = '/home/hugo/Projects/ELP_morpho_vars/'
 # SEGM_DB_PATH = os.path.join(PROJECT_PATH, 'ELP_segmentations_no_flex.csv')
 DB_PATH = os.path.join(PROJECT_PATH, '/home/hugo/Projects/ELP_morpho_vars/input/ELP-2016-12-18.csv')
 VARS_SAVE_PATH = os.path.join(PROJECT_PATH, 'output/ELP_morphological_variables.csv')
+SNAPSHOT_PATH = os.path.join(PROJECT_PATH, 'cache/morpholex.snapshot')
+QUERY_INDEX_PATH = os.path.join(PROJECT_PATH, 'output/morpholex_query.index')
+MORPHEME_INDEX_PATH = os.path.join(PROJECT_PATH, 'output/morpheme_index.index')
+SQLITE_PATH = os.path.join(PROJECT_PATH, 'output/morpholex.sqlite')
 HAPAX_SBTL_FREQ_THRESHOLD = 0.02
 HAPAX_HAL_FREQ_THRESHOLD = 1
 DB_ITEMID_COL = 0
@@ -48,6 +58,111 @@ DB_POS_COL = 2
 DB_HAL_FREQ_COL = 25
 DB_SBTL_FREQ_COL = 27
 DB_SEGM_COL = 49
+STREAM_COLS = (DB_ITEMID_COL, DB_WORD_COL, DB_POS_COL, DB_HAL_FREQ_COL,
+               DB_SBTL_FREQ_COL, DB_SEGM_COL)
+# Frequency columns that morphological variables can be computed from. HAL
+# variables are always computed; the others are optional extra corpora.
+# Columns must be converted to numbers by preprocess_db.
+CORPUS_FREQ_COLS = OrderedDict([('HAL', DB_HAL_FREQ_COL), ('SUBTLEX', DB_SBTL_FREQ_COL)])
+# Number of HAL variables per morpheme in the rows of the PRS files (see
+# generate_headers)
+N_MORPHEME_VARS = 7
+
+
+class LexRow:
+    """
+    One row of the lexical database, reduced to the columns the pipeline reads
+    (STREAM_COLS). Fields are read and set with the DB_*_COL constants, as
+    row[DB_SEGM_COL], so a LexRow stands in for a full CSV row.
+    POS tags and segmentations are interned: rows that share them share a
+    single string.
+    """
+    __slots__ = ('itemid', 'word', 'pos', 'hal_freq', 'sbtl_freq', 'segm')
+    _fields = {DB_ITEMID_COL: 'itemid', DB_WORD_COL: 'word', DB_POS_COL: 'pos',
+               DB_HAL_FREQ_COL: 'hal_freq', DB_SBTL_FREQ_COL: 'sbtl_freq',
+               DB_SEGM_COL: 'segm'}
+
+    def __init__(self, itemid, word, pos, hal_freq, sbtl_freq, segm):
+        self.itemid = itemid
+        self.word = word
+        self.pos = sys.intern(pos)
+        self.hal_freq = hal_freq
+        self.sbtl_freq = sbtl_freq
+        self.segm = sys.intern(segm)
+
+    def __getitem__(self, col):
+        return getattr(self, self._fields[col])
+
+    def __setitem__(self, col, value):
+        setattr(self, self._fields[col], value)
+
+    def __repr__(self):
+        return 'LexRow(%r, %r, %r, %r, %r, %r)' % (self.itemid, self.word, self.pos,
+                                                   self.hal_freq, self.sbtl_freq, self.segm)
+
+    @classmethod
+    def from_csv_row(cls, row):
+        return cls(row[DB_ITEMID_COL], row[DB_WORD_COL], row[DB_POS_COL],
+                   row[DB_HAL_FREQ_COL], row[DB_SBTL_FREQ_COL], row[DB_SEGM_COL])
+
+
+def aggregate_corpus_segmentations(db, corpora=(), hapax_set=None):
+    """
+    Sums, in a single pass over database, the HAL frequencies and the frequencies
+    of the extra corpora (keys of CORPUS_FREQ_COLS) of the rows that share a
+    segmentation, over all the rows and over the hapax rows.
+    Hapax rows are those of hapax_set if it is given (see get_hapax_set), and are
+    otherwise decided row by row (see is_hapax), so db can be a stream such as the
+    one returned by stream_lexical_db.
+    Returns (segm_freqs, segm_hapax_freqs, n_hapax, corpus_freqs), where the first
+    two are dicts {SEGM: HAL_FREQUENCY} ordered by first appearance, n_hapax is
+    the size of the hapax set and corpus_freqs is a dict
+    {CORPUS: (segm_freqs, segm_hapax_freqs)}. The frequencies of the extra
+    corpora may be floats, so they are not summed here: each segmentation maps
+    to the list of the frequencies of its rows (see sum_frequencies).
+    """
+    segm_freqs = {}
+    segm_hapax_freqs = {}
+    n_hapax = 0
+    corpus_cols = [(CORPUS_FREQ_COLS[c], {}, {}) for c in corpora]
+
+    def add_hapax(row):
+        nonlocal n_hapax
+        segm = row[DB_SEGM_COL]
+        if segm not in segm_hapax_freqs:
+            segm_hapax_freqs[segm] = 0
+            for _, _, hapax_freqs in corpus_cols:
+                hapax_freqs[segm] = []
+        segm_hapax_freqs[segm] += row[DB_HAL_FREQ_COL]
+        for col, _, hapax_freqs in corpus_cols:
+            hapax_freqs[segm].append(row[col])
+        n_hapax += 1
+
+    for row in db:
+        segm = row[DB_SEGM_COL]
+        if segm not in segm_freqs:
+            segm_freqs[segm] = 0
+            for _, freqs, _ in corpus_cols:
+                freqs[segm] = []
+        segm_freqs[segm] += row[DB_HAL_FREQ_COL]
+        for col, freqs, _ in corpus_cols:
+            freqs[segm].append(row[col])
+        if hapax_set is None and is_hapax(row):
+            add_hapax(row)
+    if hapax_set is not None:
+        for row in hapax_set:
+            add_hapax(row)
+    corpus_freqs = {c: (freqs, hapax_freqs)
+                    for c, (_, freqs, hapax_freqs) in zip(corpora, corpus_cols)}
+    return segm_freqs, segm_hapax_freqs, n_hapax, corpus_freqs
+
+
+def aggregate_segmentations(db, hapax_set=None):
+    """
+    Same as aggregate_corpus_segmentations, without the extra corpora.
+    Returns (segm_freqs, segm_hapax_freqs, n_hapax).
+    """
+    return aggregate_corpus_segmentations(db, (), hapax_set)[:3]
 
 
 def apply_morpho_vars_to_lex_db(db, morpho_vars):
@@ -57,39 +172,42 @@ def apply_morpho_vars_to_lex_db(db, morpho_vars):
     in the top comment of this script.
     """
     res = {}
-    for row in db:
-        # temp = copy.deepcopy(row)
-        segm = row[DB_SEGM_COL]
-        if segm == "NULL":
-            continue
-        prs = get_PRS_signature(row[DB_SEGM_COL])
+    for prs, temp in iter_morpho_vars_rows(db, morpho_vars):
         if prs not in res.keys():
             res[prs] = []
-        morphemes = get_morphemes(segm)
-        n_morphemes = len(morphemes)
-        prs_string = ','.join([str(x) for x in prs])
-        temp = [row[DB_ITEMID_COL], row[DB_WORD_COL], row[DB_POS_COL],
-                n_morphemes, prs_string, segm]
-        # freq = int(row[DB_HAL_FREQ_COL])
-        # Any morpheme would do, we use the first.
-        freq = morpho_vars[morphemes[0]]['family'][segm] if morphemes else None
-        for m in morphemes:
-            ffr = get_family_frequency_rank(freq, morpho_vars[m]['family'])
-            pfmf = get_percentage_family_more_frequent(freq, morpho_vars[m]['family'])
-            m_vars = [ffr,
-                      pfmf,
-                      morpho_vars[m]['family_size'],
-                      morpho_vars[m]['hal_freq'],
-                      morpho_vars[m]['hal_p'],
-                      morpho_vars[m]['hal_p*'],
-                      morpho_vars[m]['length']]
-            temp.extend(m_vars)
         res[prs].append(temp)
 
     return res
 
 
-def compute_morphological_variables(db, hapax_set):
+def build_morpheme_index(db, hapax_set, corpora=()):
+    """
+    Build an inverted index {MORPHEME: entry} in a single pass over database,
+    where entry is a dict with the following keys:
+
+    - 'family': {SEGM: HAL_FREQUENCY}, as returned by get_family
+    - 'hal_freq': summed HAL frequency, as returned by total_morpheme_freq
+    - 'hapax_freq': summed HAL frequency of the rows of hapax_set containing
+      the morpheme
+    - 'corpora': only if extra corpora are given, see index_corpus_frequencies
+
+    Morphemes are indexed in order of first appearance in db, and family
+    members in order of first appearance of their segmentation, so that the
+    result is ordered exactly like the output of the row-by-row functions.
+    """
+    # 1. Group rows by segmentation
+    segm_freqs, segm_hapax_freqs, _, corpus_freqs = \
+        aggregate_corpus_segmentations(db, corpora, hapax_set)
+
+    # 2. Index the unique segmentations
+    index = index_segmentations(segm_freqs, segm_hapax_freqs)
+    if corpora:
+        index_corpus_frequencies(index, corpus_freqs)
+
+    return index
+
+
+def compute_morphological_variables(db, hapax_set, corpora=()):
     """
     For each morpheme in the segmented lexical database, compute the following
     attributes:
@@ -99,39 +217,32 @@ def compute_morphological_variables(db, hapax_set):
     - p-measure
     - p*-measure
     - length
+
+    and the frequency, p-measure and p*-measure in each of the extra corpora.
+    All attributes are read from the inverted index returned by
+    build_morpheme_index, so the database is scanned only once.
     """
-    morpho_vars = {}
-    counted = set()
+    index = build_morpheme_index(db, hapax_set, corpora)
+    return get_morpho_vars_from_index(index, len(hapax_set))
 
-    for i, row in enumerate(db):
-        print('\r{} / {}'.format(i, len(db)), end='')    
-        segm = row[DB_SEGM_COL]
-        morphemes = get_morphemes(segm)
-        for m in [x for x in morphemes if x not in counted]:
-            counted.add(m)
-            freq = total_morpheme_freq(m, db)
-            family = get_family(m, db)
-            morpho_vars[m] = {'hal_freq': freq}
-            morpho_vars[m]['family'] = family
-            morpho_vars[m]['family_size'] = len(family)
-            morpho_vars[m]['length'] = len(m) - 2  # -2 because every morpheme is surrounded by brackets
-            
-            hapax_freq = total_morpheme_freq(m, hapax_set)
-            if hapax_freq == 0:
-                morpho_vars[m]['hal_p'] = 0
-                morpho_vars[m]['hal_p*'] = 0
-            else:
-                morpho_vars[m]['hal_p'] = hapax_freq / freq
-                morpho_vars[m]['hal_p*'] = hapax_freq / len(hapax_set)
 
-    print('\n')
-    return morpho_vars
+def count_family_more_frequent(word_freq, sorted_freqs):
+    """
+    Given a word frequency and the ascending list of frequencies of one of its
+    morphological families, returns the number of family members that have a
+    frequency strictly higher than word_freq (ties are not counted).
+    This is the quantity behind get_family_frequency_rank and
+    get_percentage_family_more_frequent, found by binary search.
+    """
+    return len(sorted_freqs) - bisect_right(sorted_freqs, word_freq)
 
 
-def generate_headers(prs):
+def generate_headers(prs, corpora=()):
     """
     Given a prs signature for a CSV database, returns the appropriate header
     structure (column names).
+    The variables of the extra corpora, if any, follow those of HAL, one corpus
+    after the other.
     """
     p, r, s = int(prs[0]), int(prs[1]), int(prs[2])
     headers = []
@@ -150,9 +261,27 @@ def generate_headers(prs):
                         'SUFF%d_FamSize' % i, 'SUFF%d_Freq_HAL' % i, 
                         'SUFF%d_P' % i, 'SUFF%d_P*' % i, 'SUFF%d_length' % i
                        ])
+    for corpus in corpora:
+        for role, n in (('PREF', p), ('ROOT', r), ('SUFF', s)):
+            for i in range(1, n+1):
+                headers.extend(['%s%d_FFR_%s' % (role, i, corpus),
+                                '%s%d_PFMF_%s' % (role, i, corpus),
+                                '%s%d_Freq_%s' % (role, i, corpus),
+                                '%s%d_P_%s' % (role, i, corpus),
+                                '%s%d_P*_%s' % (role, i, corpus)])
     return headers
 
 
+def get_contained_morphemes(segm):
+    """
+    Returns the set of all substrings of segm that have the shape of a morpheme,
+    including overlapping ones. Any morpheme m satisfies `m in segm` if and only
+    if m belongs to this set, which makes it a drop-in replacement for the
+    substring tests of get_family and total_morpheme_freq.
+    """
+    return set(re.findall(r'(?=([<>(][^><)]+?[<>)]))', segm))
+
+
 def get_family(morpheme, db):
     """
     Returns a dict {WORD: HAL_FREQUENCY} of all the words
@@ -191,13 +320,50 @@ def get_hapax_set(db):
     return hapax
 
 
+def get_morpho_vars_from_index(index, n_hapax):
+    """
+    Builds the morpho_vars dict of compute_morphological_variables from a
+    morpheme index (see index_segmentations) and the size of the hapax set.
+    """
+    morpho_vars = {}
+    for m, entry in index.items():
+        freq = entry['hal_freq']
+        family = entry['family']
+        morpho_vars[m] = {'hal_freq': freq}
+        morpho_vars[m]['family'] = family
+        morpho_vars[m]['family_size'] = len(family)
+        morpho_vars[m]['length'] = len(m) - 2  # -2 because every morpheme is surrounded by brackets
+
+        hapax_freq = entry['hapax_freq']
+        if hapax_freq == 0:
+            morpho_vars[m]['hal_p'] = 0
+            morpho_vars[m]['hal_p*'] = 0
+        else:
+            morpho_vars[m]['hal_p'] = hapax_freq / freq
+            morpho_vars[m]['hal_p*'] = hapax_freq / n_hapax
+
+        if 'corpora' in entry:
+            morpho_vars[m]['corpora'] = {}
+            for corpus, c_entry in entry['corpora'].items():
+                c_vars = {'family': c_entry['family'], 'freq': c_entry['freq']}
+                if c_entry['hapax_freq'] == 0:
+                    c_vars['p'] = 0
+                    c_vars['p*'] = 0
+                else:
+                    c_vars['p'] = c_entry['hapax_freq'] / c_entry['freq']
+                    c_vars['p*'] = c_entry['hapax_freq'] / n_hapax
+                morpho_vars[m]['corpora'][corpus] = c_vars
+
+    return morpho_vars
+
+
 def get_morphemes(segm):
     """
     Parses the ELP morpheme segmentation string and returns a list of morphemes.
     """
     if segm == 'NULL':
         raise Exception("NULL segmentation!")
-    return re.findall(r'[<>(][^><)]+?[<>)]', segm)
+    return list(parse_segmentation(segm).morphemes)
 
 
 def get_PRS_signature(segm):
@@ -205,10 +371,7 @@ def get_PRS_signature(segm):
     Returns a signature composed of 3 integers, each digit representing
     # of prefixes, # of roots, and # of suffixes, respectively.
     """
-    n_pref = int(segm.count('<') / 2)
-    n_root = segm.count('(')
-    n_suff = int(segm.count('>') / 2)
-    return (n_pref, n_root, n_suff)
+    return parse_segmentation(segm).prs
 
 
 def get_percentage_family_more_frequent(word_freq, family):
@@ -237,6 +400,139 @@ def get_family_frequency_rank(word_freq, family):
     return sum([1 for x in family.values() if x > word_freq]) + 1
 
 
+def index_segmentations(segm_freqs, segm_hapax_freqs, contained=None):
+    """
+    Build an inverted index {MORPHEME: entry} from the unique segmentations of
+    the database, where entry holds the 'family', 'hal_freq' and 'hapax_freq'
+    keys described in build_morpheme_index.
+    segm_freqs and segm_hapax_freqs are dicts {SEGM: HAL_FREQUENCY}, as returned
+    by aggregate_segmentations.
+    contained optionally maps each segmentation to the indexed morphemes it
+    contains, when those were already computed (e.g. by worker processes).
+    """
+    index = {}
+    for segm in segm_freqs:
+        for m in get_morphemes(segm):
+            if m not in index:
+                index[m] = {'family': {}, 'hal_freq': 0, 'hapax_freq': 0}
+
+    # Attach each unique segmentation to every morpheme it contains
+    if contained is None:
+        contained = {}
+    for segm, freq in segm_freqs.items():
+        if segm not in contained:
+            contained[segm] = [m for m in get_contained_morphemes(segm) if m in index]
+        for m in contained[segm]:
+            index[m]['family'][segm] = freq
+            index[m]['hal_freq'] += freq
+
+    for segm, freq in segm_hapax_freqs.items():
+        if segm not in contained:
+            contained[segm] = [m for m in get_contained_morphemes(segm) if m in index]
+        for m in contained[segm]:
+            index[m]['hapax_freq'] += freq
+
+    return index
+
+
+def index_corpus_frequencies(index, corpus_freqs):
+    """
+    Adds a 'corpora' key to each entry of a morpheme index (see
+    index_segmentations): {CORPUS: {'family': {SEGM: FREQUENCY}, 'freq': ...,
+    'hapax_freq': ...}}, the family and summed frequencies of the morpheme in
+    each extra corpus.
+    corpus_freqs is a dict {CORPUS: (segm_freqs, segm_hapax_freqs)}, as returned
+    by aggregate_corpus_segmentations. Families are those of the index, so no
+    segmentation has to be parsed again.
+    Every frequency is the sum of the frequencies of the rows it covers, as
+    computed by sum_frequencies, and not the sum of the family frequencies.
+    """
+    for entry in index.values():
+        entry['corpora'] = {}
+        for corpus, (segm_freqs, segm_hapax_freqs) in corpus_freqs.items():
+            family = {segm: sum_frequencies(segm_freqs[segm]) for segm in entry['family']}
+            entry['corpora'][corpus] = {
+                'family': family,
+                'freq': sum_frequencies([f for segm in family for f in segm_freqs[segm]]),
+                'hapax_freq': sum_frequencies([f for segm in family
+                                               for f in segm_hapax_freqs.get(segm, ())])}
+
+
+def is_hapax(row):
+    """
+    Returns True if the row belongs to the hapax set described in get_hapax_set.
+    """
+    return (row[DB_HAL_FREQ_COL] <= HAPAX_HAL_FREQ_THRESHOLD
+            or row[DB_SBTL_FREQ_COL] <= HAPAX_SBTL_FREQ_THRESHOLD)
+
+
+def iter_morpho_vars_rows(db, morpho_vars, sorted_families=None):
+    """
+    Generates (PRS_signature, lexical_data) pairs for every row of database, one
+    row at a time. See apply_morpho_vars_to_lex_db. lexical_data is a tuple.
+    sorted_families can be passed if sort_family_frequencies was already called.
+    """
+    if sorted_families is None:
+        sorted_families = sort_family_frequencies(morpho_vars)
+    # Extra corpora, if morpho_vars has variables for them
+    corpora = list(next(iter(morpho_vars.values()), {}).get('corpora', ()))
+    corpus_sorted_families = {c: sort_family_frequencies(morpho_vars, c) for c in corpora}
+    # Everything but the ItemID, word and POS only depends on the segmentation,
+    # so it is computed once per segmentation and shared by its rows
+    tails = {}
+    # {MORPHEME_ID: (SORTED_FAMILY_FREQS, [FAMILY_SIZE, FREQ, P, P*, LENGTH])}, filled
+    # as morphemes are met (see segm_parser.get_morpheme_id)
+    morpheme_vars = {}
+    for row in db:
+        # temp = copy.deepcopy(row)
+        segm = row[DB_SEGM_COL]
+        if segm == "NULL":
+            continue
+        if segm in tails:
+            prs, tail = tails[segm]
+            yield prs, (row[DB_ITEMID_COL], row[DB_WORD_COL], row[DB_POS_COL]) + tail
+            continue
+        parse = parse_segmentation(segm)
+        prs = parse.prs
+        morphemes = parse.morphemes
+        n_morphemes = len(morphemes)
+        prs_string = ','.join([str(x) for x in prs])
+        temp = [n_morphemes, prs_string, segm]
+        # freq = int(row[DB_HAL_FREQ_COL])
+        # Any morpheme would do, we use the first.
+        freq = morpho_vars[morphemes[0]]['family'][segm] if morphemes else None
+        for m, m_id in zip(morphemes, parse.ids):
+            if m_id not in morpheme_vars:
+                morpheme_vars[m_id] = (sorted_families[m],
+                                       [morpho_vars[m]['family_size'],
+                                        morpho_vars[m]['hal_freq'],
+                                        morpho_vars[m]['hal_p'],
+                                        morpho_vars[m]['hal_p*'],
+                                        morpho_vars[m]['length']])
+            sorted_freqs, m_vars = morpheme_vars[m_id]
+            n_more_freq = count_family_more_frequent(freq, sorted_freqs)
+            ffr = n_more_freq + 1
+            if len(sorted_freqs) == 1:
+                pfmf = 0
+            else:
+                pfmf = (n_more_freq / (len(sorted_freqs)-1)) * 100
+            temp.extend([ffr, pfmf])
+            temp.extend(m_vars)
+        for c in corpora:
+            c_freq = morpho_vars[morphemes[0]]['corpora'][c]['family'][segm] if morphemes else None
+            for m in morphemes:
+                c_sorted = corpus_sorted_families[c][m]
+                n_more_freq = count_family_more_frequent(c_freq, c_sorted)
+                if len(c_sorted) == 1:
+                    pfmf = 0
+                else:
+                    pfmf = (n_more_freq / (len(c_sorted)-1)) * 100
+                c_vars = morpho_vars[m]['corpora'][c]
+                temp.extend([n_more_freq + 1, pfmf, c_vars['freq'], c_vars['p'], c_vars['p*']])
+        tails[segm] = prs, tuple(temp)
+        yield prs, (row[DB_ITEMID_COL], row[DB_WORD_COL], row[DB_POS_COL]) + tails[segm][1]
+
+
 def merge_new_data_with_database(prs_data, main_db):
     """
     For each word in prs_data, put together the following data:
@@ -258,7 +554,7 @@ def merge_new_data_with_database(prs_data, main_db):
         for i, row in enumerate(prs_data[signature]):
             word = row[0]
             try:
-                prs_data[signature][i] = main_db[word] + prs_data[signature][i][3:]
+                prs_data[signature][i] = main_db[word] + list(prs_data[signature][i][3:])
             except KeyError:
                 print(word)
                 continue
@@ -291,6 +587,56 @@ def preprocess_db(db):
     return valid_db_subset
 
 
+def read_lexical_db(filepath):
+    """
+    Reads the ELP CSV file into a list of LexRow, without preprocessing them
+    (see preprocess_db).
+    """
+    with open(filepath) as database:
+        reader = csv.reader(database)
+        next(reader)  # skip headers (2 rows)
+        next(reader)
+        return [LexRow.from_csv_row(row) for row in reader if row]
+
+
+def sort_family_frequencies(morpho_vars, corpus=None):
+    """
+    Returns a dict {MORPHEME: [FREQ, ...]} where each list holds the frequencies
+    of the morpheme's family members, sorted in ascending order.
+    Frequencies are those of HAL, or of the given extra corpus.
+    """
+    if corpus is not None:
+        return {m: sorted(d['corpora'][corpus]['family'].values())
+                for m, d in morpho_vars.items()}
+    return {m: sorted(d['family'].values()) for m, d in morpho_vars.items()}
+
+
+def stream_lexical_db(filepath):
+    """
+    Reads the ELP CSV file one row at a time and generates preprocessed rows
+    (see preprocess_db) that have a MorphoLexSegm value, as LexRow.
+    """
+    with open(filepath) as database:
+        reader = csv.reader(database)
+        next(reader)  # skip headers (2 rows)
+        next(reader)
+        for row in reader:
+            if not row or row[DB_SEGM_COL] == 'NULL':
+                continue
+            yield preprocess_db([LexRow.from_csv_row(row)])[0]
+
+
+def sum_frequencies(freqs):
+    """
+    Sums a list of row frequencies. Floats are summed with math.fsum, whose
+    result is correctly rounded, so it doesn't depend on the order or grouping
+    of the rows. Sums of ints only (such as NULL frequencies) stay ints.
+    """
+    if all(isinstance(f, int) for f in freqs):
+        return sum(freqs)
+    return math.fsum(freqs)
+
+
 def total_morpheme_freq(morpheme, db):
     """
     Sums the frequencies of words containing the morpheme in the database.
@@ -319,28 +665,235 @@ def save_morpho_vars_to_file(morpho_vars, filepath):
                                 d['p*']])
 
 
+def save_prs_data_to_files(prs_rows, output_dir, corpora=()):
+    """
+    Writes (PRS_signature, lexical_data) pairs to one CSV file per PRS
+    signature in output_dir. Files are created as their first row comes in,
+    so prs_rows can be a stream such as the one returned by
+    iter_morpho_vars_rows. corpora are the extra corpora of the rows, if any.
+    """
+    # create output directory if it doesn't exist already
+    os.makedirs(output_dir, exist_ok=True)
+    headers = ['ELP_ItemID', 'Word', 'POS', 'Nmorph', 'PRS_signature',
+               'MorphoLexSegm']
+    files = {}
+    writers = {}
+    try:
+        for prs, row in prs_rows:
+            if prs not in writers:
+                prs_str = re.sub(r'[,()]', '', str(prs))
+                savepath = os.path.join(output_dir, '%s.csv' % prs_str)
+                files[prs] = open(savepath, 'w')
+                writers[prs] = csv.writer(files[prs])
+                writers[prs].writerow(headers + generate_headers(prs, corpora))
+            writers[prs].writerow(row)
+    finally:
+        for f in files.values():
+            f.close()
+
+
 if __name__ == '__main__':
     """
     Load lexical database, get morphological variables, divide lexical items
     by PRS signature and build one database per PRS signature where each
     lexical item is associated with its parts' morphological variables.
     """
-    # Load lexical database
-    with open(DB_PATH) as database:
-        db = [x for x in list(csv.reader(database))[2:] if x]  # skip headers (2 rows)
-
-    print('preprocessing db')
-    db = preprocess_db(db)
-    print('getting hapax set')
-    hapax_set = get_hapax_set(db)
-    print('computing morphological variables')
-    morpho_vars = compute_morphological_variables(db, hapax_set)
+    parser = argparse.ArgumentParser(description='Build the MorphoLex database.')
+    parser.add_argument('--engine', choices=['python', 'numpy'], default='python',
+                        help='use the columnar NumPy engine (falls back to python '
+                             'if numpy is not installed)')
+    parser.add_argument('--stream', action='store_true',
+                        help='read the database twice as a stream instead of loading it '
+                             'in memory (python engine only)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only recompute what changed since the previous '
+                             '--incremental run (python engine only)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes (python engine only)')
+    parser.add_argument('--cache', action='store_true',
+                        help='reuse the snapshot of the preprocessed database and '
+                             'morpheme index if the input did not change')
+    parser.add_argument('--query-index', action='store_true',
+                        help='also save the index read by query_morpholex.py')
+    parser.add_argument('--morpheme-index', action='store_true',
+                        help='also save the morpheme index read by morpheme_index.py')
+    parser.add_argument('--format', choices=['csv', 'sqlite'], default='csv',
+                        help='write one CSV file per PRS signature, or a single '
+                             'SQLite database (see sqlite_output.py)')
+    parser.add_argument('--corpora', nargs='+', default=[],
+                        choices=[c for c in CORPUS_FREQ_COLS if c != 'HAL'],
+                        help='also compute the variables of these corpora, next to '
+                             'those of HAL (python engine, single process); float '
+                             'frequencies are summed exactly (math.fsum)')
+    parser.add_argument('--out-of-core', action='store_true',
+                        help='keep the segmentations and families in a temporary '
+                             'on-disk store instead of memory (CSV output only)')
+    parser.add_argument('--memory-budget', type=int, default=512,
+                        help='memory budget of --out-of-core, in MB')
+    parser.add_argument('--profile', action='store_true',
+                        help='profile the run with cProfile (output/build.pstats)')
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+    if args.engine == 'numpy':
+        import columnar_db
+        if columnar_db.np is None:
+            print('warning: numpy is not installed, using the python engine')
+            args.engine = 'python'
+    if args.corpora and (args.engine != 'python' or args.incremental or args.cache
+                         or args.workers > 1 or args.query_index or args.morpheme_index
+                         or args.format != 'csv'):
+        parser.error('--corpora requires the python engine and CSV output, without '
+                     '--incremental, --cache, --workers, --query-index or --morpheme-index')
+    if args.out_of_core and (args.engine != 'python' or args.incremental or args.cache
+                             or args.workers > 1 or args.stream or args.corpora
+                             or args.query_index or args.morpheme_index
+                             or args.format != 'csv'):
+        parser.error('--out-of-core only supports the default options')
+    if args.stream and (args.engine != 'python' or args.workers > 1):
+        parser.error('--stream requires the python engine, without --workers')
+    if args.incremental and (args.engine != 'python' or args.stream or args.cache
+                             or args.workers > 1 or args.query_index
+                             or args.format != 'csv'):
+        parser.error('--incremental requires the python engine and CSV output, without '
+                     '--stream, --cache, --workers or --query-index')
+    output_dir = os.path.join(PROJECT_PATH, 'output')
+
+    from instrumentation import (RunReport, get_cache_counters, progress, start_profiler,
+                                 stop_profiler)
+    report = RunReport('build_morpholex_db')
+    profiler = start_profiler(args.profile)
+
+    if args.out_of_core:
+        from out_of_core import build_out_of_core
+        # Families are not kept in memory, so morpho_vars.json is not written
+        with report.stage('build_out_of_core') as stage:
+            stage.counters = build_out_of_core(DB_PATH, output_dir,
+                                               args.memory_budget * 2**20)
+            stage.rows = stage.counters['rows']
+        stop_profiler(profiler, os.path.join(output_dir, 'build.pstats'))
+        report.save(os.path.join(output_dir, 'run_report.json'))
+        sys.exit()
+
+    if args.incremental:
+        from incremental_build import run_incremental_build
+        with report.stage('incremental_build'):
+            morpho_vars = run_incremental_build(DB_PATH, output_dir)
+        stop_profiler(profiler, os.path.join(output_dir, 'build.pstats'))
+        if args.morpheme_index:
+            from morpheme_index import build_morpheme_index_file
+            with report.stage('build_morpheme_index'):
+                build_morpheme_index_file(MORPHEME_INDEX_PATH, morpho_vars)
+        report.counters['morphemes'] = len(morpho_vars)
+        report.save(os.path.join(output_dir, 'run_report.json'))
+        with open('morpho_vars.json', 'w') as f:
+            json.dump(morpho_vars, f)
+        sys.exit()
+
+    if args.cache:
+        from snapshot import get_build_fingerprint, load_build_snapshot, save_build_snapshot
+        fingerprint = get_build_fingerprint(DB_PATH)
+        with report.stage('load_snapshot'):
+            snapshot = load_build_snapshot(SNAPSHOT_PATH, fingerprint)
+        if snapshot is not None:
+            print('loaded snapshot')
+            db, index, n_hapax = snapshot
+        else:
+            print('preprocessing db')
+            with report.stage('preprocess_db') as stage:
+                db = list(stream_lexical_db(DB_PATH))
+                stage.rows = len(db)
+            print('computing morphological variables')
+            with report.stage('index_segmentations') as stage:
+                segm_freqs, segm_hapax_freqs, n_hapax = aggregate_segmentations(db)
+                index = index_segmentations(segm_freqs, segm_hapax_freqs)
+                stage.rows = len(db)
+            with report.stage('save_snapshot'):
+                save_build_snapshot(SNAPSHOT_PATH, fingerprint, db, index, n_hapax)
+        with report.stage('compute_morphological_variables'):
+            morpho_vars = get_morpho_vars_from_index(index, n_hapax)
+        if args.engine == 'numpy':
+            from columnar_db import apply_morpho_vars_to_columns, load_columns
+            with report.stage('load_columns'):
+                columns = load_columns(db)
+    elif args.stream:
+        print('aggregating segmentations')
+        with report.stage('aggregate_segmentations') as stage:
+            rows = progress(stream_lexical_db(DB_PATH), 'aggregating')
+            segm_freqs, segm_hapax_freqs, n_hapax, corpus_freqs = \
+                aggregate_corpus_segmentations(rows, args.corpora)
+            stage.counters['distinct_segmentations'] = len(segm_freqs)
+        print('computing morphological variables')
+        with report.stage('compute_morphological_variables'):
+            index = index_segmentations(segm_freqs, segm_hapax_freqs)
+            if args.corpora:
+                index_corpus_frequencies(index, corpus_freqs)
+            morpho_vars = get_morpho_vars_from_index(index, n_hapax)
+    elif args.engine == 'numpy':
+        from columnar_db import (apply_morpho_vars_to_columns, load_columns,
+                                 compute_morphological_variables_columnar)
+        print('preprocessing db')
+        with report.stage('load_columns'):
+            columns = load_columns(stream_lexical_db(DB_PATH))
+        print('computing morphological variables')
+        with report.stage('compute_morphological_variables'):
+            morpho_vars = compute_morphological_variables_columnar(columns)
+    else:
+        # Load lexical database
+        with report.stage('read_csv') as stage:
+            db = read_lexical_db(DB_PATH)
+            stage.rows = len(db)
+        print('preprocessing db')
+        with report.stage('preprocess_db') as stage:
+            db = preprocess_db(db)
+            stage.rows = len(db)
+        print('getting hapax set')
+        with report.stage('get_hapax_set') as stage:
+            hapax_set = get_hapax_set(db)
+            stage.rows = len(db)
+            stage.counters['hapax'] = len(hapax_set)
+        print('computing morphological variables')
+        with report.stage('compute_morphological_variables') as stage:
+            if args.workers > 1:
+                from parallel_build import compute_morphological_variables_parallel
+                morpho_vars = compute_morphological_variables_parallel(db, hapax_set,
+                                                                       args.workers)
+            else:
+                morpho_vars = compute_morphological_variables(db, hapax_set, args.corpora)
+            stage.rows = len(db)
+    family_sizes = [d['family_size'] for d in morpho_vars.values()]
+    report.counters['morphemes'] = len(morpho_vars)
+    report.counters['max_family_size'] = max(family_sizes, default=0)
+    report.counters['mean_family_size'] = (sum(family_sizes) / len(family_sizes)
+                                           if family_sizes else 0)
+    if args.morpheme_index:
+        from morpheme_index import build_morpheme_index_file
+        with report.stage('build_morpheme_index') as stage:
+            build_morpheme_index_file(MORPHEME_INDEX_PATH, morpho_vars)
+            stage.rows = len(morpho_vars)
     with open('morpho_vars.json', 'w') as f:
         json.dump(morpho_vars, f)
     # with open('morpho_vars.json') as f:
     #     morpho_vars = json.load(f)
     print('applying morphological variables to database')
-    new_data_by_prs = apply_morpho_vars_to_lex_db(db, morpho_vars)
+    if args.stream:
+        # Rows are written as soon as they are computed, so applying the
+        # variables is part of the output stage
+        prs_rows = iter_morpho_vars_rows(progress(stream_lexical_db(DB_PATH), 'applying'),
+                                         morpho_vars)
+    else:
+        with report.stage('apply_morpho_vars_to_lex_db') as stage:
+            if args.engine == 'numpy':
+                new_data_by_prs = apply_morpho_vars_to_columns(columns, morpho_vars)
+            elif args.workers > 1:
+                from parallel_build import apply_morpho_vars_to_lex_db_parallel
+                new_data_by_prs = apply_morpho_vars_to_lex_db_parallel(db, morpho_vars,
+                                                                       args.workers)
+            else:
+                new_data_by_prs = apply_morpho_vars_to_lex_db(db, morpho_vars)
+            stage.rows = sum(len(data) for data in new_data_by_prs.values())
+            stage.counters['prs_signatures'] = len(new_data_by_prs)
+        prs_rows = ((prs, row) for prs, data in new_data_by_prs.items() for row in data)
 
     # with open(DB_PATH) as database:
     #     reader = csv.reader(database)
@@ -351,17 +904,22 @@ if __name__ == '__main__':
     # print('merging new data with existing database')
     # merged_data = merge_new_data_with_database(new_data_by_prs, main_db)
 
-    # create output directory if it doesn't exist already
-    os.makedirs('output', exist_ok=True)
-    headers = ['ELP_ItemID', 'Word', 'POS', 'Nmorph', 'PRS_signature', 
-               'MorphoLexSegm']
-    for prs, data in new_data_by_prs.items():
-        prs_str = re.sub(r'[,()]', '', str(prs))
-        savepath = os.path.join(PROJECT_PATH, 'output/%s.csv' % prs_str)
-        with open(savepath, 'w') as f:
-            csvwriter = csv.writer(f)
-            csvwriter.writerow(headers + generate_headers(prs))
-            csvwriter.writerows(data)
+    if args.query_index:
+        from query_morpholex import build_query_index
+        with report.stage('build_query_index') as stage:
+            prs_rows = list(prs_rows)
+            build_query_index(QUERY_INDEX_PATH, prs_rows)
+            stage.rows = len(prs_rows)
+    with report.stage('save_output'):
+        if args.format == 'sqlite':
+            from sqlite_output import save_to_sqlite
+            save_to_sqlite(SQLITE_PATH, prs_rows, morpho_vars)
+        else:
+            save_prs_data_to_files(prs_rows, output_dir, args.corpora)
+
+    stop_profiler(profiler, os.path.join(output_dir, 'build.pstats'))
+    report.counters['parse_segmentation'] = get_cache_counters(parse_segmentation)
+    report.save(os.path.join(output_dir, 'run_report.json'))
 
 
     # save_morpho_vars_to_file(morpho_vars, VARS_SAVE_PATH)
@@ -0,0 +1,247 @@
+# !/usr/bin/env python
+#  encoding: utf-8
+
+"""
+NumPy engine for the MorphoLex build, with a columnar lexicon.
+
+Instead of keeping the whole ELP table as lists of ~50 strings per row, only the
+columns used by the pipeline are kept, in compact form:
+
+- ItemID, Word and POS, each as one UTF-8 buffer plus an array of offsets (see
+  StringColumn), instead of one Python string object per value
+- the list of distinct segmentation strings
+- HAL and SUBTLEX frequencies, as NumPy arrays
+- the segmentation of each row as an integer ID into the list of distinct
+  segmentations, and the morphemes of each distinct segmentation as integer IDs
+  into the morpheme vocabulary
+
+The hapax set then becomes a boolean mask, and morpheme frequencies, hapax
+frequencies and family sizes are computed with np.bincount over the
+(segmentation, morpheme) incidence pairs. The morpho_vars dict and the PRS data
+produced here are identical to those of build_morpholex_db.py.
+
+Not every stage is vectorized. Finding the morphemes contained in each distinct
+segmentation (see build_incidence) takes a regex scan per segmentation, and the
+pairs are gathered in Python lists, which costs about as much as in the python
+engine. The dicts of morpho_vars and the rows of the PRS data are built in
+Python too, once per morpheme and once per row.
+
+NumPy is an optional dependency: load_columns raises ImportError when it is not
+installed, and build_morpholex_db.py --engine numpy then warns and falls back to
+the python engine.
+"""
+
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from build_morpholex_db import (DB_HAL_FREQ_COL, DB_ITEMID_COL, DB_POS_COL,
+                                DB_SBTL_FREQ_COL, DB_SEGM_COL, DB_WORD_COL,
+                                HAPAX_HAL_FREQ_THRESHOLD, HAPAX_SBTL_FREQ_THRESHOLD,
+                                count_family_more_frequent, get_contained_morphemes,
+                                get_morphemes)
+from segm_parser import parse_segmentation
+
+
+class StringColumn:
+    """
+    List-like access to a column of strings stored as one UTF-8 buffer (blob),
+    where the i-th string spans blob[offsets[i]:offsets[i+1]]. The buffer can be
+    a bytearray or a view on a memory map (see snapshot.py).
+    """
+
+    def __init__(self, offsets, blob):
+        self._offsets = offsets
+        self._blob = blob
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return bytes(self._blob[self._offsets[i]:self._offsets[i+1]]).decode('utf-8')
+
+    def __iter__(self):
+        offsets, blob = self._offsets, self._blob
+        for start, end in zip(offsets, offsets[1:]):
+            yield str(blob[start:end], 'utf-8')
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+
+def apply_morpho_vars_to_columns(columns, morpho_vars):
+    """
+    Columnar counterpart of apply_morpho_vars_to_lex_db. Since every morphological
+    variable of a row only depends on its segmentation, the variables are computed
+    once per distinct segmentation and shared by all rows that have it.
+    """
+    res = {}
+    tails = []
+    # {MORPHEME_ID: (SORTED_FAMILY_FREQS, [FAMILY_SIZE, FREQ, P, P*, LENGTH])}
+    morpheme_vars = {}
+    for segm in columns['segms']:
+        parse = parse_segmentation(segm)
+        prs = parse.prs
+        morphemes = parse.morphemes
+        tail = [len(morphemes), ','.join([str(x) for x in prs]), segm]
+        freq = morpho_vars[morphemes[0]]['family'][segm] if morphemes else None
+        for m, m_id in zip(morphemes, parse.ids):
+            if m_id not in morpheme_vars:
+                morpheme_vars[m_id] = (sorted(morpho_vars[m]['family'].values()),
+                                       [morpho_vars[m]['family_size'],
+                                        morpho_vars[m]['hal_freq'],
+                                        morpho_vars[m]['hal_p'],
+                                        morpho_vars[m]['hal_p*'],
+                                        morpho_vars[m]['length']])
+            sorted_freqs, m_vars = morpheme_vars[m_id]
+            n_more_freq = count_family_more_frequent(freq, sorted_freqs)
+            if len(sorted_freqs) == 1:
+                pfmf = 0
+            else:
+                pfmf = (n_more_freq / (len(sorted_freqs)-1)) * 100
+            tail.extend([n_more_freq + 1, pfmf])
+            tail.extend(m_vars)
+        tails.append((prs, tail))
+
+    for itemid, word, pos, segm_id in zip(columns['itemid'], columns['word'],
+                                          columns['pos'], columns['segm_id'].tolist()):
+        prs, tail = tails[segm_id]
+        if prs not in res:
+            res[prs] = []
+        res[prs].append([itemid, word, pos] + tail)
+
+    return res
+
+
+def build_incidence(columns):
+    """
+    Returns the morpheme vocabulary (in order of first appearance in the database)
+    and two aligned integer arrays (segm_ids, morpheme_ids) listing every pair of a
+    distinct segmentation and a morpheme it contains.
+
+    As in get_family and total_morpheme_freq, a segmentation contains a morpheme
+    whenever the morpheme is a substring of it. The pairs are found with a Python
+    loop over the distinct segmentations: only the arrays returned are NumPy.
+    """
+    vocab = {}
+    for segm in columns['segms']:
+        for m in get_morphemes(segm):
+            if m not in vocab:
+                vocab[m] = len(vocab)
+
+    pair_segms = []
+    pair_morphemes = []
+    for segm_id, segm in enumerate(columns['segms']):
+        for m_id in sorted([vocab[m] for m in get_contained_morphemes(segm) if m in vocab]):
+            pair_segms.append(segm_id)
+            pair_morphemes.append(m_id)
+
+    return (list(vocab),
+            np.array(pair_segms, dtype=np.int64),
+            np.array(pair_morphemes, dtype=np.int64))
+
+
+def compute_morphological_variables_columnar(columns):
+    """
+    Columnar counterpart of get_hapax_set followed by
+    compute_morphological_variables. Returns the same morpho_vars dict.
+    """
+    n_segms = len(columns['segms'])
+    hal = columns['hal_freq']
+    hapax_mask = get_hapax_mask(columns)
+    n_hapax = int(hapax_mask.sum())
+
+    # Frequencies are integers: summing them in int64 keeps them exact
+    segm_freqs = np.zeros(n_segms, dtype=np.int64)
+    np.add.at(segm_freqs, columns['segm_id'], hal)
+    segm_hapax_freqs = np.zeros(n_segms, dtype=np.int64)
+    np.add.at(segm_hapax_freqs, columns['segm_id'][hapax_mask], hal[hapax_mask])
+
+    vocab, pair_segms, pair_morphemes = build_incidence(columns)
+    n_morphemes = len(vocab)
+    family_sizes = np.bincount(pair_morphemes, minlength=n_morphemes)
+    morpheme_freqs = np.zeros(n_morphemes, dtype=np.int64)
+    np.add.at(morpheme_freqs, pair_morphemes, segm_freqs[pair_segms])
+    hapax_freqs = np.zeros(n_morphemes, dtype=np.int64)
+    np.add.at(hapax_freqs, pair_morphemes, segm_hapax_freqs[pair_segms])
+
+    # Sort pairs by morpheme, then by segmentation, so that each family is a
+    # contiguous slice ordered by first appearance of its members
+    order = np.lexsort((pair_segms, pair_morphemes))
+    family_segms = pair_segms[order].tolist()
+    family_freqs = segm_freqs[pair_segms[order]].tolist()
+    bounds = np.concatenate(([0], np.cumsum(family_sizes))).tolist()
+
+    morpho_vars = {}
+    segms = columns['segms']
+    for m_id, m in enumerate(vocab):
+        start, end = bounds[m_id], bounds[m_id+1]
+        freq = int(morpheme_freqs[m_id])
+        family = {segms[s]: f for s, f in zip(family_segms[start:end],
+                                              family_freqs[start:end])}
+        morpho_vars[m] = {'hal_freq': freq}
+        morpho_vars[m]['family'] = family
+        morpho_vars[m]['family_size'] = int(family_sizes[m_id])
+        morpho_vars[m]['length'] = len(m) - 2  # -2 because every morpheme is surrounded by brackets
+
+        hapax_freq = int(hapax_freqs[m_id])
+        if hapax_freq == 0:
+            morpho_vars[m]['hal_p'] = 0
+            morpho_vars[m]['hal_p*'] = 0
+        else:
+            morpho_vars[m]['hal_p'] = hapax_freq / freq
+            morpho_vars[m]['hal_p*'] = hapax_freq / n_hapax
+
+    return morpho_vars
+
+
+def get_hapax_mask(columns):
+    """
+    Vectorized counterpart of get_hapax_set: returns a boolean array that is True
+    for the rows that belong to the hapax set.
+    """
+    return ((columns['hal_freq'] <= HAPAX_HAL_FREQ_THRESHOLD)
+            | (columns['sbtl_freq'] <= HAPAX_SBTL_FREQ_THRESHOLD))
+
+
+def load_columns(rows):
+    """
+    Columnar counterpart of the list of preprocessed rows. Takes an iterable of
+    preprocessed rows (LexRow), as generated by stream_lexical_db, and returns
+    a dict of columns.
+    """
+    if np is None:
+        raise ImportError("The columnar engine requires NumPy")
+
+    # The ItemID, Word and POS columns are each one UTF-8 buffer, where the i-th
+    # value ends at offset i+1
+    itemids, words, poss = bytearray(), bytearray(), bytearray()
+    itemid_offsets, word_offsets, pos_offsets = array('q', [0]), array('q', [0]), array('q', [0])
+    hal, sbtl, segm_ids = array('q'), array('d'), array('q')
+    segms = {}
+    for row in rows:
+        segm = row[DB_SEGM_COL]
+        if segm not in segms:
+            segms[segm] = len(segms)
+        itemids += row[DB_ITEMID_COL].encode('utf-8')
+        itemid_offsets.append(len(itemids))
+        words += row[DB_WORD_COL].encode('utf-8')
+        word_offsets.append(len(words))
+        poss += row[DB_POS_COL].encode('utf-8')
+        pos_offsets.append(len(poss))
+        segm_ids.append(segms[segm])
+        # Frequencies were converted to numbers by preprocess_db
+        hal.append(row[DB_HAL_FREQ_COL])
+        sbtl.append(row[DB_SBTL_FREQ_COL])
+
+    return {'itemid': StringColumn(itemid_offsets, itemids),
+            'word': StringColumn(word_offsets, words),
+            'pos': StringColumn(pos_offsets, poss),
+            'segm_id': np.frombuffer(segm_ids, dtype=np.int64),
+            'segms': list(segms),
+            'hal_freq': np.frombuffer(hal, dtype=np.int64),
+            'sbtl_freq': np.frombuffer(sbtl, dtype=np.float64)}
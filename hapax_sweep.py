@@ -0,0 +1,162 @@
+# !/usr/bin/env python
+#  encoding: utf-8
+
+"""
+Sensitivity of P and P* to the hapax thresholds.
+
+A word belongs to the hapax set if its HAL frequency is at most
+HAPAX_HAL_FREQ_THRESHOLD or its SUBTLEX frequency is at most
+HAPAX_SBTL_FREQ_THRESHOLD (see is_hapax). Families and summed frequencies don't
+depend on the thresholds, only the hapax frequencies and the size of the hapax
+set do, so sweep_hapax_thresholds computes P and P* for a whole grid of
+threshold pairs with a single pass over the database and a single indexing of
+the morphemes.
+
+Each row is placed in a cell of the grid: the lowest HAL threshold and the
+lowest SUBTLEX threshold that make it a hapax. The rows that are *not* hapaxes
+at a grid point are those whose cell lies strictly above it on both axes, so the
+hapax frequencies at every grid point are read from 2D cumulative sums of the
+cell frequencies of each morpheme.
+
+Usage:
+
+    python hapax_sweep.py --hal 0 1 2 5 10 --sbtl 0 0.02 0.05 0.1 0.5
+
+writes the P and P* of every morpheme at every grid point to
+output/hapax_sweep.csv, and the size of the hapax set at every grid point to
+output/hapax_sweep_n_hapax.csv.
+"""
+
+from bisect import bisect_left
+import argparse
+import csv
+import itertools
+import os
+
+from build_morpholex_db import (DB_HAL_FREQ_COL, DB_PATH, DB_SBTL_FREQ_COL, DB_SEGM_COL,
+                                PROJECT_PATH, index_segmentations, stream_lexical_db)
+
+
+def get_suffix_sums(cells, n_rows, n_cols):
+    """
+    Takes a dict {(ROW, COL): VALUE}, where 0 <= ROW <= n_rows and
+    0 <= COL <= n_cols, and returns a table where [i][j] is the sum of the
+    values of the cells (a, b) with a >= i and b >= j.
+    """
+    # One extra row and column of zeros spares bound checks
+    table = [[0] * (n_cols + 2) for _ in range(n_rows + 2)]
+    for (a, b), value in cells.items():
+        table[a][b] += value
+    for a in range(n_rows, -1, -1):
+        for b in range(n_cols, -1, -1):
+            table[a][b] += table[a+1][b] + table[a][b+1] - table[a+1][b+1]
+    return table
+
+
+def save_sweep(sweep, output_dir):
+    """
+    Saves the result of sweep_hapax_thresholds to hapax_sweep.csv (one row per
+    morpheme, with P and P* for each threshold pair) and hapax_sweep_n_hapax.csv
+    in output_dir.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    pairs = list(sweep['n_hapax'])
+    with open(os.path.join(output_dir, 'hapax_sweep.csv'), 'w') as f:
+        writer = csv.writer(f)
+        headers = ['Morpheme', 'FamSize', 'Freq_HAL']
+        for h, s in pairs:
+            headers.extend(['P_HAL%s_SBTL%s' % (h, s), 'P*_HAL%s_SBTL%s' % (h, s)])
+        writer.writerow(headers)
+        for m in sorted(sweep['morphemes']):
+            d = sweep['morphemes'][m]
+            row = [m, d['family_size'], d['hal_freq']]
+            for pair in pairs:
+                row.extend(d['p'][pair])
+            writer.writerow(row)
+    with open(os.path.join(output_dir, 'hapax_sweep_n_hapax.csv'), 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(['HAL_threshold', 'SBTL_threshold', 'N_hapax'])
+        for (h, s), n_hapax in sweep['n_hapax'].items():
+            writer.writerow([h, s, n_hapax])
+
+
+def sweep_hapax_thresholds(db, threshold_pairs):
+    """
+    Computes P and P* of every morpheme of db for each (HAL_THRESHOLD,
+    SBTL_THRESHOLD) pair of threshold_pairs, in a single pass over db, which
+    can be a stream such as the one returned by stream_lexical_db.
+    Returns a dict with two keys:
+
+    - 'n_hapax': {PAIR: size of the hapax set}
+    - 'morphemes': {MORPHEME: {'family_size': ..., 'hal_freq': ...,
+      'p': {PAIR: (P, P*)}}}
+
+    For each pair, the values are those compute_morphological_variables
+    returns with these thresholds.
+    """
+    threshold_pairs = list(dict.fromkeys(threshold_pairs))
+    hal_thresholds = sorted({h for h, _ in threshold_pairs})
+    sbtl_thresholds = sorted({s for _, s in threshold_pairs})
+
+    # 1. Sum the HAL frequencies of the rows of each segmentation, by cell
+    segm_freqs = {}
+    segm_cells = {}
+    row_cells = {}
+    for row in db:
+        segm = row[DB_SEGM_COL]
+        # The row is a hapax at grid point (i, j) iff i >= a or j >= b
+        cell = (bisect_left(hal_thresholds, row[DB_HAL_FREQ_COL]),
+                bisect_left(sbtl_thresholds, row[DB_SBTL_FREQ_COL]))
+        if segm not in segm_freqs:
+            segm_freqs[segm] = 0
+            segm_cells[segm] = {}
+        segm_freqs[segm] += row[DB_HAL_FREQ_COL]
+        segm_cells[segm][cell] = segm_cells[segm].get(cell, 0) + row[DB_HAL_FREQ_COL]
+        row_cells[cell] = row_cells.get(cell, 0) + 1
+
+    # 2. Index the unique segmentations once
+    contained = {}
+    index = index_segmentations(segm_freqs, {}, contained)
+    morpheme_cells = {m: {} for m in index}
+    for segm, cells in segm_cells.items():
+        for m in contained[segm]:
+            m_cells = morpheme_cells[m]
+            for cell, freq in cells.items():
+                m_cells[cell] = m_cells.get(cell, 0) + freq
+
+    # 3. Read the grid points from the cumulative sums
+    n_h, n_s = len(hal_thresholds), len(sbtl_thresholds)
+    points = [(pair, bisect_left(hal_thresholds, pair[0]) + 1,
+               bisect_left(sbtl_thresholds, pair[1]) + 1) for pair in threshold_pairs]
+    n_rows = sum(row_cells.values())
+    not_hapax = get_suffix_sums(row_cells, n_h, n_s)
+    n_hapax = {pair: n_rows - not_hapax[i][j] for pair, i, j in points}
+
+    morphemes = {}
+    for m, entry in index.items():
+        freq = entry['hal_freq']
+        not_hapax = get_suffix_sums(morpheme_cells[m], n_h, n_s)
+        p = {}
+        for pair, i, j in points:
+            hapax_freq = freq - not_hapax[i][j]
+            if hapax_freq == 0:
+                p[pair] = (0, 0)
+            else:
+                p[pair] = (hapax_freq / freq, hapax_freq / n_hapax[pair])
+        morphemes[m] = {'family_size': len(entry['family']), 'hal_freq': freq, 'p': p}
+
+    return {'n_hapax': n_hapax, 'morphemes': morphemes}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compute P and P* for a grid of hapax thresholds.')
+    parser.add_argument('--hal', type=int, nargs='+', required=True,
+                        help='HAL frequency thresholds')
+    parser.add_argument('--sbtl', type=float, nargs='+', required=True,
+                        help='SUBTLEX frequency thresholds')
+    args = parser.parse_args()
+
+    sweep = sweep_hapax_thresholds(stream_lexical_db(DB_PATH),
+                                   itertools.product(args.hal, args.sbtl))
+    save_sweep(sweep, os.path.join(PROJECT_PATH, 'output'))
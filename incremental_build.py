@@ -0,0 +1,226 @@
+# !/usr/bin/env python
+#  encoding: utf-8
+
+"""
+Incremental rebuild of the MorphoLex database after segmentation fixes.
+
+Every full build run with --incremental leaves a state file next to the PRS
+output files. It holds the rows of the run (by ELP ItemID), the HAL frequencies
+summed by segmentation and the morpheme index (see index_segmentations).
+
+On the next run, the new input is compared with the stored rows by ItemID:
+changed segmentations, changed frequencies, and added or removed rows. Only the
+morphemes contained in the segmentations of those rows (plus morphemes that did
+not exist before) get their family, frequency, P and P* recomputed,
+and only the PRS files holding at least one row that uses such a morpheme are
+rewritten. The results are identical to those of a full build.
+
+When the rows were reordered, a full build is done instead, since the order of
+morphemes and family members follows the order of the rows. So is a state saved
+with other hapax thresholds or another version of the code that computes it
+(see get_state_fingerprint).
+
+The state of one version of the database can also be the starting point of the
+build of another version that shares most of its rows (see batch_build.py).
+"""
+
+import os
+import pickle
+import re
+
+from build_morpholex_db import (DB_HAL_FREQ_COL, DB_ITEMID_COL, DB_POS_COL,
+                                DB_SBTL_FREQ_COL, DB_SEGM_COL, DB_WORD_COL,
+                                aggregate_segmentations, get_contained_morphemes,
+                                get_morphemes, get_morpho_vars_from_index,
+                                get_PRS_signature,
+                                index_segmentations, iter_morpho_vars_rows,
+                                save_prs_data_to_files, stream_lexical_db)
+from snapshot import get_code_fingerprint
+
+STATE_FILENAME = 'morpholex_state.pickle'
+# Source files whose content is part of the fingerprint of the state
+FINGERPRINTED_SOURCES = ('segm_parser.py', 'incremental_build.py')
+
+
+def build_state(db):
+    """
+    Computes the state of a full build from preprocessed rows.
+    """
+    items, order = get_items(db)
+    segm_freqs, segm_hapax_freqs, n_hapax = aggregate_segmentations(db)
+    return {'fingerprint': get_state_fingerprint(),
+            'items': items,
+            'order': order,
+            'segm_freqs': segm_freqs,
+            'segm_hapax_freqs': segm_hapax_freqs,
+            'n_hapax': n_hapax,
+            'index': index_segmentations(segm_freqs, segm_hapax_freqs)}
+
+
+def get_items(db):
+    """
+    Returns a dict {ITEMID: (WORD, POS, HAL_FREQ, SBTL_FREQ, SEGM)} and the list of
+    ItemIDs in database order.
+    """
+    items = {}
+    order = []
+    for row in db:
+        items[row[DB_ITEMID_COL]] = (row[DB_WORD_COL], row[DB_POS_COL],
+                                     row[DB_HAL_FREQ_COL], row[DB_SBTL_FREQ_COL],
+                                     row[DB_SEGM_COL])
+        order.append(row[DB_ITEMID_COL])
+    return items, order
+
+
+def get_state_fingerprint():
+    """
+    Returns a hash of the hapax thresholds and of the code the state is
+    computed with: a state with another fingerprint can't be updated.
+    """
+    return get_code_fingerprint(FINGERPRINTED_SOURCES)
+
+
+def load_state(output_dir):
+    """
+    Returns the state saved by the previous run in output_dir, or None.
+    """
+    filepath = os.path.join(output_dir, STATE_FILENAME)
+    if not os.path.exists(filepath):
+        return None
+    with open(filepath, 'rb') as f:
+        return pickle.load(f)
+
+
+def run_incremental_build(db_path, output_dir, base_dir=None):
+    """
+    Updates the PRS files in output_dir for the database at db_path, recomputing
+    only what changed since the previous run. Falls back to a full build when
+    there is no usable previous state.
+    If output_dir has no state, the state saved in base_dir by the build of
+    another version of the database is updated instead, and every PRS file is
+    written.
+    Returns the morpho_vars dict.
+    """
+    db = list(stream_lexical_db(db_path))
+    old_state = load_state(output_dir)
+    own_state = old_state is not None
+    if not own_state and base_dir is not None:
+        old_state = load_state(base_dir)
+    update = update_state(old_state, db) if old_state is not None else None
+
+    if update is None:
+        print('full build')
+        state = build_state(db)
+        dirty_prs = None
+    elif own_state:
+        state, dirty_prs = update
+        print('{} PRS file(s) to rewrite'.format(len(dirty_prs)))
+    else:
+        # The PRS files of base_dir are not in output_dir
+        state, dirty_prs = update[0], None
+        print('reusing the morpheme index of {}'.format(base_dir))
+
+    morpho_vars = get_morpho_vars_from_index(state['index'], state['n_hapax'])
+    if dirty_prs is None:
+        save_prs_data_to_files(iter_morpho_vars_rows(db, morpho_vars), output_dir)
+    elif dirty_prs:
+        dirty_rows = [row for row in db if get_PRS_signature(row[DB_SEGM_COL]) in dirty_prs]
+        save_prs_data_to_files(iter_morpho_vars_rows(dirty_rows, morpho_vars), output_dir)
+        # Remove files of PRS signatures that are no longer in the database
+        written = {get_PRS_signature(row[DB_SEGM_COL]) for row in dirty_rows}
+        for prs in dirty_prs - written:
+            prs_str = re.sub(r'[,()]', '', str(prs))
+            savepath = os.path.join(output_dir, '%s.csv' % prs_str)
+            if os.path.exists(savepath):
+                os.remove(savepath)
+
+    save_state(state, output_dir)
+    return morpho_vars
+
+
+def save_state(state, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, STATE_FILENAME), 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def update_state(old_state, db):
+    """
+    Computes the state for the preprocessed rows of db from the state of the
+    previous run. Returns (state, dirty_prs), where dirty_prs is the set of PRS
+    signatures whose output file must be rewritten, or None if a full build is
+    needed.
+    """
+    if old_state.get('fingerprint') != get_state_fingerprint():
+        return None
+    items, order = get_items(db)
+    old_items = old_state['items']
+    if len(items) != len(order):
+        return None  # Duplicate ItemIDs
+    if [i for i in order if i in old_items] != [i for i in old_state['order'] if i in items]:
+        return None
+
+    segm_freqs, segm_hapax_freqs, n_hapax = aggregate_segmentations(db)
+
+    # Segmentations of the rows that were added, removed or changed. Since the
+    # other rows kept their relative order, these are the only segmentations
+    # whose frequencies or position of first appearance may have changed.
+    changed_segms = set()
+    for i, item in items.items():
+        if old_items.get(i) != item:
+            changed_segms.add(item[-1])
+    for i, item in old_items.items():
+        if items.get(i) != item:
+            changed_segms.add(item[-1])
+    # Segmentations whose hapax frequency changed
+    old_segm_hapax_freqs = old_state['segm_hapax_freqs']
+    for segm in set(segm_hapax_freqs) | set(old_segm_hapax_freqs):
+        if segm_hapax_freqs.get(segm, 0) != old_segm_hapax_freqs.get(segm, 0):
+            changed_segms.add(segm)
+
+    vocab = {}
+    for segm in segm_freqs:
+        for m in get_morphemes(segm):
+            vocab[m] = None
+
+    # Morphemes whose family changed, and new morphemes, which may be contained
+    # in segmentations that did not change
+    old_index = old_state['index']
+    affected = {m for m in vocab if m not in old_index}
+    for segm in changed_segms:
+        affected.update([m for m in get_contained_morphemes(segm) if m in vocab])
+
+    segm_positions = {s: i for i, s in enumerate(segm_freqs)}
+    index = {}
+    for m in vocab:
+        if m not in affected:
+            index[m] = old_index[m]
+            continue
+        if m in old_index:
+            members = {s for s in old_index[m]['family'] if s in segm_freqs}
+            members.update([s for s in changed_segms if s in segm_freqs and m in s])
+        else:
+            members = [s for s in segm_freqs if m in s]
+        family = {s: segm_freqs[s] for s in sorted(members, key=segm_positions.get)}
+        index[m] = {'family': family,
+                    'hal_freq': sum(family.values()),
+                    'hapax_freq': sum([segm_hapax_freqs.get(s, 0) for s in family])}
+
+    if n_hapax != old_state['n_hapax']:
+        # Every P* depends on the size of the hapax set. Signatures whose last
+        # rows were removed come from changed_segms: their files must be removed
+        dirty_prs = {get_PRS_signature(s) for s in set(segm_freqs) | changed_segms}
+    else:
+        dirty_segms = set(changed_segms)
+        for m in affected:
+            dirty_segms.update(index[m]['family'])
+        dirty_prs = {get_PRS_signature(s) for s in dirty_segms}
+
+    state = {'fingerprint': old_state['fingerprint'],
+             'items': items,
+             'order': order,
+             'segm_freqs': segm_freqs,
+             'segm_hapax_freqs': segm_hapax_freqs,
+             'n_hapax': n_hapax,
+             'index': index}
+    return state, dirty_prs
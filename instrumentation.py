@@ -0,0 +1,199 @@
+# !/usr/bin/env python
+#  encoding: utf-8
+
+"""
+Lightweight instrumentation for build_morpholex_db.py and fix_segmentation.py.
+
+A RunReport records, for each stage of a run, its wall time, the number of
+rows it processed (and so its throughput), its memory use and any counters the
+stage sets. Memory is measured with the peak resident set size of the process,
+which never decreases: a stage reports that peak at its end (the peak of the
+whole run so far, not of the stage), and how much the stage raised it. A stage
+that only reuses memory freed by earlier stages raises it by 0.
+The peak of the process doesn't count the memory of its worker processes (see
+--workers), so the largest peak of the workers that have exited is reported
+next to it, the same way.
+
+    report = RunReport('build_morpholex_db')
+    with report.stage('preprocess_db') as stage:
+        db = preprocess_db(db)
+        stage.rows = len(db)
+        stage.counters['distinct_segmentations'] = len({...})
+    report.save('output/run_report.json')
+
+progress wraps an iterable and reports how far it got on stderr, at most once
+per PROGRESS_INTERVAL seconds, so that it costs next to nothing per row.
+
+start_profiler and stop_profiler optionally run the code in between under
+cProfile.
+"""
+
+from contextlib import contextmanager
+import cProfile
+import json
+import os
+import platform
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Windows
+
+PROGRESS_INTERVAL = 1.0
+
+
+class Stage:
+    """
+    Measurements of one stage of a run. rows and counters can be set by the
+    code of the stage.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = None
+        self.counters = {}
+        self.seconds = None
+        self.process_peak_rss = None
+        self.peak_rss_increase = None
+        self.children_peak_rss = None
+        self.children_peak_rss_increase = None
+
+    def to_dict(self):
+        d = {'stage': self.name, 'seconds': self.seconds, 'rows': self.rows,
+             'rows_per_second': None, 'process_peak_rss_bytes': self.process_peak_rss,
+             'peak_rss_increase_bytes': self.peak_rss_increase,
+             'children_peak_rss_bytes': self.children_peak_rss,
+             'children_peak_rss_increase_bytes': self.children_peak_rss_increase,
+             'counters': self.counters}
+        if self.rows is not None and self.seconds:
+            d['rows_per_second'] = self.rows / self.seconds
+        return d
+
+
+class RunReport:
+    """
+    Collects the stages of a run, and saves them as a JSON report.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = []
+        self.counters = {}
+        self._start = time.perf_counter()
+        self._started_at = time.strftime('%Y-%m-%dT%H:%M:%S')
+
+    @contextmanager
+    def stage(self, name):
+        s = Stage(name)
+        start = time.perf_counter()
+        start_peak_rss = get_peak_rss()
+        start_children_peak_rss = get_peak_rss(children=True)
+        try:
+            yield s
+        finally:
+            s.seconds = time.perf_counter() - start
+            s.process_peak_rss = get_peak_rss()
+            if s.process_peak_rss is not None:
+                s.peak_rss_increase = s.process_peak_rss - start_peak_rss
+            s.children_peak_rss = get_peak_rss(children=True)
+            if s.children_peak_rss is not None:
+                s.children_peak_rss_increase = s.children_peak_rss - start_children_peak_rss
+            self.stages.append(s)
+
+    def to_dict(self):
+        return {'run': self.name,
+                'started_at': self._started_at,
+                'seconds': time.perf_counter() - self._start,
+                'process_peak_rss_bytes': get_peak_rss(),
+                'children_peak_rss_bytes': get_peak_rss(children=True),
+                'python': platform.python_version(),
+                'argv': sys.argv,
+                'counters': self.counters,
+                'stages': [s.to_dict() for s in self.stages]}
+
+    def save(self, filepath):
+        os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+        with open(filepath, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+def get_cache_counters(cached_function):
+    """
+    Returns the hits, misses and size of the cache of a functools.lru_cache
+    decorated function as a dict.
+    """
+    info = cached_function.cache_info()
+    return {'cache_hits': info.hits, 'cache_misses': info.misses,
+            'cache_size': info.currsize}
+
+
+def get_peak_rss(children=False):
+    """
+    Returns the peak resident set size of the process in bytes, or None if it
+    can't be measured on this platform. If children is True, returns instead
+    the largest peak of its child processes that have exited and been waited
+    for (0 if there are none).
+    """
+    if resource is None:
+        return None
+    who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+    peak = resource.getrusage(who).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def progress(iterable, label, total=None, stream=sys.stderr):
+    """
+    Generates the items of iterable, and writes the number of items seen so far
+    to stream at most once per PROGRESS_INTERVAL seconds, and once at the end.
+    """
+    if total is None and hasattr(iterable, '__len__'):
+        total = len(iterable)
+    # The clock is only read every `step` items
+    step = 256
+    n = 0
+    last = time.monotonic()
+
+    def write():
+        if total:
+            stream.write('\r%s: %d / %d' % (label, n, total))
+        else:
+            stream.write('\r%s: %d' % (label, n))
+        stream.flush()
+
+    for item in iterable:
+        yield item
+        n += 1
+        if n % step == 0:
+            now = time.monotonic()
+            if now - last >= PROGRESS_INTERVAL:
+                last = now
+                write()
+    write()
+    stream.write('\n')
+
+
+def start_profiler(enabled=True):
+    """
+    Returns a running cProfile profiler, or None if enabled is False.
+    """
+    if not enabled:
+        return None
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def stop_profiler(profiler, filepath):
+    """
+    Stops a profiler returned by start_profiler and dumps its statistics to
+    filepath, to be read with pstats or snakeviz. Does nothing if profiler is
+    None.
+    """
+    if profiler is None:
+        return
+    profiler.disable()
+    os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+    profiler.dump_stats(filepath)
@@ -0,0 +1,258 @@
+# !/usr/bin/env python
+#  encoding: utf-8
+
+"""
+Browse the morphemes of MorphoLex and their families without loading
+morpho_vars.json.
+
+The index is built from the morpho_vars dict (build_morpholex_db.py
+--morpheme-index) and saved as a snapshot file (see snapshot.py), which
+MorphemeIndex memory-maps. It holds:
+
+- the morphemes sorted by their form without brackets (then by role), for
+  exact and prefix lookups by binary search
+- secondary orders of the morphemes by (role, family size), (role, HAL
+  frequency) and (role, length), for range queries
+- the family of each morpheme, sorted by decreasing HAL frequency
+
+Library use:
+
+    with MorphemeIndex('output/morpheme_index.index') as index:
+        index.lookup('(act)')
+        index.search_prefix('graph')
+        index.search_range('family_size', 10, 50, role='suffix')
+        index.get_family('(act)', limit=20)
+
+Command line use:
+
+    python morpheme_index.py output/morpheme_index.index --prefix graph
+    python morpheme_index.py output/morpheme_index.index --range family_size 10 50 --role suffix
+    python morpheme_index.py output/morpheme_index.index --family '(act)' --limit 20
+"""
+
+import argparse
+import json
+
+from segm_parser import BRACKET_ROLES as ROLE_BRACKETS, ROLE_NAMES as ROLES
+from snapshot import Snapshot, get_number, write_snapshot
+
+# Morpheme attributes that can be queried by range, and their section
+RANGE_ATTRIBUTES = {'family_size': 'fam_size', 'freq': 'freq', 'length': 'length'}
+# Keys of the entries of MorphemeIndex that hold the range attributes
+RANGE_KEYS = {'family_size': 'FamSize', 'freq': 'Freq_HAL', 'length': 'length'}
+
+
+class MorphemeIndex:
+    """
+    Read-only access to a morpheme index file.
+    """
+
+    def __init__(self, filepath):
+        self._snap = Snapshot(filepath)
+        get = self._snap.get
+        self._morphemes = get('morphemes')
+        self._bare = get('bare')
+        self._roles = get('role')
+        self._values = {attribute: get(section)
+                        for attribute, section in RANGE_ATTRIBUTES.items()}
+        self._ps = get('p')
+        self._p_is_int = get('p_is_int')
+        self._p_stars = get('p_star')
+        self._p_star_is_int = get('p_star_is_int')
+        self._orders = {attribute: get(section + '_order')
+                        for attribute, section in RANGE_ATTRIBUTES.items()}
+        self._family_offsets = get('family_offsets')
+        self._family_members = get('family_members')
+        self._segms = get('segms')
+        self._segm_freqs = get('segm_freqs')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        # Views on the memory map must be released before it can be closed
+        for name in list(vars(self)):
+            if name != '_snap':
+                delattr(self, name)
+        self._snap.close()
+
+    def get_entry(self, i):
+        """
+        Returns the variables of the i-th morpheme of the index as a dict.
+        """
+        return {'Morpheme': self._morphemes[i],
+                'role': ROLES[self._roles[i]],
+                'FamSize': self._values['family_size'][i],
+                'Freq_HAL': self._values['freq'][i],
+                'P': get_number(self._ps, self._p_is_int, i),
+                'P*': get_number(self._p_stars, self._p_star_is_int, i),
+                'length': self._values['length'][i]}
+
+    def get_family(self, morpheme, limit=None):
+        """
+        Returns the family of morpheme (with its brackets, e.g. '(act)') as a
+        list of (SEGM, HAL_FREQUENCY) pairs sorted by decreasing frequency, or
+        None if the morpheme is not in the index.
+        """
+        i = self._find(morpheme)
+        if i is None:
+            return None
+        start, end = self._family_offsets[i], self._family_offsets[i+1]
+        if limit is not None:
+            end = min(end, start + limit)
+        return [(self._segms[s], self._segm_freqs[s])
+                for s in self._family_members[start:end]]
+
+    def lookup(self, morpheme):
+        """
+        Returns the entry of morpheme (with its brackets, e.g. '(act)'), or None.
+        """
+        i = self._find(morpheme)
+        return self.get_entry(i) if i is not None else None
+
+    def search_prefix(self, prefix, role=None):
+        """
+        Returns the entries of the morphemes whose form (without brackets)
+        starts with prefix, in alphabetical order, optionally only those of the
+        given role ('prefix', 'root' or 'suffix').
+        """
+        bare = self._bare
+        i = _bisect(len(bare), bare.__getitem__, prefix)
+        entries = []
+        while i < len(bare) and bare[i].startswith(prefix):
+            if role is None or ROLES[self._roles[i]] == role:
+                entries.append(self.get_entry(i))
+            i += 1
+        return entries
+
+    def search_range(self, attribute, low, high, role=None):
+        """
+        Returns the entries of the morphemes whose attribute ('family_size',
+        'freq' or 'length') is between low and high (inclusive), in increasing
+        order of attribute, optionally only those of the given role.
+        """
+        values = self._values[attribute]
+        order = self._orders[attribute]
+        roles = self._roles
+
+        def key_at(k):
+            return roles[order[k]], values[order[k]]
+
+        entries = []
+        for r in ([ROLES.index(role)] if role is not None else range(len(ROLES))):
+            start = _bisect(len(order), key_at, (r, low))
+            end = _bisect(len(order), key_at, (r, high), right=True)
+            entries.extend(self.get_entry(order[k]) for k in range(start, end))
+        if role is None:
+            entries.sort(key=lambda e: e[RANGE_KEYS[attribute]])
+        return entries
+
+    def _find(self, morpheme):
+        bare, role = morpheme[1:-1], ROLE_BRACKETS.get(morpheme[:1])
+        if role is None:
+            return None
+        i = _bisect(len(self._bare), lambda k: (self._bare[k], self._roles[k]),
+                    (bare, role))
+        # Morphemes that only differ by their closing bracket share the same
+        # (bare, role) key
+        while i < len(self._bare) and self._bare[i] == bare and self._roles[i] == role:
+            if self._morphemes[i] == morpheme:
+                return i
+            i += 1
+        return None
+
+
+def build_morpheme_index_file(filepath, morpho_vars):
+    """
+    Saves a morpheme index to filepath from the morpho_vars dict of
+    compute_morphological_variables.
+    """
+    morphemes = sorted(morpho_vars, key=lambda m: (m[1:-1], ROLE_BRACKETS[m[0]]))
+    roles = [ROLE_BRACKETS[m[0]] for m in morphemes]
+
+    segms = {}
+    segm_freqs = []
+    family_offsets = [0]
+    family_members = []
+    for m in morphemes:
+        family = morpho_vars[m]['family']
+        for segm in family:
+            if segm not in segms:
+                segms[segm] = len(segms)
+                segm_freqs.append(family[segm])
+        # sorted is stable: members of equal frequency keep their order
+        family_members.extend(segms[s] for s in sorted(family, key=lambda s: -family[s]))
+        family_offsets.append(len(family_members))
+
+    sections = {
+        'morphemes': ('s', morphemes),
+        'bare': ('s', [m[1:-1] for m in morphemes]),
+        'role': ('q', roles),
+        'fam_size': ('q', [morpho_vars[m]['family_size'] for m in morphemes]),
+        'freq': ('q', [morpho_vars[m]['hal_freq'] for m in morphemes]),
+        'length': ('q', [morpho_vars[m]['length'] for m in morphemes]),
+        'p': ('d', [morpho_vars[m]['hal_p'] for m in morphemes]),
+        'p_is_int': ('b', [isinstance(morpho_vars[m]['hal_p'], int) for m in morphemes]),
+        'p_star': ('d', [morpho_vars[m]['hal_p*'] for m in morphemes]),
+        'p_star_is_int': ('b', [isinstance(morpho_vars[m]['hal_p*'], int)
+                                for m in morphemes]),
+        'family_offsets': ('q', family_offsets),
+        'family_members': ('q', family_members),
+        'segms': ('s', list(segms)),
+        'segm_freqs': ('q', segm_freqs),
+    }
+    for section in RANGE_ATTRIBUTES.values():
+        values = sections[section][1]
+        sections[section + '_order'] = ('q', sorted(range(len(morphemes)),
+                                                   key=lambda i: (roles[i], values[i])))
+    write_snapshot(filepath, {'kind': 'morpheme_index'}, sections)
+
+
+def _bisect(n, key_at, key, right=False):
+    """
+    Returns the first k in range(n) such that key_at(k) >= key (> key if right),
+    where key_at(k) is increasing.
+    """
+    lo, hi = 0, n
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if key_at(mid) < key or (right and key_at(mid) == key):
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Browse the morphemes of MorphoLex.')
+    parser.add_argument('index', help='path to the morpheme index file')
+    query = parser.add_mutually_exclusive_group(required=True)
+    query.add_argument('--morpheme', help="variables of a morpheme, e.g. '(act)'")
+    query.add_argument('--prefix', help='morphemes whose form starts with this prefix')
+    query.add_argument('--range', nargs=3, metavar=('ATTRIBUTE', 'LOW', 'HIGH'),
+                       help='morphemes whose family_size, freq or length is between '
+                            'LOW and HIGH')
+    query.add_argument('--family', help="family of a morpheme, e.g. '(act)', sorted by "
+                                        "decreasing frequency")
+    parser.add_argument('--role', choices=ROLES, help='only morphemes of this role')
+    parser.add_argument('--limit', type=int, default=None,
+                        help='maximum number of family members')
+    args = parser.parse_args()
+    if args.range and args.range[0] not in RANGE_ATTRIBUTES:
+        parser.error('ATTRIBUTE must be one of %s' % ', '.join(RANGE_ATTRIBUTES))
+
+    with MorphemeIndex(args.index) as index:
+        if args.morpheme is not None:
+            print(json.dumps(index.lookup(args.morpheme)))
+        elif args.prefix is not None:
+            for entry in index.search_prefix(args.prefix, args.role):
+                print(json.dumps(entry))
+        elif args.range:
+            attribute, low, high = args.range
+            for entry in index.search_range(attribute, int(low), int(high), args.role):
+                print(json.dumps(entry))
+        else:
+            print(json.dumps(index.get_family(args.family, args.limit)))
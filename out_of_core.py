@@ -0,0 +1,238 @@
+# !/usr/bin/env python
+#  encoding: utf-8
+
+"""
+Out-of-core build of the MorphoLex database, for lexicons that don't fit in
+memory (build_morpholex_db.py --out-of-core).
+
+The in-memory build keeps every row, the hapax set and the family of every
+morpheme in memory. Here, everything that grows with the lexicon lives in a
+temporary SQLite store, and SQLite sorts and aggregates it with external merges
+when it doesn't fit in its page cache:
+
+1. The CSV file is streamed once, and the HAL and hapax frequencies of each
+   segmentation are summed into the segms table, by batches.
+2. The distinct segmentations are parsed once: their morphemes make up the
+   vocabulary, and every morpheme-shaped substring of a segmentation is a
+   candidate family membership (see get_contained_morphemes). Candidates that
+   are in the vocabulary become the (morpheme, segmentation, frequency) triples
+   of the members table.
+3. Family sizes and summed frequencies are GROUP BY aggregates of the triples,
+   and the family frequency rank (FFR) of each triple is a RANK() window over
+   the family, in decreasing order of frequency.
+4. The CSV file is streamed again, and each row is written to its PRS file
+   with the variables of its segmentation, read from the store. The variables
+   of the most recently seen segmentations are cached.
+
+Memory use is bounded by the budget passed to build_out_of_core, which is shared
+between the SQLite page cache, the aggregation batches and the cache of
+segmentation variables. The output is identical to that of the in-memory build.
+"""
+
+from collections import OrderedDict
+import os
+import sqlite3
+import tempfile
+
+from build_morpholex_db import (DB_HAL_FREQ_COL, DB_ITEMID_COL, DB_POS_COL, DB_SEGM_COL,
+                                DB_WORD_COL, get_contained_morphemes, is_hapax,
+                                save_prs_data_to_files, stream_lexical_db)
+from segm_parser import parse_segmentation
+
+DEFAULT_MEMORY_BUDGET = 512 * 2**20
+# Rough memory cost of a pending segmentation in an aggregation batch, and of a
+# cached row tail, in bytes
+SEGM_ENTRY_SIZE = 300
+TAIL_ENTRY_SIZE = 1000
+
+SCHEMA = """
+CREATE TABLE segms (
+    id INTEGER PRIMARY KEY,
+    segm TEXT UNIQUE,
+    freq INTEGER,
+    hapax_freq INTEGER
+);
+CREATE TABLE morphemes (
+    id INTEGER PRIMARY KEY,
+    morpheme TEXT UNIQUE
+);
+CREATE TABLE candidates (
+    morpheme TEXT,
+    segm_id INTEGER
+);
+"""
+
+
+def aggregate_segmentations_on_disk(conn, db, batch_size):
+    """
+    Sums the HAL frequencies of the rows of db that share a segmentation into
+    the segms table, like aggregate_segmentations, holding at most batch_size
+    segmentations in memory. Returns the size of the hapax set.
+    """
+    n_hapax = 0
+    batch = {}
+
+    def flush():
+        conn.executemany('INSERT INTO segms (segm, freq, hapax_freq) VALUES (?, ?, ?) '
+                         'ON CONFLICT (segm) DO UPDATE SET '
+                         'freq = freq + excluded.freq, '
+                         'hapax_freq = hapax_freq + excluded.hapax_freq',
+                         ((segm, f, h) for segm, (f, h) in batch.items()))
+        batch.clear()
+
+    for row in db:
+        segm = row[DB_SEGM_COL]
+        freqs = batch.get(segm)
+        if freqs is None:
+            if len(batch) >= batch_size:
+                flush()
+            freqs = batch[segm] = [0, 0]
+        freqs[0] += row[DB_HAL_FREQ_COL]
+        if is_hapax(row):
+            freqs[1] += row[DB_HAL_FREQ_COL]
+            n_hapax += 1
+    flush()
+    return n_hapax
+
+
+def build_out_of_core(db_path, output_dir, memory_budget=DEFAULT_MEMORY_BUDGET,
+                      work_dir=None):
+    """
+    Builds the PRS files of the lexical database at db_path into output_dir,
+    like save_prs_data_to_files(iter_morpho_vars_rows(...)), with memory use
+    bounded by memory_budget (in bytes). The temporary store is created in
+    work_dir (default: the system's temporary directory) and removed at the end.
+    Returns a dict of counts (rows, segmentations, morphemes, hapax).
+    """
+    fd, store_path = tempfile.mkstemp(suffix='.sqlite', dir=work_dir)
+    os.close(fd)
+    conn = sqlite3.connect(store_path)
+    try:
+        # The store is thrown away at the end, so there is no point in journaling
+        conn.execute('PRAGMA journal_mode = OFF')
+        conn.execute('PRAGMA synchronous = OFF')
+        # Sorts and temporary indexes spill to disk instead of memory
+        conn.execute('PRAGMA temp_store = FILE')
+        conn.execute('PRAGMA cache_size = -%d' % max(memory_budget // 2 // 1024, 1024))
+        conn.executescript(SCHEMA)
+
+        with conn:
+            n_hapax = aggregate_segmentations_on_disk(
+                conn, stream_lexical_db(db_path),
+                max(memory_budget // 4 // SEGM_ENTRY_SIZE, 1000))
+        with conn:
+            index_families_on_disk(conn)
+        counts = {
+            'hapax': n_hapax,
+            'segmentations': conn.execute('SELECT COUNT(*) FROM segms').fetchone()[0],
+            'morphemes': conn.execute('SELECT COUNT(*) FROM morphemes').fetchone()[0]}
+
+        n_rows = 0
+
+        def count_rows(rows):
+            nonlocal n_rows
+            for row in rows:
+                n_rows += 1
+                yield row
+
+        prs_rows = iter_out_of_core_rows(conn, count_rows(stream_lexical_db(db_path)),
+                                         n_hapax,
+                                         max(memory_budget // 4 // TAIL_ENTRY_SIZE, 1000))
+        save_prs_data_to_files(prs_rows, output_dir)
+        counts['rows'] = n_rows
+    finally:
+        conn.close()
+        os.remove(store_path)
+    return counts
+
+
+def index_families_on_disk(conn):
+    """
+    Fills the morphemes table with the vocabulary of the segms table, and builds
+    the ranks table, which gives the family frequency rank of each
+    (segmentation, morpheme) pair, and the families table, which holds the
+    family size and summed frequencies of each morpheme.
+    """
+    cursor = conn.execute('SELECT id, segm FROM segms')
+    while True:
+        segms = cursor.fetchmany(10000)
+        if not segms:
+            break
+        conn.executemany('INSERT OR IGNORE INTO morphemes (morpheme) VALUES (?)',
+                         ((m,) for _, segm in segms
+                          for m in parse_segmentation(segm).morphemes))
+        conn.executemany('INSERT INTO candidates VALUES (?, ?)',
+                         ((m, segm_id) for segm_id, segm in segms
+                          for m in get_contained_morphemes(segm)))
+
+    conn.executescript("""
+        CREATE TABLE members AS
+            SELECT m.id AS morpheme_id, c.segm_id AS segm_id, s.freq AS freq,
+                   s.hapax_freq AS hapax_freq
+            FROM candidates c
+            JOIN morphemes m ON m.morpheme = c.morpheme
+            JOIN segms s ON s.id = c.segm_id;
+        DROP TABLE candidates;
+        CREATE TABLE families AS
+            SELECT morpheme_id, COUNT(*) AS family_size, SUM(freq) AS freq,
+                   SUM(hapax_freq) AS hapax_freq
+            FROM members GROUP BY morpheme_id;
+        CREATE UNIQUE INDEX families_morpheme_id ON families (morpheme_id);
+        CREATE TABLE ranks AS
+            SELECT segm_id, morpheme_id,
+                   RANK() OVER (PARTITION BY morpheme_id ORDER BY freq DESC) AS ffr
+            FROM members;
+        DROP TABLE members;
+        CREATE INDEX ranks_segm_id ON ranks (segm_id);
+    """)
+
+
+def iter_out_of_core_rows(conn, db, n_hapax, cache_size):
+    """
+    Generates the (PRS_signature, lexical_data) pairs of iter_morpho_vars_rows
+    for every row of db, reading the variables of each segmentation from the
+    store. The variables of the last cache_size segmentations are cached.
+    """
+    tails = OrderedDict()
+    for row in db:
+        segm = row[DB_SEGM_COL]
+        if segm in tails:
+            tails.move_to_end(segm)
+            prs, tail = tails[segm]
+        else:
+            prs, tail = get_segmentation_tail(conn, segm, n_hapax)
+            tails[segm] = prs, tail
+            if len(tails) > cache_size:
+                tails.popitem(last=False)
+        yield prs, (row[DB_ITEMID_COL], row[DB_WORD_COL], row[DB_POS_COL]) + tail
+
+
+def get_segmentation_tail(conn, segm, n_hapax):
+    """
+    Returns the PRS signature of segm, and the part of its rows that only depends
+    on the segmentation (see iter_morpho_vars_rows).
+    """
+    found = {}
+    for m, ffr, family_size, freq, hapax_freq in conn.execute(
+            'SELECT m.morpheme, r.ffr, f.family_size, f.freq, f.hapax_freq '
+            'FROM segms s '
+            'JOIN ranks r ON r.segm_id = s.id '
+            'JOIN morphemes m ON m.id = r.morpheme_id '
+            'JOIN families f ON f.morpheme_id = r.morpheme_id '
+            'WHERE s.segm = ?', (segm,)):
+        found[m] = ffr, family_size, freq, hapax_freq
+
+    parse = parse_segmentation(segm)
+    temp = [len(parse.morphemes), ','.join([str(x) for x in parse.prs]), segm]
+    for m in parse.morphemes:
+        ffr, family_size, freq, hapax_freq = found[m]
+        if family_size == 1:
+            pfmf = 0
+        else:
+            pfmf = ((ffr - 1) / (family_size-1)) * 100
+        if hapax_freq == 0:
+            p, p_star = 0, 0
+        else:
+            p, p_star = hapax_freq / freq, hapax_freq / n_hapax
+        temp.extend([ffr, pfmf, family_size, freq, p, p_star, len(m) - 2])
+    return parse.prs, tuple(temp)
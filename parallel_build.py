@@ -0,0 +1,187 @@
+# !/usr/bin/env python
+#  encoding: utf-8
+
+"""
+Process-pool versions of compute_morphological_variables and
+apply_morpho_vars_to_lex_db.
+
+Finding the morphemes contained in each distinct segmentation, summing the
+families and frequencies of each morpheme, and computing the variables of each
+row are independent tasks. Segmentations and rows are split into contiguous
+chunks, and morphemes into partitions, that are handed to a pool of worker
+processes. Results are merged back in their original order, so the output is
+identical to the single-process one.
+
+The data shared by all tasks (the distinct segmentations with their frequencies
+and the numbered morphemes, or the morpho_vars dict and the rows) is set in this
+process before the pool starts, and inherited by the workers when they are
+forked, without being pickled or copied (see _start_pool). Where processes are
+spawned instead of forked, it is sent once to each worker when the pool starts.
+Tasks only carry chunk boundaries, or the (segmentation, morpheme) pairs of one
+partition, as arrays of numbers.
+"""
+
+from contextlib import contextmanager
+import multiprocessing
+from array import array
+
+from build_morpholex_db import (aggregate_segmentations, get_contained_morphemes,
+                                get_morphemes, get_morpho_vars_from_index,
+                                iter_morpho_vars_rows, sort_family_frequencies)
+
+CHUNKS_PER_WORKER = 4
+
+# Data shared by the tasks of a worker process, set by the pool initializers
+# (in this process when workers are forked)
+_shared = {}
+
+
+def apply_morpho_vars_to_lex_db_parallel(db, morpho_vars, workers):
+    """
+    Same as apply_morpho_vars_to_lex_db, with the rows split across workers
+    processes. db is a sequence of preprocessed rows that can be sliced, such as
+    a list of LexRow or the rows of a snapshot.
+    """
+    # Spawned workers are sent a copy of the rows, which must be picklable
+    rows = db if multiprocessing.get_start_method() == 'fork' else list(db)
+    with _start_pool(workers, _init_apply_worker, (rows, morpho_vars)) as pool:
+        chunks = pool.map(_apply_chunk, get_chunk_bounds(len(rows), workers))
+
+    res = {}
+    for chunk in chunks:
+        for prs, temp in chunk:
+            if prs not in res:
+                res[prs] = []
+            res[prs].append(temp)
+    return res
+
+
+def compute_morphological_variables_parallel(db, hapax_set, workers):
+    """
+    Same as compute_morphological_variables, with the search for the morphemes
+    contained in each distinct segmentation split across workers processes by
+    segmentation, and the families and frequencies of the morphemes summed
+    across them by morpheme.
+    """
+    segm_freqs, segm_hapax_freqs, n_hapax = aggregate_segmentations(db, hapax_set)
+
+    # Morphemes in order of first appearance, as in index_segmentations
+    morpheme_numbers = {}
+    for segm in segm_freqs:
+        for m in get_morphemes(segm):
+            if m not in morpheme_numbers:
+                morpheme_numbers[m] = len(morpheme_numbers)
+    # Morpheme number k belongs to partition k % n_partitions
+    n_partitions = len(get_chunk_bounds(len(morpheme_numbers), workers))
+
+    segms = list(segm_freqs)
+    freqs = [segm_freqs[segm] for segm in segms]
+    hapax_freqs = [segm_hapax_freqs.get(segm, 0) for segm in segms]
+    initargs = (segms, freqs, hapax_freqs, morpheme_numbers, n_partitions)
+    with _start_pool(workers, _init_index_worker, initargs) as pool:
+        contained = [(array('q'), array('q')) for _ in range(n_partitions)]
+        for chunk in pool.map(_index_chunk, get_chunk_bounds(len(segms), workers)):
+            for (segm_numbers, numbers), (chunk_segm_numbers, chunk_numbers) in zip(
+                    contained, chunk):
+                segm_numbers.extend(chunk_segm_numbers)
+                numbers.extend(chunk_numbers)
+        entries = {}
+        for partition_entries in pool.map(_aggregate_partition, contained):
+            entries.update(partition_entries)
+
+    index = {m: entries[m] for m in morpheme_numbers}
+    return get_morpho_vars_from_index(index, n_hapax)
+
+
+def get_chunk_bounds(n_items, workers):
+    """
+    Splits range(n_items) into contiguous (start, end) chunks, a few per worker
+    so that uneven chunks balance out.
+    """
+    if n_items == 0:
+        return []
+    n_chunks = min(n_items, workers * CHUNKS_PER_WORKER)
+    size = -(-n_items // n_chunks)
+    return [(start, min(start + size, n_items)) for start in range(0, n_items, size)]
+
+
+def _aggregate_partition(pairs):
+    """
+    Returns the index_segmentations entries of the morphemes of a partition,
+    from the (SEGM_NUMBERS, MORPHEME_NUMBERS) arrays of its pairs, in the order
+    of the segmentations.
+    """
+    segms, freqs, hapax_freqs = _shared['segms'], _shared['freqs'], _shared['hapax_freqs']
+    morphemes = _shared['morphemes']
+    entries = {}
+    for i, k in zip(*pairs):
+        m = morphemes[k]
+        if m not in entries:
+            entries[m] = {'family': {}, 'hal_freq': 0, 'hapax_freq': 0}
+        entries[m]['family'][segms[i]] = freqs[i]
+        entries[m]['hal_freq'] += freqs[i]
+        entries[m]['hapax_freq'] += hapax_freqs[i]
+    return entries
+
+
+def _apply_chunk(bounds):
+    start, end = bounds
+    return list(iter_morpho_vars_rows(_shared['rows'][start:end],
+                                      _shared['morpho_vars'],
+                                      _shared['sorted_families']))
+
+
+def _index_chunk(bounds):
+    """
+    Returns, for each partition, the (SEGM_NUMBERS, MORPHEME_NUMBERS) arrays of
+    the pairs of a segmentation of the chunk and a morpheme of the partition it
+    contains.
+    """
+    start, end = bounds
+    morpheme_numbers = _shared['morpheme_numbers']
+    n_partitions = _shared['n_partitions']
+    chunk = [(array('q'), array('q')) for _ in range(n_partitions)]
+    for i in range(start, end):
+        for m in get_contained_morphemes(_shared['segms'][i]):
+            k = morpheme_numbers.get(m)
+            if k is not None:
+                segm_numbers, numbers = chunk[k % n_partitions]
+                segm_numbers.append(i)
+                numbers.append(k)
+    return chunk
+
+
+def _init_apply_worker(rows, morpho_vars):
+    _shared['rows'] = rows
+    _shared['morpho_vars'] = morpho_vars
+    _shared['sorted_families'] = sort_family_frequencies(morpho_vars)
+
+
+def _init_index_worker(segms, freqs, hapax_freqs, morpheme_numbers, n_partitions):
+    _shared['segms'] = segms
+    _shared['freqs'] = freqs
+    _shared['hapax_freqs'] = hapax_freqs
+    _shared['morpheme_numbers'] = morpheme_numbers
+    _shared['morphemes'] = list(morpheme_numbers)
+    _shared['n_partitions'] = n_partitions
+
+
+@contextmanager
+def _start_pool(workers, initializer, initargs):
+    """
+    Starts a pool of workers processes whose tasks read the data that
+    initializer(*initargs) sets in _shared. With the fork start method, the
+    data is set in this process before the workers are forked, so they share it
+    instead of each unpickling a copy. Otherwise, initializer runs in each
+    worker.
+    """
+    if multiprocessing.get_start_method() == 'fork':
+        initializer(*initargs)
+        pool = multiprocessing.Pool(workers)
+    else:
+        pool = multiprocessing.Pool(workers, initializer, initargs)
+    try:
+        with pool:
+            yield pool
+    finally:
+        _shared.clear()
@@ -0,0 +1,245 @@
+# !/usr/bin/env python
+#  encoding: utf-8
+
+"""
+Look up the morphological variables of words in a prebuilt MorphoLex index.
+
+The index is built along with the PRS files (build_morpholex_db.py --query-index)
+and saved as a snapshot file (see snapshot.py). MorphoLexIndex memory-maps it,
+so opening it is immediate, and finds a word or an ItemID by binary search over
+presorted keys.
+
+Library use:
+
+    with MorphoLexIndex('output/morpholex_query.index') as index:
+        index.lookup_word('kindness')
+        index.lookup_item('12345')
+        index.lookup_words(['kindness', 'unkind'])
+
+Command line use:
+
+    python query_morpholex.py output/morpholex_query.index kindness unkind
+    python query_morpholex.py output/morpholex_query.index --server
+
+In server mode, each line read on stdin is a JSON request, {"word": "kindness"},
+{"item": "12345"} or {"words": [...]}, and the answer is written as a single
+JSON line on stdout.
+"""
+
+import argparse
+import json
+import sys
+
+from build_morpholex_db import N_MORPHEME_VARS, get_morphemes
+from snapshot import Snapshot, get_number, write_snapshot
+
+
+class MorphoLexIndex:
+    """
+    Read-only access to a query index file.
+    """
+
+    def __init__(self, filepath):
+        self._snap = Snapshot(filepath)
+        get = self._snap.get
+        self._itemids = get('itemid')
+        self._words = get('word')
+        self._pos = get('pos')
+        self._row_segms = get('segm_id')
+        self._segms = get('segms')
+        self._prs = get('prs')
+        self._segm_offsets = get('segm_offsets')
+        self._occ_morphemes = get('occ_morpheme')
+        self._occ_ffr = get('occ_ffr')
+        self._occ_pfmf = get('occ_pfmf')
+        self._occ_pfmf_is_int = get('occ_pfmf_is_int')
+        self._morphemes = get('morphemes')
+        self._fam_sizes = get('fam_size')
+        self._freqs = get('freq')
+        self._ps = get('p')
+        self._p_is_int = get('p_is_int')
+        self._p_stars = get('p_star')
+        self._p_star_is_int = get('p_star_is_int')
+        self._word_order = get('word_order')
+        self._itemid_order = get('itemid_order')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        # Views on the memory map must be released before it can be closed
+        for name in list(vars(self)):
+            if name != '_snap':
+                delattr(self, name)
+        self._snap.close()
+
+    def get_entry(self, row):
+        """
+        Returns the data of the given row of the index as a dict.
+        """
+        segm_id = self._row_segms[row]
+        start, end = self._segm_offsets[segm_id], self._segm_offsets[segm_id+1]
+        morphemes = []
+        for occ in range(start, end):
+            m = self._occ_morphemes[occ]
+            morpheme = self._morphemes[m]
+            morphemes.append({'Morpheme': morpheme,
+                              'FFR': self._occ_ffr[occ],
+                              'PFMF': get_number(self._occ_pfmf, self._occ_pfmf_is_int, occ),
+                              'FamSize': self._fam_sizes[m],
+                              'Freq_HAL': self._freqs[m],
+                              'P': get_number(self._ps, self._p_is_int, m),
+                              'P*': get_number(self._p_stars, self._p_star_is_int, m),
+                              'length': len(morpheme) - 2})
+        return {'ELP_ItemID': self._itemids[row],
+                'Word': self._words[row],
+                'POS': self._pos[row],
+                'PRS_signature': self._prs[segm_id],
+                'MorphoLexSegm': self._segms[segm_id],
+                'morphemes': morphemes}
+
+    def lookup_item(self, itemid):
+        """
+        Returns the entry of the given ELP ItemID, or None.
+        """
+        rows = _search(self._itemids, self._itemid_order, itemid)
+        return self.get_entry(rows[0]) if rows else None
+
+    def lookup_word(self, word):
+        """
+        Returns the list of entries of the given word (empty if the word is not
+        in the index).
+        """
+        return [self.get_entry(row) for row in _search(self._words, self._word_order, word)]
+
+    def lookup_words(self, words):
+        """
+        Returns a dict {WORD: [entries]} for a batch of words.
+        """
+        return {word: self.lookup_word(word) for word in words}
+
+
+def build_query_index(filepath, prs_rows):
+    """
+    Saves a query index to filepath from (PRS_signature, lexical_data) pairs,
+    as generated by iter_morpho_vars_rows.
+    """
+    itemids, words, poss, row_segms = [], [], [], []
+    segms = {}
+    prs_strings = []
+    segm_offsets = [0]
+    occ_morphemes, occ_ffr, occ_pfmf = [], [], []
+    morphemes = {}
+    fam_sizes, freqs, ps, p_stars = [], [], [], []
+
+    for _, row in prs_rows:
+        segm = row[5]
+        if segm not in segms:
+            segms[segm] = len(segms)
+            prs_strings.append(row[4])
+            for i, m in enumerate(get_morphemes(segm)):
+                ffr, pfmf, fam_size, freq, p, p_star, _ = \
+                    row[6 + i*N_MORPHEME_VARS:6 + (i+1)*N_MORPHEME_VARS]
+                if m not in morphemes:
+                    morphemes[m] = len(morphemes)
+                    fam_sizes.append(fam_size)
+                    freqs.append(freq)
+                    ps.append(p)
+                    p_stars.append(p_star)
+                occ_morphemes.append(morphemes[m])
+                occ_ffr.append(ffr)
+                occ_pfmf.append(pfmf)
+            segm_offsets.append(len(occ_morphemes))
+        itemids.append(row[0])
+        words.append(row[1])
+        poss.append(row[2])
+        row_segms.append(segms[segm])
+
+    sections = {
+        'itemid': ('s', itemids),
+        'word': ('s', words),
+        'pos': ('s', poss),
+        'segm_id': ('q', row_segms),
+        'segms': ('s', list(segms)),
+        'prs': ('s', prs_strings),
+        'segm_offsets': ('q', segm_offsets),
+        'occ_morpheme': ('q', occ_morphemes),
+        'occ_ffr': ('q', occ_ffr),
+        'occ_pfmf': ('d', occ_pfmf),
+        'occ_pfmf_is_int': ('b', [isinstance(x, int) for x in occ_pfmf]),
+        'morphemes': ('s', list(morphemes)),
+        'fam_size': ('q', fam_sizes),
+        'freq': ('q', freqs),
+        'p': ('d', ps),
+        'p_is_int': ('b', [isinstance(x, int) for x in ps]),
+        'p_star': ('d', p_stars),
+        'p_star_is_int': ('b', [isinstance(x, int) for x in p_stars]),
+        'word_order': ('q', sorted(range(len(words)), key=words.__getitem__)),
+        'itemid_order': ('q', sorted(range(len(itemids)), key=itemids.__getitem__)),
+    }
+    write_snapshot(filepath, {'kind': 'query_index'}, sections)
+
+
+def serve(index, infile=sys.stdin, outfile=sys.stdout):
+    """
+    Answers JSON-lines requests read from infile until it is closed.
+    """
+    for line in infile:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+            if 'word' in request:
+                response = index.lookup_word(request['word'])
+            elif 'item' in request:
+                response = index.lookup_item(request['item'])
+            elif 'words' in request:
+                response = index.lookup_words(request['words'])
+            else:
+                response = {'error': 'expected one of "word", "item" or "words"'}
+        except (ValueError, TypeError) as e:
+            response = {'error': str(e)}
+        outfile.write(json.dumps(response) + '\n')
+        outfile.flush()
+
+
+def _search(keys, order, key):
+    """
+    Returns the rows whose key equals key, given the order of rows sorted by key.
+    """
+    lo, hi = 0, len(order)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if keys[order[mid]] < key:
+            lo = mid + 1
+        else:
+            hi = mid
+    rows = []
+    while lo < len(order) and keys[order[lo]] == key:
+        rows.append(order[lo])
+        lo += 1
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Look up words in a MorphoLex query index.')
+    parser.add_argument('index', help='path to the query index file')
+    parser.add_argument('words', nargs='*', help='words to look up')
+    parser.add_argument('--items', action='store_true',
+                        help='look up ELP ItemIDs instead of words')
+    parser.add_argument('--server', action='store_true',
+                        help='answer JSON-lines requests on stdin')
+    args = parser.parse_intermixed_args()
+
+    with MorphoLexIndex(args.index) as index:
+        if args.server:
+            serve(index)
+        else:
+            for key in args.words:
+                if args.items:
+                    print(json.dumps(index.lookup_item(key)))
+                else:
+                    print(json.dumps(index.lookup_word(key)))
@@ -0,0 +1,123 @@
+# !/usr/bin/env python
+#  encoding: utf-8
+
+"""
+Score novel words and pseudo-words against the morphological families of the
+database, without rebuilding it.
+
+SegmentationScorer.score computes the variables that apply_morpho_vars_to_lex_db
+would emit for a segmentation with the given frequencies, if a row with that
+segmentation had been added to the database:
+
+- the families of its morphemes get a new member (or, if the segmentation is
+  already in the database, the frequency of that member goes up)
+- the summed frequencies of its morphemes go up
+- if the new row belongs to the hapax set, the hapax frequencies of its
+  morphemes and the size of the hapax set go up, which changes P and P*
+
+Families are only updated virtually: the family sizes and frequencies of the
+morphemes are read once, when the scorer is created, and FFR and PFMF are found
+by binary search in the sorted family frequencies of the real database, so each
+call costs O(morphemes * log(family size)).
+
+Morphemes that are not in the database are given a family made of the new row
+only.
+"""
+
+import argparse
+import json
+
+from build_morpholex_db import (DB_HAL_FREQ_COL, DB_PATH, DB_SBTL_FREQ_COL, SNAPSHOT_PATH,
+                                count_family_more_frequent, is_hapax)
+from segm_parser import parse_segmentation
+
+
+class SegmentationScorer:
+    """
+    Scores segmentations against the morpheme index of a build (see
+    index_segmentations). n_hapax is the size of the hapax set of that build.
+    """
+
+    def __init__(self, index, n_hapax):
+        self.index = index
+        self.n_hapax = n_hapax
+        # Each family is read once here, so that scoring never rebuilds one (a
+        # SnapshotIndex decodes the whole family of a morpheme on every access)
+        self.sorted_families = {}
+        # {MORPHEME: (FAMILY_SIZE, HAL_FREQ, HAPAX_FREQ)}
+        self.morpheme_vars = {}
+        # {SEGM: HAL_FREQUENCY} of every segmentation of the database
+        self.segm_freqs = {}
+        for m, entry in index.items():
+            family = entry['family']
+            self.sorted_families[m] = sorted(family.values())
+            self.morpheme_vars[m] = (len(family), entry['hal_freq'], entry['hapax_freq'])
+            self.segm_freqs.update(family)
+
+    def score(self, segm, hal_freq, sbtl_freq=None):
+        """
+        Returns the columns of the PRS files that follow POS for a new row with
+        the given segmentation and frequencies: number of morphemes, PRS
+        signature, segmentation, then FFR, PFMF, family size, frequency, P, P*
+        and length for each morpheme.
+        A missing SUBTLEX frequency counts as 0, as NULL values do in
+        preprocess_db.
+        """
+        if sbtl_freq is None:
+            sbtl_freq = 0
+        hapax = is_hapax({DB_HAL_FREQ_COL: hal_freq, DB_SBTL_FREQ_COL: sbtl_freq})
+        n_hapax = self.n_hapax + 1 if hapax else self.n_hapax
+
+        parse = parse_segmentation(segm)
+        res = [len(parse.morphemes), ','.join([str(x) for x in parse.prs]), segm]
+        if not parse.morphemes:
+            return res
+
+        # Frequency of the segmentation once the new row is added
+        old_freq = self.segm_freqs.get(segm)
+        word_freq = hal_freq if old_freq is None else old_freq + hal_freq
+
+        for m in parse.morphemes:
+            m_vars = self.morpheme_vars.get(m)
+            if m_vars is not None:
+                family_size, freq, hapax_freq = m_vars
+                n_more_freq = count_family_more_frequent(word_freq, self.sorted_families[m])
+                if old_freq is None:
+                    family_size += 1
+                freq += hal_freq
+            else:
+                n_more_freq = 0
+                family_size = 1
+                freq = hal_freq
+                hapax_freq = 0
+            if hapax:
+                hapax_freq += hal_freq
+
+            if family_size == 1:
+                pfmf = 0
+            else:
+                pfmf = (n_more_freq / (family_size-1)) * 100
+            if hapax_freq == 0:
+                p, p_star = 0, 0
+            else:
+                p, p_star = hapax_freq / freq, hapax_freq / n_hapax
+            res.extend([n_more_freq + 1, pfmf, family_size, freq, p, p_star, len(m) - 2])
+        return res
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Score a segmentation against the families of the database.')
+    parser.add_argument('segm', help='segmentation, e.g. "<un<(kind)>ness>"')
+    parser.add_argument('hal_freq', type=int, help='HAL frequency of the new item')
+    parser.add_argument('--sbtl', type=float, default=None,
+                        help='SUBTLEX frequency of the new item')
+    args = parser.parse_args()
+
+    from snapshot import get_build_fingerprint, load_build_snapshot
+    snapshot = load_build_snapshot(SNAPSHOT_PATH, get_build_fingerprint(DB_PATH))
+    if snapshot is None:
+        raise SystemExit('No up-to-date snapshot: run build_morpholex_db.py --cache first')
+    _, index, n_hapax = snapshot
+    scorer = SegmentationScorer(index, n_hapax)
+    print(json.dumps(scorer.score(args.segm, args.hal_freq, args.sbtl)))
@@ -0,0 +1,93 @@
+# !/usr/bin/env python
+#  encoding: utf-8
+
+"""
+Parser for MorphoLex segmentation strings, shared by build_morpholex_db.py and
+utilities/fix_segmentation.py.
+
+Many rows of the database share the same segmentation, and every stage of the
+build needs its morphemes. parse_segmentation tokenizes each distinct
+segmentation once and keeps the result in a bounded LRU cache. A parse holds:
+
+- the morphemes, as interned strings, in order of appearance
+- their integer IDs (see get_morpheme_id)
+- their roles: PREFIX, ROOT or SUFFIX, given by their opening bracket
+- the PRS signature of the segmentation
+
+Stages that look up per-morpheme data for every segmentation key it by the
+IDs, so they compare integers rather than morpheme strings.
+
+get_morphs_by_role is the cached counterpart used by the allomorph merging step
+of fix_segmentation.py.
+"""
+
+from collections import namedtuple
+from functools import lru_cache
+import re
+import sys
+
+PARSE_CACHE_SIZE = 2**17
+PREFIX, ROOT, SUFFIX = 0, 1, 2
+ROLE_NAMES = ('prefix', 'root', 'suffix')
+BRACKET_ROLES = {'<': PREFIX, '(': ROOT, '>': SUFFIX}
+MORPHEME_RE = re.compile(r'[<>(][^><)]+?[<>)]')
+PREFIX_RE = re.compile(r'<(\w+)<')
+ROOT_RE = re.compile(r'\((\w+)\)')
+SUFFIX_RE = re.compile(r'>(\w+)>')
+
+Parse = namedtuple('Parse', ['morphemes', 'ids', 'roles', 'prs'])
+
+# The ID table only holds the morphemes of parsed segmentations, so it is
+# bounded by the size of the morpheme vocabulary
+_morpheme_ids = {}
+_morphemes = []
+
+
+def get_morpheme(morpheme_id):
+    """
+    Returns the morpheme string with the given ID.
+    """
+    return _morphemes[morpheme_id]
+
+
+def get_morpheme_id(morpheme):
+    """
+    Returns the integer ID of morpheme, assigning the next free ID to morphemes
+    seen for the first time. IDs are only valid within a process.
+    """
+    try:
+        return _morpheme_ids[morpheme]
+    except KeyError:
+        morpheme = sys.intern(morpheme)
+        _morpheme_ids[morpheme] = len(_morphemes)
+        _morphemes.append(morpheme)
+        return _morpheme_ids[morpheme]
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def get_morphs_by_role(segm):
+    """
+    Returns three tuples with the bare spellings (without brackets) of the
+    prefixes, roots and suffixes of segm that are made of word characters only.
+
+    Unlike parse_segmentation, each role is matched on its own: in malformed
+    segmentations such as <p<re<<re(brachyo), a morpheme token may swallow the
+    brackets of the next one, which these patterns still find.
+    """
+    return (tuple(PREFIX_RE.findall(segm)),
+            tuple(ROOT_RE.findall(segm)),
+            tuple(SUFFIX_RE.findall(segm)))
+
+
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_segmentation(segm):
+    """
+    Tokenizes segm in a single pass and returns a Parse. Results are cached, so
+    callers must not mutate them.
+    """
+    morphemes = tuple([sys.intern(m) for m in MORPHEME_RE.findall(segm)])
+    ids = tuple([get_morpheme_id(m) for m in morphemes])
+    roles = tuple([BRACKET_ROLES[m[0]] for m in morphemes])
+    # Counting brackets (rather than tokens) is the historical definition
+    prs = (int(segm.count('<') / 2), segm.count('('), int(segm.count('>') / 2))
+    return Parse(morphemes, ids, roles, prs)
@@ -0,0 +1,319 @@
+# !/usr/bin/env python
+#  encoding: utf-8
+
+"""
+On-disk snapshot of the preprocessed database and of the morpheme index.
+
+A snapshot file holds a small JSON header followed by flat binary sections:
+integer and float arrays, and string columns (a UTF-8 blob plus an array of
+offsets). Sections are read through a memory map, so opening a snapshot costs
+almost nothing and values are only decoded when they are accessed.
+
+save_build_snapshot and load_build_snapshot store what build_morpholex_db.py
+computes before applying the variables to the database. The snapshot is tagged
+with a fingerprint of the input CSV, the hapax thresholds and the code that
+computes the data (see get_build_fingerprint): a snapshot whose fingerprint
+doesn't match is ignored. Only the code that reads, preprocesses and indexes the
+database is fingerprinted, so changes to the output stages (headers, writers)
+don't invalidate the snapshot.
+
+load_build_snapshot doesn't decode the snapshot: rows and index entries are
+built from the memory map when they are accessed (see SnapshotRows and
+SnapshotIndex).
+"""
+
+from array import array
+from collections.abc import Mapping, Sequence
+import hashlib
+import inspect
+import json
+import mmap
+import os
+import struct
+
+import build_morpholex_db as bmd
+from columnar_db import StringColumn
+
+MAGIC = b'MLXSNAP1'
+SNAPSHOT_VERSION = 1
+# Source files whose content is part of the fingerprint
+FINGERPRINTED_SOURCES = ('segm_parser.py', 'snapshot.py')
+# Functions and classes of build_morpholex_db.py whose source code is part of
+# the fingerprint: everything the snapshot is computed with
+FINGERPRINTED_CODE = ('LexRow', 'aggregate_corpus_segmentations', 'aggregate_segmentations',
+                      'get_contained_morphemes', 'get_morphemes', 'index_segmentations',
+                      'is_hapax', 'preprocess_db', 'stream_lexical_db')
+
+
+class Snapshot:
+    """
+    Read-only, memory-mapped view of a snapshot file.
+    """
+
+    def __init__(self, filepath):
+        self._file = open(filepath, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file
+            self._file.close()
+            raise ValueError('%s is not a snapshot file' % filepath)
+        if self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError('%s is not a snapshot file' % filepath)
+        header_length, = struct.unpack_from('<Q', self._map, len(MAGIC))
+        start = len(MAGIC) + 8
+        header = json.loads(self._map[start:start + header_length].decode('utf-8'))
+        self.header = header['header']
+        self._sections = header['sections']
+        self._data_start = _align(start + header_length)
+        self._view = memoryview(self._map)
+
+    def __contains__(self, name):
+        return name in self._sections
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if getattr(self, '_view', None) is not None:
+            self._view.release()
+            self._view = None
+        self._map.close()
+        self._file.close()
+
+    def get(self, name):
+        """
+        Returns an integer or float section as a memoryview, or a string section
+        as a StringColumn.
+        """
+        kind, offset, length = self._sections[name]
+        if kind == 's':
+            return StringColumn(self.get(name + '/offsets'), self._raw(name + '/blob'))
+        start = self._data_start + offset
+        return self._view[start:start + length].cast(kind)
+
+    def _raw(self, name):
+        _, offset, length = self._sections[name]
+        start = self._data_start + offset
+        return self._view[start:start + length]
+
+
+class SnapshotIndex(Mapping):
+    """
+    Read-only mapping {MORPHEME: entry} over the morpheme index of a build
+    snapshot, where entry is a dict like those of index_segmentations, built
+    when it is accessed.
+    """
+
+    def __init__(self, snap):
+        self._morphemes = snap.get('morphemes')
+        self._hal_freqs = snap.get('hal_freqs')
+        self._hapax_freqs = snap.get('hapax_freqs')
+        self._offsets = snap.get('family_offsets')
+        self._members = snap.get('family_members')
+        self._segms = snap.get('segms')
+        self._segm_freqs = snap.get('segm_freqs')
+        self._positions = None
+
+    def __getitem__(self, morpheme):
+        if self._positions is None:
+            self._positions = {m: i for i, m in enumerate(self._morphemes)}
+        i = self._positions[morpheme]
+        family = {self._segms[s]: self._segm_freqs[s]
+                  for s in self._members[self._offsets[i]:self._offsets[i+1]]}
+        return {'family': family, 'hal_freq': self._hal_freqs[i],
+                'hapax_freq': self._hapax_freqs[i]}
+
+    def __iter__(self):
+        return iter(self._morphemes)
+
+    def __len__(self):
+        return len(self._morphemes)
+
+
+class SnapshotRows(Sequence):
+    """
+    Read-only sequence of the preprocessed rows of a build snapshot, as LexRow
+    built when they are accessed.
+    """
+
+    def __init__(self, snap):
+        self._itemids = snap.get('itemid')
+        self._words = snap.get('word')
+        self._pos = snap.get('pos')
+        self._hal_freqs = snap.get('hal_freq')
+        self._sbtl_freqs = snap.get('sbtl_freq')
+        self._sbtl_is_int = snap.get('sbtl_is_int')
+        self._segm_ids = snap.get('segm_id')
+        self._segms = snap.get('segms')
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[k] for k in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        sbtl_freq = self._sbtl_freqs[i]
+        # SUBTLEX frequencies were ints when the column was NULL
+        if self._sbtl_is_int[i]:
+            sbtl_freq = int(sbtl_freq)
+        return bmd.LexRow(self._itemids[i], self._words[i], self._pos[i],
+                          self._hal_freqs[i], sbtl_freq, self._segms[self._segm_ids[i]])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __len__(self):
+        return len(self._segm_ids)
+
+
+def get_build_fingerprint(db_path):
+    """
+    Returns a hash of the input CSV, of the hapax thresholds and columns used by
+    the build, and of the source code that computes the snapshot.
+    """
+    h = hashlib.sha1()
+    h.update(get_code_fingerprint(FINGERPRINTED_SOURCES).encode())
+    with open(db_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def get_code_fingerprint(sources):
+    """
+    Returns a hash of the hapax thresholds and columns used by the build, of
+    the functions of FINGERPRINTED_CODE and of the given source files (names of
+    files next to this one).
+    """
+    h = hashlib.sha1()
+    h.update(repr((SNAPSHOT_VERSION,
+                   bmd.HAPAX_SBTL_FREQ_THRESHOLD, bmd.HAPAX_HAL_FREQ_THRESHOLD,
+                   bmd.STREAM_COLS)).encode())
+    code_dir = os.path.dirname(os.path.abspath(__file__))
+    for filename in sources:
+        with open(os.path.join(code_dir, filename), 'rb') as f:
+            h.update(f.read())
+    for name in FINGERPRINTED_CODE:
+        h.update(inspect.getsource(getattr(bmd, name)).encode())
+    return h.hexdigest()
+
+
+def get_number(values, is_int, i):
+    """
+    Returns values[i], a float section, as an int if is_int[i] is set, so that
+    numbers that were ints when the snapshot was written (such as the zeros of
+    P and P*) are read back as they are written in the PRS files.
+    """
+    return int(values[i]) if is_int[i] else values[i]
+
+
+def load_build_snapshot(filepath, fingerprint):
+    """
+    Returns (db, index, n_hapax) as saved by save_build_snapshot, or None if
+    there is no snapshot at filepath or if its fingerprint doesn't match.
+    db is a sequence of preprocessed rows (LexRow), as generated by
+    stream_lexical_db, and index a mapping with the entries of
+    index_segmentations. Both read the snapshot lazily, which stays open as long
+    as they are in use.
+    """
+    if not os.path.exists(filepath):
+        return None
+    try:
+        snap = Snapshot(filepath)
+    except (ValueError, struct.error):
+        return None
+    if snap.header.get('fingerprint') != fingerprint:
+        snap.close()
+        return None
+    return SnapshotRows(snap), SnapshotIndex(snap), snap.header['n_hapax']
+
+
+def save_build_snapshot(filepath, fingerprint, db, index, n_hapax):
+    """
+    Saves the preprocessed rows of db and the morpheme index to filepath.
+    """
+    segm_ids = {}
+    for row in db:
+        if row[bmd.DB_SEGM_COL] not in segm_ids:
+            segm_ids[row[bmd.DB_SEGM_COL]] = len(segm_ids)
+    segm_freqs = [0] * len(segm_ids)
+    for row in db:
+        segm_freqs[segm_ids[row[bmd.DB_SEGM_COL]]] += row[bmd.DB_HAL_FREQ_COL]
+
+    offsets = [0]
+    members = []
+    for entry in index.values():
+        members.extend([segm_ids[s] for s in entry['family']])
+        offsets.append(len(members))
+
+    sections = {
+        'itemid': ('s', [row[bmd.DB_ITEMID_COL] for row in db]),
+        'word': ('s', [row[bmd.DB_WORD_COL] for row in db]),
+        'pos': ('s', [row[bmd.DB_POS_COL] for row in db]),
+        'hal_freq': ('q', [row[bmd.DB_HAL_FREQ_COL] for row in db]),
+        'sbtl_freq': ('d', [row[bmd.DB_SBTL_FREQ_COL] for row in db]),
+        'sbtl_is_int': ('b', [isinstance(row[bmd.DB_SBTL_FREQ_COL], int) for row in db]),
+        'segm_id': ('q', [segm_ids[row[bmd.DB_SEGM_COL]] for row in db]),
+        'segms': ('s', list(segm_ids)),
+        'segm_freqs': ('q', segm_freqs),
+        'morphemes': ('s', list(index)),
+        'hal_freqs': ('q', [entry['hal_freq'] for entry in index.values()]),
+        'hapax_freqs': ('q', [entry['hapax_freq'] for entry in index.values()]),
+        'family_offsets': ('q', offsets),
+        'family_members': ('q', members),
+    }
+    write_snapshot(filepath, {'fingerprint': fingerprint, 'n_hapax': n_hapax}, sections)
+
+
+def write_snapshot(filepath, header, sections):
+    """
+    Writes a snapshot file. header is a JSON-serializable dict, and sections a
+    dict {NAME: (KIND, VALUES)}, where KIND is an array typecode ('q' for
+    integers, 'd' for floats, 'b' for booleans) or 's' for a list of strings.
+    The file is written under a temporary name first, so that a crash never
+    leaves a truncated snapshot behind.
+    """
+    layout = {}
+    chunks = []
+    offset = 0
+
+    def add(name, kind, data):
+        nonlocal offset
+        layout[name] = [kind, offset, len(data)]
+        padding = b'\0' * (_align(len(data)) - len(data))
+        chunks.extend([data, padding])
+        offset += len(data) + len(padding)
+
+    for name, (kind, values) in sections.items():
+        if kind == 's':
+            encoded = [x.encode('utf-8') for x in values]
+            string_offsets = array('q', [0])
+            for x in encoded:
+                string_offsets.append(string_offsets[-1] + len(x))
+            layout[name] = ['s', None, len(encoded)]
+            add(name + '/offsets', 'q', string_offsets.tobytes())
+            add(name + '/blob', 'B', b''.join(encoded))
+        else:
+            add(name, kind, array(kind, values).tobytes())
+
+    header_bytes = json.dumps({'header': header, 'sections': layout}).encode('utf-8')
+    start = len(MAGIC) + 8 + len(header_bytes)
+    os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+    tmp_filepath = filepath + '.tmp'
+    with open(tmp_filepath, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        f.write(b'\0' * (_align(start) - start))
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(tmp_filepath, filepath)
+
+
+def _align(n):
+    return (n + 7) // 8 * 8
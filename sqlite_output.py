@@ -0,0 +1,127 @@
+# !/usr/bin/env python
+#  encoding: utf-8
+
+"""
+SQLite output of the MorphoLex database, as an alternative to one CSV file per
+PRS signature.
+
+The database has three tables:
+
+- words: one row per item of the lexical database (ELP ItemID, word, POS,
+  number of morphemes, PRS signature and segmentation)
+- morphemes: the variables of each morpheme (length, family size, summed HAL
+  frequency, P and P*)
+- word_morphemes: links each word to its morphemes, in order, with the FFR and
+  PFMF of the morpheme for that word
+
+Example query, all words containing >ity> in a family of more than 20 words:
+
+    SELECT w.word FROM words w
+    JOIN word_morphemes wm ON wm.word_id = w.id
+    JOIN morphemes m ON m.id = wm.morpheme_id
+    WHERE m.morpheme = '>ity>' AND m.family_size > 20;
+"""
+
+import os
+import sqlite3
+
+from build_morpholex_db import N_MORPHEME_VARS, get_morphemes
+
+# Number of words (and of their word_morphemes rows) inserted at a time, so that
+# a stream of rows is never held in memory
+INSERT_BATCH_SIZE = 10000
+
+SCHEMA = """
+CREATE TABLE words (
+    id INTEGER PRIMARY KEY,
+    item_id TEXT,
+    word TEXT,
+    pos TEXT,
+    n_morph INTEGER,
+    prs_signature TEXT,
+    segm TEXT
+);
+CREATE TABLE morphemes (
+    id INTEGER PRIMARY KEY,
+    morpheme TEXT,
+    length INTEGER,
+    family_size INTEGER,
+    freq INTEGER,
+    p REAL,
+    p_star REAL
+);
+CREATE TABLE word_morphemes (
+    word_id INTEGER,
+    position INTEGER,
+    morpheme_id INTEGER,
+    ffr INTEGER,
+    pfmf REAL,
+    PRIMARY KEY (word_id, position)
+) WITHOUT ROWID;
+"""
+
+# Indexes are created after the bulk insert, which is faster than updating them
+# row by row
+INDEXES = """
+CREATE INDEX words_word ON words (word);
+CREATE INDEX words_item_id ON words (item_id);
+CREATE INDEX words_prs_signature ON words (prs_signature);
+CREATE UNIQUE INDEX morphemes_morpheme ON morphemes (morpheme);
+CREATE INDEX word_morphemes_morpheme_id ON word_morphemes (morpheme_id);
+"""
+
+
+def save_to_sqlite(filepath, prs_rows, morpho_vars):
+    """
+    Saves (PRS_signature, lexical_data) pairs, as generated by
+    iter_morpho_vars_rows, and the morphological variables of every morpheme
+    to a new SQLite database at filepath. prs_rows can be a stream.
+    The database is written under a temporary name first and replaces any
+    existing file at filepath once complete.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(filepath)), exist_ok=True)
+    tmp_filepath = filepath + '.tmp'
+    if os.path.exists(tmp_filepath):
+        os.remove(tmp_filepath)
+
+    conn = sqlite3.connect(tmp_filepath)
+    try:
+        # The file is only kept if everything went well, so there is no point
+        # in journaling
+        conn.execute('PRAGMA journal_mode = OFF')
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.executescript(SCHEMA)
+        # A single transaction for the bulk insert
+        with conn:
+            morpheme_ids = {m: i for i, m in enumerate(sorted(morpho_vars), 1)}
+            conn.executemany('INSERT INTO morphemes VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             ((morpheme_ids[m], m, d['length'], d['family_size'],
+                               d['hal_freq'], d['hal_p'], d['hal_p*'])
+                              for m, d in morpho_vars.items()))
+            for words, links in _iter_word_batches(prs_rows, morpheme_ids):
+                conn.executemany('INSERT INTO words VALUES (?, ?, ?, ?, ?, ?, ?)', words)
+                conn.executemany('INSERT INTO word_morphemes VALUES (?, ?, ?, ?, ?)', links)
+        conn.executescript(INDEXES)
+        conn.execute('ANALYZE')
+    finally:
+        conn.close()
+    os.replace(tmp_filepath, filepath)
+
+
+def _iter_word_batches(prs_rows, morpheme_ids):
+    """
+    Generates (words, links) pairs of lists of rows of the words and
+    word_morphemes tables, INSERT_BATCH_SIZE words at a time.
+    """
+    words, links = [], []
+    for word_id, (_, row) in enumerate(prs_rows, 1):
+        segm = row[5]
+        for i, m in enumerate(get_morphemes(segm)):
+            ffr, pfmf = row[6 + i*N_MORPHEME_VARS:8 + i*N_MORPHEME_VARS]
+            links.append((word_id, i, morpheme_ids[m], ffr, pfmf))
+        words.append((word_id,) + tuple(row[:6]))
+        if len(words) == INSERT_BATCH_SIZE:
+            yield words, links
+            words, links = [], []
+    if words:
+        yield words, links
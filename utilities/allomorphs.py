@@ -0,0 +1,144 @@
+# !/usr/bin/env python
+# encoding: utf-8
+
+"""
+Allomorph canonicalization, used by fix_segmentation.py.
+
+The allomorphs_{prefixes,roots,suffixes}.json files map each canonical morph to
+the list of its allomorphs. load_canonical_forms turns them into reverse lookups
+{allomorph: canonical morph} and caches the result in a pickle file next to the
+sources. The cache is rebuilt whenever the content of a source file changes, so
+the reverse lookups can no longer go stale.
+
+canonicalize replaces each morph of a segmentation by its canonical form. Its
+output is identical to that of replacing the morphs one at a time (see
+_canonicalize_one_by_one), which it falls back to when a morph occurs in an
+unexpected position or when a replacement could feed another one; otherwise the
+whole segmentation is rewritten with a single regex scan.
+
+segm_parser (at the root of the project) must be importable.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import re
+
+from segm_parser import get_morphs_by_role
+
+ALLOMORPH_ROLES = ('prefixes', 'roots', 'suffixes')
+CACHE_FILENAME = '.allomorphs_cache.pickle'
+CACHE_VERSION = 1
+MORPH_RE = re.compile(r'<(\w+)<|\((\w+)\)|>(\w+)>')
+BRACKETS = (('<', '<'), ('(', ')'), ('>', '>'))
+
+
+def build_reverse_lookup(allos):
+    """
+    Takes a dict {"key1":["value1", "value2", ...]} and returns a reverse lookup
+    {"value1":"key1", "value2":"key1"}. When a value is listed under several
+    keys, the last key wins.
+    """
+    reverse = {}
+    for k, values in allos.items():
+        for v in values:
+            reverse[v] = k
+    return reverse
+
+
+def canonicalize(segm, table):
+    """
+    Replaces each prefix, root and suffix of segm by its canonical form, if any.
+    table is a dict {ROLE: reverse_lookup}, as returned by load_canonical_forms.
+    """
+    lookups = [table[role] for role in ALLOMORPH_ROLES]
+    found = get_morphs_by_role(segm)
+
+    for lookup, morphs, (op, cl) in zip(lookups, found, BRACKETS):
+        for m in set(morphs):
+            canonical = lookup.get(m, m)
+            if canonical == m:
+                continue
+            # Every occurrence must be one the pattern found (no overlaps), and
+            # the canonical form must not be rewritten in turn
+            if (count_occurrences(segm, op+m+cl) != morphs.count(m)
+                    or (canonical in morphs and lookup.get(canonical, canonical) != canonical)):
+                return _canonicalize_one_by_one(segm, lookups, found)
+
+    def replace(match):
+        role = match.lastindex - 1
+        op, cl = BRACKETS[role]
+        return op + lookups[role].get(match.group(role + 1), match.group(role + 1)) + cl
+
+    return MORPH_RE.sub(replace, segm)
+
+
+def count_occurrences(s, sub):
+    """
+    Counts the occurrences of sub in s, including overlapping ones.
+    """
+    n = 0
+    i = s.find(sub)
+    while i != -1:
+        n += 1
+        i = s.find(sub, i + 1)
+    return n
+
+
+def get_sources_fingerprint(linguistic_data_dir):
+    """
+    Returns a hash of the content of the allomorph source files.
+    """
+    h = hashlib.sha1(str(CACHE_VERSION).encode())
+    for role in ALLOMORPH_ROLES:
+        with open(os.path.join(linguistic_data_dir, 'allomorphs_%s.json' % role), 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def load_canonical_forms(linguistic_data_dir):
+    """
+    Returns a dict {ROLE: {ALLOMORPH: CANONICAL_MORPH}} for each role in
+    ALLOMORPH_ROLES, built from the allomorphs_*.json files of
+    linguistic_data_dir, or read from the cache if those didn't change.
+    """
+    fingerprint = get_sources_fingerprint(linguistic_data_dir)
+    cache_fp = os.path.join(linguistic_data_dir, CACHE_FILENAME)
+    try:
+        with open(cache_fp, 'rb') as f:
+            cached = pickle.load(f)
+        if cached['fingerprint'] == fingerprint:
+            return cached['table']
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError):
+        pass
+
+    table = {}
+    for role in ALLOMORPH_ROLES:
+        with open(os.path.join(linguistic_data_dir, 'allomorphs_%s.json' % role)) as f:
+            table[role] = build_reverse_lookup(json.load(f))
+    try:
+        with open(cache_fp, 'wb') as f:
+            pickle.dump({'fingerprint': fingerprint, 'table': table}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        pass  # Read-only data directory: work without a cache
+    return table
+
+
+def _canonicalize_one_by_one(segm, lookups, found):
+    allo_prefs, allo_roots, allo_suffs = lookups
+    prefs, rts, suffs = found
+    for p in prefs:
+        if p in allo_prefs:
+            segm = segm.replace('<'+p+'<', '<'+allo_prefs[p]+'<')
+    for r in rts:
+        if r in allo_roots:
+            segm = segm.replace('('+r+')', '('+allo_roots[r]+')')
+    for s in suffs:
+        if s in allo_suffs:
+            # Replace only the rightmost occurrence
+            i = segm.rfind('>'+s+'>')
+            if i != -1:
+                segm = segm[:i] + '>'+allo_suffs[s]+'>' + segm[i+len(s)+2:]
+    return segm
@@ -2,25 +2,26 @@
 # encoding: utf-8
 
 """
-Takes a json file with {"key1":["value1", "value2", ...]} pairs and outputs
-a reverse lookup {"value1":"key", "value2":"key"}
+Takes the allomorphs_{prefixes,roots,suffixes}.json files, each with
+{"key1":["value1", "value2", ...]} pairs, and outputs the matching
+rev_allomorphs_*.json reverse lookups {"value1":"key", "value2":"key"}.
+
+fix_segmentation.py builds these lookups by itself (see allomorphs.py); the
+JSON files are only kept for other tools.
 """
 
 import json
 import os
+import sys
 
-project_fp = "/home/hugo/Projects/ELP_morpho_vars"
-input_fp = os.path.join(project_fp, "linguistic_data/allomorphs_suffixes.json")
-output_fp = os.path.join(project_fp, "linguistic_data/rev_allomorphs_suffixes.json")
-
-with open(input_fp) as f:
-    allos = json.load(f)
-
-reverse = {}
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from allomorphs import ALLOMORPH_ROLES, load_canonical_forms
 
-for k, values in allos.items():
-    for v in values:
-        reverse[v] = k
+project_fp = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+linguistic_data_fp = os.path.join(project_fp, 'linguistic_data')
 
-with open(output_fp, 'w') as f:
-    json.dump(reverse, f)
+table = load_canonical_forms(linguistic_data_fp)
+for role in ALLOMORPH_ROLES:
+    output_fp = os.path.join(linguistic_data_fp, 'rev_allomorphs_%s.json' % role)
+    with open(output_fp, 'w') as f:
+        json.dump(table[role], f)
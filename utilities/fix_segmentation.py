@@ -41,14 +41,32 @@ Hypo-segmentation:
     marked at the end of this process is merged with its neighboring morphemes
     and forms a root.
 
+Pipeline:
+Phase 1 streams the database once to find the free roots (step 3), the only
+step that needs a view of the whole database. Phase 2 streams it again and
+applies every fix to each row independently, by chunks of CHUNK_SIZE rows. With
+--workers N, the chunks are handed to a pool of N processes, and the results are
+written back in the original row order, so the output (and segm_to_fix.txt) is
+identical to that of a single-process run.
+
+    python utilities/fix_segmentation.py --workers 4
+
 ------------------------------------------
 
 """
 
+import argparse
+from collections import deque
 import csv
-import re
+import multiprocessing
 import os
-import json
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from allomorphs import canonicalize, load_canonical_forms
+from instrumentation import RunReport, progress, start_profiler, stop_profiler
+from segm_annotation import (compile_annotator, find_free_roots,
+                             remove_final_inflection)
 
 
 project_fp = '/home/hugo/Projects/ELP_morpho_vars'
@@ -57,148 +75,179 @@ output_fp = os.path.join(project_fp, 'input/ELP-2016-12-17.csv')
 roots_fp = os.path.join(project_fp, 'linguistic_data/roots.txt')
 non_roots_fp = os.path.join(project_fp, 'linguistic_data/non_roots.txt')
 prefixes_fp = os.path.join(project_fp, 'linguistic_data/prefixes.txt')
-allo_prefs_fp = os.path.join(project_fp, 'linguistic_data/rev_allomorphs_prefixes.json')
-allo_roots_fp = os.path.join(project_fp, 'linguistic_data/rev_allomorphs_roots.json')
-allo_suffs_fp = os.path.join(project_fp, 'linguistic_data/rev_allomorphs_suffixes.json')
-
-def rreplace(s, old, new, count):
-    """ Replaces only the rightmost occurrence of old in string s, count times."""
-    return (s[::-1].replace(old[::-1], new[::-1], count))[::-1]
-
-
-with open(elp_fp) as f:
-    reader = csv.reader(f)
-    h1 = next(reader)  # Keep headers 1 and 2 in separate variables
-    h2 = next(reader)
-    elp = list(reader)   # This is the data, without headers
+report_fp = os.path.join(project_fp, 'input/fix_segmentation_report.json')
+profile_fp = os.path.join(project_fp, 'input/fix_segmentation.pstats')
 
+# 1 is the word
 # 46 is MorphSp
 # 47 is MorphSp_revised
 # 48 is MorphoLexSegm
 # 49 is MorphoLexSegmMerged
-# Copy MorphSp_revised (segmentation) column in new list, we work on that list
-# allo_segm will hold the segmentation where morphs are replaced by their canonical forms
-new_segm = [x[47] for x in elp]
-old_segm = [x[47] for x in elp]
-
-################################################################
-### Apply miscellaneous fixes to erroneous ELP segmentations ###
-################################################################
-
-# 1. Remove non-derivational suffixes: ed/d, ing, s, and contractions like 'll, 's, etc.
-new_segm = [re.sub(r">(ed|d|ing|s|\w*'\w*)>$", '', segm) for segm in new_segm]
-
-### Build the set of roots ###
-free_roots = [re.sub(r'[{}]', '', x) for i,x in enumerate(new_segm)
-              if not re.search(r'([<>-]|\}\{)', x)  # Must be only morpheme in x
-                                                    # ("}{" would mean two roots)
-                 and len(x) > 5                     # Must have more than 3 chars (+2 for {})
-                 and not elp[i][1][0].isupper()]    # Word can't begin with uppercase letter
-
-with open(roots_fp) as f:
-    roots = set(f.read().split('\n'))
-with open(non_roots_fp) as f:
-    non_roots = set(f.read().split('\n'))
-
-roots = roots.union(set(free_roots)) - set(non_roots)
-
-
-### Correctly annotate roots ###
-for i, segm in enumerate(new_segm):
-    rts = [x for x in re.findall(r'[<>{}-](.+?)[<>{}-]', segm) if x in roots]
-    for r in rts:
-        new_segm[i] = new_segm[i].replace(r, '('+r+')')
-
-# Remove affix notation where we changed to root notation
-new_segm = [re.sub(r'[><](\(\w+?\))[><]', r'\1', x) for x in new_segm]
-
-### Correctly annotate prefixes marked as roots ###
-with open(prefixes_fp) as f:
-    prefixes = set(f.read().split('\n'))
-
-for i, segm in enumerate(new_segm):
-    pfs = [x for x in re.findall(r'\{(.+?)\}', segm) 
-           if x in prefixes and segm.count('{') > 1]  
-           # Last condition to ensure there will be a root left (eg not get <up<>er>)
-    for p in pfs:
-        new_segm[i] = new_segm[i].replace('{'+p+'}', '<'+p+'<')
-
-# Annotate suffixes between curly brackets
-for i, segm in enumerate(new_segm):
-    suffs_sequence = ''.join([x[0] for x in re.findall(r'\)((--\w+)*--\w+)', segm)])
-    # Output for {re--anti--pre--(hyster)--ec--tom--y--(other)--stuff}
-    # '--ec--tom--y--stuff'
-    suffs = re.findall(r'--\w+', suffs_sequence)
-    # ['--ec', '--tom', '--y', '--stuff']
-    for suff in suffs:
-        # Take care to replace only last occurrence of suff
-        # (There could be a prefix with the same spelling)
-        new_segm[i] = rreplace(new_segm[i], suff, '>'+suff+'>', 1)
-
-# Annotate prefixes between curly brackets
-for i, segm in enumerate(new_segm):
-    prefs = re.findall(r'(\w+--)(?=[^\)\}]*\()', segm) 
-    # Output for {re--anti--pre--(hyster)--ec--tom--y--(other)--stuff}
-    # ['re--', 'anti--', 'pre--']
-    for pref in prefs:
-        # Take care to replace only first occurrence of pref
-        # (There could be a suffix with the same spelling)
-        new_segm[i] = new_segm[i].replace(pref, '<'+pref+'<', 1)
-
-# Remove dashes
-new_segm = [x.replace('-', '') for x in new_segm]
-
-# Any uninterrupted alphabetic sequence between curly brackets not marked as root
-# must be marked as root
-new_segm = [re.sub(r'\{(\w+)\}', r'{(\1)}', x) for x in new_segm]
-
-# In some cases, inflectional affixes were identified inside words
-# (e.g. >s> in {(sport)>s>(man)}). We now remove those.
-new_segm = [re.sub(r">(ed|d|ing|s|\w*'\w*)>", '', segm) for segm in new_segm]
-
-
-##############################
-### Allomorph merging step ###
-##############################
-
-with open(allo_prefs_fp) as f:
-    allo_prefs = json.load(f)
-with open(allo_roots_fp) as f:
-    allo_roots = json.load(f)
-with open(allo_suffs_fp) as f:
-    allo_suffs = json.load(f)
-
-# Build allomorph-merged segmentations from new_segm
-allo_segm = new_segm[:]
-
-# Replace each morph by its canonical form, if any
-for i, segm in enumerate(new_segm):
-    prefs = re.findall(r'<(\w+)<', segm)
-    rts = re.findall(r'\((\w+)\)', segm)
-    suffs = re.findall(r'>(\w+)>', segm)
-    for p in prefs:
-        if p in allo_prefs:
-            allo_segm[i] = allo_segm[i].replace('<'+p+'<', '<'+allo_prefs[p]+'<')        
-    for r in rts:
-        if r in allo_roots:
-            allo_segm[i] = allo_segm[i].replace('('+r+')', '('+allo_roots[r]+')')
-    for s in suffs:
-        if s in allo_suffs:
-            allo_segm[i] = rreplace(allo_segm[i], '>'+s+'>', '>'+allo_suffs[s]+'>', 1)
-
-# Save elements of new_segm as the 48th column of the ELP database
-for i, segm in enumerate(new_segm):
-    elp[i][48] = segm
-# Save elements of allo_segm as the 49th column of the ELP database
-for i, segm in enumerate(allo_segm):
-    elp[i][49] = segm
-
-with open(output_fp, 'w') as f:
-    writer = csv.writer(f)
-    writer.writerow(h1)
-    writer.writerow(h2)
-    writer.writerows(elp)
-
-with open('segm_to_fix.txt', 'w') as f:
-    for i, _ in enumerate(new_segm):
-        f.write(old_segm[i]+','+new_segm[i]+'\n')
\ No newline at end of file
+WORD_COL = 1
+SEGM_COL = 47
+NEW_SEGM_COL = 48
+ALLO_SEGM_COL = 49
+
+CHUNK_SIZE = 10000
+# Chunks handed to the pool ahead of the one being written, per worker
+PENDING_CHUNKS_PER_WORKER = 2
+
+# Data shared by the chunks of a worker process, set by init_worker
+_shared = {}
+
+
+def find_roots(filepath, chunk_size=CHUNK_SIZE):
+    """
+    Phase 1: returns the set of free roots (see find_free_roots) of the
+    segmentations of the ELP file at filepath, once their final inflections are
+    removed, and the number of rows of the file.
+    """
+    free_roots = set()
+    n_rows = 0
+    with open(filepath) as f:
+        reader = csv.reader(f)
+        next(reader)  # Skip headers (2 rows)
+        next(reader)
+        for chunk in iter_chunks(reader, chunk_size):
+            free_roots.update(find_free_roots(
+                [remove_final_inflection(row[SEGM_COL]) for row in chunk],
+                [row[WORD_COL] for row in chunk]))
+            n_rows += len(chunk)
+    return free_roots, n_rows
+
+
+def fix_chunk(segms):
+    """
+    Phase 2: applies every fix to a list of MorphSp_revised segmentations, and
+    returns the list of fixed segmentations and the list of their
+    allomorph-merged versions. init_worker must have been called in the process.
+    """
+    annotate = _shared['annotate']
+    canonical_forms = _shared['canonical_forms']
+    # 1. Remove non-derivational suffixes: ed/d, ing, s, and contractions like 'll, 's, etc.
+    # 2. Annotate roots, prefixes and suffixes (see segm_annotation.py for the detail
+    #    of each fix)
+    new_segms = [annotate(remove_final_inflection(segm)) for segm in segms]
+    # 3. Replace each morph by its canonical form, if any
+    return new_segms, [canonicalize(segm, canonical_forms) for segm in new_segms]
+
+
+def fix_elp_file(input_fp, output_fp, diff_fp, roots, non_roots, prefixes, canonical_forms,
+                 report, workers=1, chunk_size=CHUNK_SIZE):
+    """
+    Runs both phases on the ELP file at input_fp, and writes the fixed file to
+    output_fp and the (old, new) segmentation pairs to diff_fp. roots, non_roots
+    and prefixes are the sets read from linguistic_data, and canonical_forms is
+    returned by load_canonical_forms. Stages are recorded in report (a
+    RunReport). Returns the number of rows.
+    """
+    ### Phase 1: build the set of roots ###
+    with report.stage('find_free_roots') as stage:
+        free_roots, n_rows = find_roots(input_fp, chunk_size)
+        stage.rows = n_rows
+        stage.counters['free_roots'] = len(free_roots)
+
+    roots = roots.union(free_roots) - non_roots
+
+    ### Phase 2: fix each row, and save the fixed segmentations as columns 48 and 49 ###
+    with report.stage('fix_rows') as stage:
+        with open(input_fp) as f, open(output_fp, 'w') as out, open(diff_fp, 'w') as diff:
+            reader = csv.reader(f)
+            writer = csv.writer(out)
+            writer.writerow(next(reader))  # Copy headers 1 and 2
+            writer.writerow(next(reader))
+            chunks = map_fix_chunk(iter_chunks(reader, chunk_size), workers,
+                                   (roots, prefixes, canonical_forms))
+            for chunk, (new_segms, allo_segms) in progress(chunks, 'fixing chunks',
+                                                           -(-n_rows // chunk_size)):
+                for row, new, allo in zip(chunk, new_segms, allo_segms):
+                    diff.write(row[SEGM_COL]+','+new+'\n')
+                    row[NEW_SEGM_COL] = new
+                    row[ALLO_SEGM_COL] = allo
+                writer.writerows(chunk)
+        stage.rows = n_rows
+        stage.counters['workers'] = workers
+        stage.counters['chunk_size'] = chunk_size
+    return n_rows
+
+
+def load_linguistic_data():
+    """
+    Returns the roots, non-roots and prefixes sets, and the canonical forms of
+    the allomorphs, read from linguistic_data.
+    """
+    with open(roots_fp) as f:
+        roots = set(f.read().split('\n'))
+    with open(non_roots_fp) as f:
+        non_roots = set(f.read().split('\n'))
+    with open(prefixes_fp) as f:
+        prefixes = set(f.read().split('\n'))
+    canonical_forms = load_canonical_forms(os.path.join(project_fp, 'linguistic_data'))
+    return roots, non_roots, prefixes, canonical_forms
+
+
+def init_worker(roots, prefixes, canonical_forms):
+    _shared['annotate'] = compile_annotator(roots, prefixes)
+    _shared['canonical_forms'] = canonical_forms
+
+
+def iter_chunks(rows, chunk_size):
+    """
+    Generates lists of chunk_size consecutive rows (the last one can be shorter).
+    """
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def map_fix_chunk(chunks, workers, initargs):
+    """
+    Generates (chunk, fix_chunk(SEGMENTATIONS_OF_CHUNK)) for each chunk of rows,
+    in order. With more than one worker, the chunks are fixed by a process pool,
+    and at most PENDING_CHUNKS_PER_WORKER chunks per worker are read ahead.
+    """
+    if workers <= 1:
+        init_worker(*initargs)
+        for chunk in chunks:
+            yield chunk, fix_chunk([row[SEGM_COL] for row in chunk])
+        return
+
+    with multiprocessing.Pool(workers, init_worker, initargs) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append((chunk, pool.apply_async(fix_chunk,
+                                                    ([row[SEGM_COL] for row in chunk],))))
+            if len(pending) >= workers * PENDING_CHUNKS_PER_WORKER:
+                chunk, result = pending.popleft()
+                yield chunk, result.get()
+        while pending:
+            chunk, result = pending.popleft()
+            yield chunk, result.get()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fix the segmentations of the ELP.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes fixing the rows')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help='number of rows per task')
+    parser.add_argument('--profile', action='store_true',
+                        help='profile the run with cProfile')
+    args = parser.parse_args()
+    if args.chunk_size < 1:
+        parser.error('--chunk-size must be at least 1')
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+
+    profiler = start_profiler(args.profile)
+    report = RunReport('fix_segmentation')
+    roots, non_roots, prefixes, canonical_forms = load_linguistic_data()
+    fix_elp_file(elp_fp, output_fp, 'segm_to_fix.txt', roots, non_roots, prefixes,
+                 canonical_forms, report, args.workers, args.chunk_size)
+    stop_profiler(profiler, profile_fp)
+    report.save(report_fp)
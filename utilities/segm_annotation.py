@@ -0,0 +1,189 @@
+# !/usr/bin/env python
+# encoding: utf-8
+
+"""
+Annotation engine behind fix_segmentation.py.
+
+Every fix of fix_segmentation.py that only depends on the segmentation itself
+(and on the root and prefix sets) is a function of one string here, so that:
+
+- the script applies all fixes to a row in one go, instead of making a full
+  pass over the database for each fix
+- the fixes can be used as a library, on a single segmentation:
+
+    annotate = compile_annotator(roots, prefixes)
+    annotate('{re--act--ion}')
+
+Only the discovery of free roots (find_free_roots) needs to see the whole
+database.
+
+The output is identical to the historical pass-by-pass script, quirks
+included. In particular, a root found in a segmentation is wrapped in
+parentheses wherever its spelling occurs, and as many times as it was found.
+annotate_roots does this in a single scan of the string when the occurrences of
+the matched roots do not overlap, and falls back to one replacement per root
+otherwise.
+"""
+
+import re
+
+FINAL_INFLECTION_RE = re.compile(r">(ed|d|ing|s|\w*'\w*)>$")
+INFLECTION_RE = re.compile(r">(ed|d|ing|s|\w*'\w*)>")
+ROOT_CANDIDATE_RE = re.compile(r'[<>{}-](.+?)[<>{}-]')
+AFFIXED_ROOT_RE = re.compile(r'[><](\(\w+?\))[><]')
+CURLY_RE = re.compile(r'\{(.+?)\}')
+BARE_CURLY_RE = re.compile(r'\{([^{}]+)\}')
+SUFFIX_SEQUENCE_RE = re.compile(r'\)((--\w+)*--\w+)')
+DASHED_SUFFIX_RE = re.compile(r'--\w+')
+DASHED_PREFIX_RE = re.compile(r'(\w+--)(?=[^\)\}]*\()')
+UNMARKED_ROOT_RE = re.compile(r'\{(\w+)\}')
+
+
+def annotate_dashed_affixes(segm):
+    """
+    Annotates the affixes between curly brackets that are separated by dashes:
+    those on the right of a root are suffixes, those on the left are prefixes.
+    """
+    suffs_sequence = ''.join([x[0] for x in SUFFIX_SEQUENCE_RE.findall(segm)])
+    # Output for {re--anti--pre--(hyster)--ec--tom--y--(other)--stuff}
+    # '--ec--tom--y--stuff'
+    for suff in DASHED_SUFFIX_RE.findall(suffs_sequence):
+        # ['--ec', '--tom', '--y', '--stuff']
+        # Take care to replace only last occurrence of suff
+        # (There could be a prefix with the same spelling)
+        segm = rreplace(segm, suff, '>'+suff+'>', 1)
+
+    for pref in DASHED_PREFIX_RE.findall(segm):
+        # Output for {re--anti--pre--(hyster)--ec--tom--y--(other)--stuff}
+        # ['re--', 'anti--', 'pre--']
+        # Take care to replace only first occurrence of pref
+        # (There could be a suffix with the same spelling)
+        segm = segm.replace(pref, '<'+pref+'<', 1)
+    return segm
+
+
+def annotate_prefixes(segm, prefixes):
+    """
+    Turns {p} into <p< for every p in prefixes, as long as there is another
+    curly bracketed sequence left (eg not get <up<>er>).
+    """
+    if segm.count('{') <= 1:
+        return segm
+    pfs = [x for x in CURLY_RE.findall(segm) if x in prefixes]
+    if not pfs:
+        return segm
+    if any(['{' in p or '}' in p for p in pfs]):
+        for p in pfs:
+            segm = segm.replace('{'+p+'}', '<'+p+'<')
+        return segm
+    # Without nested brackets, the {p} occurrences cannot overlap
+    pfs = set(pfs)
+    return BARE_CURLY_RE.sub(lambda x: '<'+x.group(1)+'<' if x.group(1) in pfs else x.group(0),
+                             segm)
+
+
+def annotate_roots(segm, roots):
+    """
+    Wraps the roots found between delimiters of segm in parentheses, and removes
+    the affix notation around them.
+    """
+    rts = [x for x in ROOT_CANDIDATE_RE.findall(segm) if x in roots]
+    if rts:
+        segm = wrap_roots(segm, rts)
+    return AFFIXED_ROOT_RE.sub(r'\1', segm)
+
+
+def compile_annotator(roots, prefixes):
+    """
+    Returns a function that applies every fix of fix_segmentation.py that
+    follows the removal of final inflections (see remove_final_inflection) to a
+    single segmentation. roots and prefixes are sets of strings.
+    """
+    roots = frozenset(roots)
+    prefixes = frozenset(prefixes)
+    cache = {}
+
+    def annotate(segm):
+        if segm in cache:
+            return cache[segm]
+        new = annotate_roots(segm, roots)
+        new = annotate_prefixes(new, prefixes)
+        new = annotate_dashed_affixes(new)
+        # Remove dashes
+        new = new.replace('-', '')
+        # Any uninterrupted alphabetic sequence between curly brackets not marked
+        # as root must be marked as root
+        new = UNMARKED_ROOT_RE.sub(r'{(\1)}', new)
+        # In some cases, inflectional affixes were identified inside words
+        # (e.g. >s> in {(sport)>s>(man)}). We now remove those.
+        new = INFLECTION_RE.sub('', new)
+        cache[segm] = new
+        return new
+
+    return annotate
+
+
+def find_free_roots(segms, words):
+    """
+    Returns the list of free roots: segmentations made of a single morpheme
+    between curly brackets, longer than 3 characters, of words that don't begin
+    with an uppercase letter (e.g., <e<{vince} isn't good, but caused by {Vince}).
+    """
+    return [re.sub(r'[{}]', '', x) for x, word in zip(segms, words)
+            if not re.search(r'([<>-]|\}\{)', x)  # Must be only morpheme in x
+                                                  # ("}{" would mean two roots)
+               and len(x) > 5                     # Must have more than 3 chars (+2 for {})
+               and not word[0].isupper()]         # Word can't begin with uppercase letter
+
+
+def remove_final_inflection(segm):
+    """
+    Removes a non-derivational suffix at the end of segm: ed/d, ing, s, and
+    contractions like 'll, 's, etc.
+    """
+    return FINAL_INFLECTION_RE.sub('', segm)
+
+
+def rreplace(s, old, new, count):
+    """ Replaces only the rightmost occurrence of old in string s, count times."""
+    if count == 1:
+        i = s.rfind(old)
+        return s if i == -1 else s[:i] + new + s[i+len(old):]
+    return (s[::-1].replace(old[::-1], new[::-1], count))[::-1]
+
+
+def wrap_roots(segm, rts):
+    """
+    Same as calling segm.replace(r, '('+r+')') for each r in rts, in order.
+    """
+    layers = {}
+    for r in rts:
+        layers[r] = layers.get(r, 0) + 1
+    if any(['(' in r or ')' in r for r in layers]):
+        return _wrap_roots_one_by_one(segm, rts)
+
+    spans = []
+    for r, n in layers.items():
+        start = segm.find(r)
+        while start != -1:
+            spans.append((start, start + len(r), n))
+            start = segm.find(r, start + len(r))
+    spans.sort()
+    for (_, end, _), (start, _, _) in zip(spans, spans[1:]):
+        if start < end:
+            # Wrapping a root would hide or split another one
+            return _wrap_roots_one_by_one(segm, rts)
+
+    pieces = []
+    last = 0
+    for start, end, n in spans:
+        pieces.extend([segm[last:start], '('*n, segm[start:end], ')'*n])
+        last = end
+    pieces.append(segm[last:])
+    return ''.join(pieces)
+
+
+def _wrap_roots_one_by_one(segm, rts):
+    for r in rts:
+        segm = segm.replace(r, '('+r+')')
+    return segm